@@ -7,6 +7,7 @@ import streamlit as st
 import sys
 import os
 from pathlib import Path
+from dotenv import load_dotenv
 
 # Add both root and modules directory to Python path
 root_dir = Path(__file__).parent
@@ -14,6 +15,13 @@ modules_dir = root_dir / "modules"
 sys.path.append(str(root_dir))
 sys.path.append(str(modules_dir))
 
+# Modules read their CYPERSONA_* settings at import, so .env has to be loaded first
+load_dotenv()
+
+from llm_cache import get_response_cache
+from persona_assets import load_avatar_library
+from persona_store import get_persona_store
+
 # Import page modules
 try:
     import importlib.util
@@ -62,11 +70,12 @@ def main():
         initial_sidebar_state="expanded"
     )
     
+    # Encode avatar images once per process (no-op on later reruns)
+    load_avatar_library()
+    
     # Initialize session state
     if 'processing_complete' not in st.session_state:
         st.session_state.processing_complete = False
-    if 'generated_personas' not in st.session_state:
-        st.session_state.generated_personas = []
     if 'test_results' not in st.session_state:
         st.session_state.test_results = []
     
@@ -141,8 +150,9 @@ def main():
             st.info("Step 1: Data Processing")
         
         # Step 2 status
-        if st.session_state.generated_personas:
-            st.success(f"✅ Step 2: Personas ({len(st.session_state.generated_personas)})")
+        persona_count = get_persona_store().count()
+        if persona_count:
+            st.success(f"✅ Step 2: Personas ({persona_count})")
         else:
             st.info("Step 2: Persona Generation")
         
@@ -155,14 +165,19 @@ def main():
         st.markdown("---")
         
         # Quick stats
-        if st.session_state.processing_complete or st.session_state.generated_personas:
+        if st.session_state.processing_complete or persona_count:
             st.markdown("### Quick Stats")
             
             col1, col2 = st.columns(2)
             with col1:
-                st.metric("Personas", len(st.session_state.generated_personas))
+                st.metric("Personas", persona_count)
             with col2:
                 st.metric("Tests", len(st.session_state.test_results))
+            
+            llm_cache = get_response_cache()
+            if llm_cache and llm_cache.stats['hits'] + llm_cache.stats['misses']:
+                st.caption(f"LLM cache: {llm_cache.stats['hits']} hits ({llm_cache.hit_rate():.0%}), "
+                           f"{llm_cache.size()} stored responses")
     
     # Main content area
     page = st.session_state.current_page
@@ -203,7 +218,7 @@ def render_overview():
             st.rerun()
     
     with steps_col2:
-        status = "✅" if st.session_state.generated_personas else "⏳" if st.session_state.processing_complete else "⏸️"
+        status = "✅" if get_persona_store().count() else "⏳" if st.session_state.processing_complete else "⏸️"
         st.markdown(f"""
         **{status} Step 2: Persona Generation**
         - Natural language persona creation
@@ -216,7 +231,7 @@ def render_overview():
             st.rerun()
     
     with steps_col3:
-        status = "✅" if st.session_state.test_results else "⏳" if st.session_state.generated_personas else "⏸️"
+        status = "✅" if st.session_state.test_results else "⏳" if get_persona_store().count() else "⏸️"
         st.markdown(f"""
         **{status} Step 3: Intervention Testing**
         - Test security interventions
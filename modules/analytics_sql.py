@@ -0,0 +1,276 @@
+"""
+Embedded analytical SQL layer over ingested datasets
+
+Uploaded datasets are snapshotted to Parquet and registered as DuckDB views, so
+personas and interventions can ask for exact facts ("click rate for Finance
+directors on High-difficulty Financial Request templates after training")
+instead of relying on vector search over prose summaries.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+
+from dataset_schemas import match_schema
+
+ANALYTICS_DIR = Path(".cache/analytics")
+RESULT_CACHE_SIZE = 256
+
+# Only read-only statements reach DuckDB through the public query API
+_READ_ONLY_SQL = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_FORBIDDEN_SQL = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|CREATE|DROP|ALTER|COPY|ATTACH|DETACH|INSTALL|LOAD|PRAGMA|SET|EXPORT|IMPORT|CALL)\b",
+    re.IGNORECASE
+)
+
+KNOWBE4_OUTCOMES = """
+    COUNT(*) AS simulations,
+    AVG(CAST("Clicked" AS DOUBLE)) AS click_rate,
+    AVG(CAST("Reported" AS DOUBLE)) AS report_rate,
+    AVG(CAST("Data Entered" AS DOUBLE)) AS data_entry_rate,
+    MEDIAN("Time to Click (seconds)") AS median_time_to_click
+"""
+
+KNOWBE4_FILTERS = """
+    ($department IS NULL OR "Department" = $department)
+    AND ($title IS NULL OR "Title" = $title)
+    AND ($location IS NULL OR "Location" = $location)
+    AND ($template IS NULL OR "Template" = $template)
+    AND ($difficulty IS NULL OR "Difficulty" = $difficulty)
+    AND ($after_training IS NULL
+         OR ($after_training AND "Previous Training Completed" AND "Sent Date" > "Training Completion Date")
+         -- A missing completion date or flag counts as before training, as in knowbe4_training_effect
+         OR (NOT $after_training
+             AND NOT COALESCE("Previous Training Completed" AND "Sent Date" > "Training Completion Date", FALSE)))
+"""
+
+KNOWBE4_FILTER_PARAMS = ['department', 'title', 'location', 'template', 'difficulty', 'after_training']
+
+# Templates: {dataset} and {column}-style identifiers are validated and quoted;
+# every value is a bound $parameter
+QUERY_TEMPLATES = {
+    'knowbe4_outcome_rates': {
+        'description': "Click/report/data-entry rates for a KnowBe4 segment (any filter may be left empty)",
+        'dataset': 'knowbe4',
+        'identifiers': [],
+        'params': KNOWBE4_FILTER_PARAMS,
+        'sql': f"SELECT {KNOWBE4_OUTCOMES} FROM {{dataset}} WHERE {KNOWBE4_FILTERS}"
+    },
+    'knowbe4_outcome_rates_by': {
+        'description': "KnowBe4 outcome rates grouped by one column",
+        'dataset': 'knowbe4',
+        'identifiers': ['group_by'],
+        'params': KNOWBE4_FILTER_PARAMS,
+        'sql': f"SELECT {{group_by}}, {KNOWBE4_OUTCOMES} FROM {{dataset}} WHERE {KNOWBE4_FILTERS} "
+               f"GROUP BY {{group_by}} ORDER BY click_rate DESC"
+    },
+    'knowbe4_training_effect': {
+        'description': "Click and report rates before vs after completed training",
+        'dataset': 'knowbe4',
+        'identifiers': [],
+        'params': ['department', 'title'],
+        'sql': """
+            SELECT
+                CASE WHEN "Previous Training Completed" AND "Sent Date" > "Training Completion Date"
+                     THEN 'after training' ELSE 'untrained / before training' END AS training_status,
+                {outcomes}
+            FROM {dataset}
+            WHERE ($department IS NULL OR "Department" = $department)
+              AND ($title IS NULL OR "Title" = $title)
+            GROUP BY training_status
+            ORDER BY training_status
+        """.replace('{outcomes}', KNOWBE4_OUTCOMES)
+    },
+    'survey_pre_post': {
+        'description': "Mean pre/post values and change for one survey measure, optionally by group",
+        'dataset': None,
+        'identifiers': ['pre_column', 'post_column', 'group_by'],
+        'params': [],
+        'sql': """
+            SELECT {group_by} AS segment, COUNT(*) AS respondents,
+                   AVG({pre_column}) AS mean_pre, AVG({post_column}) AS mean_post,
+                   AVG({post_column} - {pre_column}) AS mean_change
+            FROM {dataset}
+            GROUP BY segment
+            ORDER BY segment
+        """
+    }
+}
+
+
+def quote_identifier(name):
+    """Quote a SQL identifier for DuckDB"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _sanitize_table_name(name):
+    return re.sub(r'[^0-9a-zA-Z_]+', '_', str(name)).strip('_').lower() or 'dataset'
+
+
+def dataframe_version(df):
+    """Content hash of a dataframe (columns, dtypes and values)"""
+    digest = hashlib.sha1()
+    digest.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()[:16]
+
+
+class AnalyticsCatalog:
+    """Registry of datasets in an in-process DuckDB engine with a versioned result cache"""
+
+    def __init__(self, cache_dir=ANALYTICS_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.con = duckdb.connect()
+        self.datasets = {}
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'queries': 0, 'cache_hits': 0}
+
+    def register_dataframe(self, df, dataset_name):
+        """Snapshot a dataframe to Parquet and register it; returns the table name"""
+        schema = match_schema(df.columns)
+        table = schema['name'] if schema else _sanitize_table_name(dataset_name)
+        version = dataframe_version(df)
+        path = self.cache_dir / f"{table}-{version}.parquet"
+        if not path.exists():
+            df.to_parquet(path, index=False)
+        return self._register(table, path, version, list(df.columns), dataset_name)
+
+    def register_file(self, path, dataset_name):
+        """Register a CSV/Parquet file, converting CSV to Parquet inside DuckDB"""
+        path = Path(path)
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(16 * 1024 * 1024), b''):
+                digest.update(block)
+        version = digest.hexdigest()[:16]
+        if path.suffix.lower() == '.parquet':
+            source = f"read_parquet({self._literal(path)})"
+        else:
+            source = self._csv_source(path)
+        columns = [row[0] for row in self.con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+        schema = match_schema(columns)
+        table = schema['name'] if schema else _sanitize_table_name(dataset_name)
+        parquet_path = self.cache_dir / f"{table}-{version}.parquet"
+        if not parquet_path.exists():
+            with self._lock:
+                self.con.execute(f"COPY (SELECT * FROM {source}) TO {self._literal(parquet_path)} (FORMAT PARQUET)")
+        return self._register(table, parquet_path, version, columns, dataset_name)
+
+    def _csv_source(self, path):
+        """read_csv() call using the registered schema's date formats when the layout is known"""
+        header = self.con.execute(f"DESCRIBE SELECT * FROM read_csv_auto({self._literal(path)})").fetchall()
+        schema = match_schema([row[0] for row in header])
+        options = []
+        for fmt in set((schema or {}).get('date_formats', {}).values()):
+            if fmt.startswith('%'):
+                option = 'timestampformat' if '%H' in fmt else 'dateformat'
+                options.append(f"{option}={self._literal(fmt)}")
+        return f"read_csv({', '.join([self._literal(path)] + options)})"
+
+    def _register(self, table, path, version, columns, dataset_name):
+        with self._lock:
+            self.con.execute(
+                f"CREATE OR REPLACE VIEW {quote_identifier(table)} AS SELECT * FROM read_parquet({self._literal(path)})"
+            )
+            self.datasets[table] = {
+                'path': str(path), 'version': version, 'columns': columns, 'dataset_name': dataset_name
+            }
+        return table
+
+    @staticmethod
+    def _literal(value):
+        return "'" + str(value).replace("'", "''") + "'"
+
+    def has_dataset(self, table):
+        return table in self.datasets
+
+    def query(self, sql, params=None):
+        """Run a read-only parameterized query and return a dataframe (cached per dataset version)"""
+        if not _READ_ONLY_SQL.match(sql) or _FORBIDDEN_SQL.search(sql) or ';' in sql.strip().rstrip(';'):
+            raise ValueError("Only single read-only SELECT queries are allowed")
+        params = params or {}
+        key = (sql, tuple(sorted(params.items())), tuple(sorted((t, d['version']) for t, d in self.datasets.items())))
+        with self._lock:
+            self.stats['queries'] += 1
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.stats['cache_hits'] += 1
+                return self._results[key].copy()
+            result = self.con.execute(sql, params).fetchdf()
+            self._results[key] = result
+            if len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        return result.copy()
+
+    def render_template(self, template_name, dataset=None, **identifiers):
+        """Build the SQL text of a template, validating identifiers against the dataset columns"""
+        template = QUERY_TEMPLATES[template_name]
+        table = dataset or template['dataset']
+        if table not in self.datasets:
+            raise KeyError(f"Dataset '{table}' is not registered")
+        columns = set(self.datasets[table]['columns'])
+        quoted = {'dataset': quote_identifier(table)}
+        for name in template['identifiers']:
+            column = identifiers.get(name)
+            if column is None and name == 'group_by':
+                quoted[name] = "'all'"
+                continue
+            if column not in columns:
+                raise ValueError(f"Unknown column '{column}' for {table}")
+            quoted[name] = quote_identifier(column)
+        return template['sql'].format(**quoted)
+
+    def run_template(self, template_name, dataset=None, **kwargs):
+        """Run a library template; identifiers and values are both passed as keyword arguments"""
+        template = QUERY_TEMPLATES[template_name]
+        identifiers = {name: kwargs.get(name) for name in template['identifiers']}
+        params = {name: kwargs.get(name) for name in template['params']}
+        return self.query(self.render_template(template_name, dataset, **identifiers), params)
+
+    def timed_template(self, template_name, dataset=None, **kwargs):
+        """run_template plus elapsed milliseconds, for display"""
+        start = time.perf_counter()
+        result = self.run_template(template_name, dataset, **kwargs)
+        return result, (time.perf_counter() - start) * 1000
+
+    def distinct_values(self, table, column, limit=200):
+        """Distinct non-null values of a column (for building filter widgets)"""
+        if column not in self.datasets.get(table, {}).get('columns', []):
+            return []
+        sql = f"SELECT DISTINCT {quote_identifier(column)} AS v FROM {quote_identifier(table)} " \
+              f"WHERE {quote_identifier(column)} IS NOT NULL ORDER BY v LIMIT {int(limit)}"
+        return [v for v in self.query(sql)['v'].tolist()]
+
+    def segment_facts(self, text):
+        """Exact KnowBe4 outcome facts for departments/titles mentioned in free text"""
+        if 'knowbe4' not in self.datasets:
+            return ""
+        lowered = text.lower()
+        mentioned = {}
+        for column, param in (('Department', 'department'), ('Title', 'title')):
+            for value in self.distinct_values('knowbe4', column):
+                if re.search(rf"\b{re.escape(str(value).lower())}s?\b", lowered):
+                    mentioned[param] = value
+                    break
+        if not mentioned:
+            return ""
+
+        segment = " ".join(str(mentioned[p]) for p in ('department', 'title') if p in mentioned)
+        lines = [f"EXACT KNOWBE4 FACTS ({segment}):"]
+        for label, after_training in (("overall", None), ("after training", True), ("untrained/before training", False)):
+            row = self.run_template('knowbe4_outcome_rates', after_training=after_training, **mentioned).iloc[0]
+            if not row['simulations']:
+                continue
+            lines.append(
+                f"- {label}: {int(row['simulations'])} simulations, click rate {row['click_rate']:.1%}, "
+                f"report rate {row['report_rate']:.1%}, data entry rate {row['data_entry_rate']:.1%}"
+            )
+        return "\n".join(lines) if len(lines) > 1 else ""
@@ -0,0 +1,222 @@
+"""
+Archetype clustering of KnowBe4 employees
+
+Campaign rows are aggregated per employee with vectorized groupbys (click,
+report and data-entry rates, median time to click, training, 2FA and password
+manager use), standardized and clustered with mini-batch k-means (k-means++
+seeding), so millions of rows cluster in seconds. Each archetype comes out as a
+centroid in original units with its population weight and a ready-made persona
+spec (the same fields persona_batch.py reads).
+"""
+
+import numpy as np
+import pandas as pd
+
+ARCHETYPE_COUNT = 6
+BATCH_SIZE = 2048
+MAX_ITERATIONS = 200
+ASSIGN_CHUNK = 100_000
+
+RATE_FEATURES = {'click_rate': 'Clicked', 'report_rate': 'Reported', 'data_entry_rate': 'Data Entered'}
+FLAG_FEATURES = {'trained': 'Previous Training Completed', 'two_factor': 'Two Factor Enabled',
+                 'password_manager': 'Password Manager'}
+TIME_TO_CLICK = 'Time to Click (seconds)'
+SEGMENT_COLUMNS = ['Department', 'Title']
+FEATURE_LABELS = {
+    'click_rate': 'click rate', 'report_rate': 'report rate', 'data_entry_rate': 'data-entry rate',
+    'time_to_click': 'median time to click (s)', 'trained': 'completed training', 'two_factor': 'uses 2FA',
+    'password_manager': 'uses a password manager'
+}
+
+
+def employee_features(df):
+    """One row per User ID: behavior features plus most frequent Department/Title"""
+    users = df['User ID'].astype(str).to_numpy()
+    columns = {}
+    for name, column in {**RATE_FEATURES, **FLAG_FEATURES}.items():
+        if column in df.columns:
+            columns[name] = df[column].astype('float64').to_numpy()
+    if TIME_TO_CLICK in df.columns:
+        # Only clicks have a time; an employee who never clicked gets NaN here
+        clicked = df[RATE_FEATURES['click_rate']].fillna(False).astype(bool).to_numpy() \
+            if RATE_FEATURES['click_rate'] in df.columns else np.ones(len(df), dtype=bool)
+        columns['time_to_click'] = np.where(clicked, df[TIME_TO_CLICK].astype('float64').to_numpy(), np.nan)
+    frame = pd.DataFrame(columns)
+    frame['User ID'] = users
+    grouped = frame.groupby('User ID', sort=False)
+    features = grouped[[c for c in columns if c != 'time_to_click']].mean()
+    if 'time_to_click' in columns:
+        features['time_to_click'] = grouped['time_to_click'].median()
+    features['campaigns'] = grouped.size()
+
+    for column in SEGMENT_COLUMNS:
+        if column in df.columns:
+            pairs = pd.DataFrame({'User ID': users, column: df[column].astype(str).to_numpy()})
+            modes = pairs.value_counts().reset_index(name='n').drop_duplicates('User ID').set_index('User ID')[column]
+            features[column.lower()] = modes.reindex(features.index)
+    return features
+
+
+def feature_matrix(features):
+    """Standardized float32 matrix, column names and (mean, std) for converting back"""
+    names = [name for name in FEATURE_LABELS if name in features]
+    values = features[names].to_numpy(dtype=np.float64)
+    if 'time_to_click' in names:
+        j = names.index('time_to_click')
+        times = np.log1p(values[:, j])
+        # Never clicked = slower than anyone who did
+        slowest = np.nanmax(times) if np.any(~np.isnan(times)) else 0.0
+        values[:, j] = np.where(np.isnan(times), slowest, times)
+    values = np.where(np.isnan(values), np.nanmean(values, axis=0), values)
+    values = np.nan_to_num(values)
+    mean, std = values.mean(axis=0), values.std(axis=0)
+    std[std == 0] = 1.0
+    return ((values - mean) / std).astype(np.float32), names, (mean, std)
+
+
+def _squared_distances(X, centers):
+    return (X ** 2).sum(axis=1)[:, None] - 2 * X @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+
+
+def assign(X, centers):
+    """Nearest center of every row (chunked) and the total inertia"""
+    labels = np.empty(len(X), dtype=np.int32)
+    inertia = 0.0
+    for start in range(0, len(X), ASSIGN_CHUNK):
+        distances = _squared_distances(X[start:start + ASSIGN_CHUNK], centers)
+        labels[start:start + ASSIGN_CHUNK] = distances.argmin(axis=1)
+        inertia += float(np.maximum(distances.min(axis=1), 0).sum())
+    return labels, inertia
+
+
+def kmeans_plus_plus(X, k, rng):
+    centers = [X[rng.integers(len(X))]]
+    closest = _squared_distances(X, np.array(centers)).ravel()
+    for _ in range(1, k):
+        closest = np.maximum(closest, 0)
+        total = closest.sum()
+        index = rng.choice(len(X), p=closest / total) if total > 0 else rng.integers(len(X))
+        centers.append(X[index])
+        closest = np.minimum(closest, _squared_distances(X, X[index:index + 1]).ravel())
+    return np.array(centers, dtype=X.dtype)
+
+
+def mini_batch_kmeans(X, k=ARCHETYPE_COUNT, batch_size=BATCH_SIZE, max_iterations=MAX_ITERATIONS, tol=1e-4, seed=None):
+    """(centers, labels, inertia) by mini-batch k-means with per-center learning rates"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(X))
+    seed_rows = X[rng.choice(len(X), size=min(len(X), 20 * batch_size), replace=False)]
+    centers = kmeans_plus_plus(seed_rows, k, rng).astype(np.float64)
+    counts = np.zeros(k)
+    for _ in range(max_iterations):
+        batch = X[rng.integers(0, len(X), size=min(batch_size, len(X)))].astype(np.float64)
+        labels = _squared_distances(batch, centers).argmin(axis=1)
+        batch_counts = np.bincount(labels, minlength=k).astype(np.float64)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, batch)
+        counts += batch_counts
+        moved = batch_counts > 0
+        rate = np.where(moved, batch_counts / np.maximum(counts, 1), 0)[:, None]
+        target = np.where(moved[:, None], sums / np.maximum(batch_counts, 1)[:, None], centers)
+        previous = centers
+        centers = centers + rate * (target - centers)
+        if np.abs(centers - previous).max() < tol:
+            break
+    labels, inertia = assign(X, centers.astype(np.float32))
+    return centers.astype(np.float32), labels, inertia
+
+
+def _describe(centroid, overall):
+    """Short behavioral label of a centroid relative to the population"""
+    parts = []
+    if 'click_rate' in centroid:
+        ratio = centroid['click_rate'] / overall['click_rate'] if overall['click_rate'] else 1
+        parts.append("frequent clicker" if ratio > 1.5 else "rare clicker" if ratio < 0.5 else "average clicker")
+    if 'report_rate' in centroid:
+        ratio = centroid['report_rate'] / overall['report_rate'] if overall['report_rate'] else 1
+        parts.append("active reporter" if ratio > 1.3 else "seldom reports" if ratio < 0.7 else None)
+    if centroid.get('data_entry_rate', 0) > 1.5 * overall.get('data_entry_rate', 0) > 0:
+        parts.append("enters credentials")
+    if 'time_to_click' in centroid and centroid.get('click_rate', 0) > 0 and \
+            centroid['time_to_click'] < 0.6 * overall.get('time_to_click', np.inf):
+        parts.append("clicks fast")
+    for name, label in (('trained', 'untrained'), ('two_factor', 'no 2FA'), ('password_manager', 'no password manager')):
+        if name in centroid and centroid[name] < 0.5 * overall[name]:
+            parts.append(label)
+    return ", ".join(part for part in parts if part) or "typical employee"
+
+
+def load_knowbe4_columns(catalog):
+    """Only the columns clustering needs, from the KnowBe4 dataset registered in Step 1"""
+    info = catalog.datasets.get('knowbe4')
+    if info is None:
+        return None
+    wanted = ['User ID', TIME_TO_CLICK] + list(RATE_FEATURES.values()) + list(FLAG_FEATURES.values()) + SEGMENT_COLUMNS
+    return pd.read_parquet(info['path'], columns=[c for c in wanted if c in info['columns']])
+
+
+def find_archetypes(df, k=ARCHETYPE_COUNT, seed=0):
+    """Cluster employees of a KnowBe4 export into k archetypes (largest first)"""
+    features = employee_features(df)
+    X, names, _ = feature_matrix(features)
+    centers, labels, inertia = mini_batch_kmeans(X, k, seed=seed)
+
+    overall = {name: float(features[name].median() if name == 'time_to_click' else features[name].mean())
+               for name in names}
+    archetypes = []
+    for cluster in range(len(centers)):
+        members = features[labels == cluster]
+        if members.empty:
+            continue
+        centroid = {name: float(members[name].mean()) for name in names}
+        if 'time_to_click' in names:
+            centroid['time_to_click'] = float(members['time_to_click'].median())
+        segments = {column: members[column].value_counts().head(2).index.tolist()
+                    for column in ('department', 'title') if column in members}
+        archetypes.append({
+            'archetype_id': f"A{cluster + 1}",
+            'label': _describe(centroid, overall),
+            'employees': int(len(members)),
+            'weight': len(members) / len(features),
+            'centroid': centroid,
+            'segments': segments
+        })
+    archetypes.sort(key=lambda a: a['weight'], reverse=True)
+    return {'archetypes': archetypes, 'employees': int(len(features)), 'inertia': inertia, 'features': names}
+
+
+def archetype_description(archetype):
+    """Persona request text for an archetype"""
+    centroid = archetype['centroid']
+    facts = []
+    for name in ('click_rate', 'report_rate', 'data_entry_rate', 'trained', 'two_factor', 'password_manager'):
+        if name in centroid:
+            facts.append(f"{FEATURE_LABELS[name]} {centroid[name]:.0%}")
+    if centroid.get('click_rate', 0) >= 0.05 and not np.isnan(centroid.get('time_to_click', np.nan)):
+        facts.append(f"{FEATURE_LABELS['time_to_click']} {centroid['time_to_click']:.0f}")
+    text = f"Create a persona for the '{archetype['label']}' archetype ({archetype['weight']:.0%} of employees)"
+    if archetype['segments'].get('title'):
+        text += f", most often {' or '.join(archetype['segments']['title'])}"
+    if archetype['segments'].get('department'):
+        text += f" in {' or '.join(archetype['segments']['department'])}"
+    return f"{text}. Observed phishing-simulation behavior: {'; '.join(facts)}."
+
+
+def archetype_specs(archetypes, total_personas=None, industry='Any', complexity='Detailed'):
+    """Persona specs (persona_batch fields) with counts proportional to population weight"""
+    total = total_personas or len(archetypes)
+    quotas = np.array([a['weight'] * total for a in archetypes])
+    counts = np.floor(quotas).astype(int)
+    # Largest remainders get the leftover personas; every archetype gets at least one
+    for index in np.argsort(-(quotas - counts))[:max(0, total - counts.sum())]:
+        counts[index] += 1
+    counts = np.maximum(counts, 1)
+    return [{
+        'spec_id': f"archetype-{a['archetype_id']}",
+        'name': f"{a['label'].capitalize()} ({a['archetype_id']})",
+        'description': archetype_description(a),
+        'industry': industry,
+        'complexity': complexity,
+        'count': int(count),
+        'weight': round(a['weight'], 4)
+    } for a, count in zip(archetypes, counts)]
@@ -0,0 +1,151 @@
+"""
+Token-budgeted context packing for RAG prompts
+
+Retrieved passages range from short column summaries to multi-thousand-token
+transcripts. The packer over-fetches candidates, picks them with maximal
+marginal relevance (relevant but not redundant with what is already chosen),
+trims long passages to their most query-relevant sentences and stops at a
+per-prompt token budget, so prompt size stays predictable.
+"""
+
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from token_utils import count_tokens, truncate_to_tokens
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CYPERSONA_CONTEXT_TOKENS", "1200"))
+PASSAGE_TOKEN_LIMIT = 400
+MIN_PASSAGE_TOKENS = 40
+CANDIDATE_COUNT = 15
+MMR_LAMBDA = 0.7
+# Candidates this similar to an already chosen passage add nothing
+REDUNDANCY_CUTOFF = 0.95
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were with "
+    "their they them not but which who will can all any".split()
+)
+
+
+def _terms(text):
+    return [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS and len(word) > 1]
+
+
+def lexical_vectors(texts):
+    """TF-IDF rows (L2-normalized) over the candidate set, for when no embeddings are given"""
+    counts = [Counter(_terms(text)) for text in texts]
+    vocabulary = {term: i for i, term in enumerate(sorted(set().union(*counts)))} if counts else {}
+    matrix = np.zeros((len(texts), max(len(vocabulary), 1)), dtype=np.float32)
+    document_frequency = Counter(term for count in counts for term in count)
+    for row, count in enumerate(counts):
+        for term, n in count.items():
+            matrix[row, vocabulary[term]] = (1 + math.log(n)) * math.log((1 + len(texts)) / (1 + document_frequency[term]) + 1)
+    return normalize_rows(matrix)
+
+
+def normalize_rows(vectors):
+    """float32 rows scaled to unit length (zero rows stay zero); a single vector becomes one row"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def mmr_select(relevance, vectors, k, lambda_=MMR_LAMBDA, redundancy_cutoff=REDUNDANCY_CUTOFF):
+    """Indices chosen by maximal marginal relevance, best first"""
+    relevance = np.asarray(relevance, dtype=np.float32)
+    if not len(relevance):
+        return []
+    similarity = vectors @ vectors.T
+    chosen, remaining = [], list(range(len(relevance)))
+    while remaining and len(chosen) < k:
+        if chosen:
+            redundancy = similarity[np.ix_(remaining, chosen)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining), dtype=np.float32)
+        scores = lambda_ * relevance[remaining] - (1 - lambda_) * redundancy
+        best = int(np.argmax(scores))
+        candidate = remaining.pop(best)
+        if redundancy[best] < redundancy_cutoff:
+            chosen.append(candidate)
+    return chosen
+
+
+def trim_passage(text, query, budget):
+    """The passage's most query-relevant sentences, in original order, within budget tokens"""
+    if count_tokens(text) <= budget:
+        return text
+    sentences = [s.strip() for s in _SENTENCE_SPLIT.split(text) if s.strip()]
+    query_terms = set(_terms(query))
+    scored = []
+    for position, sentence in enumerate(sentences):
+        terms = _terms(sentence)
+        overlap = sum(1 for term in terms if term in query_terms)
+        # Favor dense matches; the position term keeps ties in reading order
+        scored.append((overlap / math.sqrt(len(terms) + 1), -position, position, sentence))
+
+    # Sentences sharing no terms with the query are only used when nothing matches
+    if any(score > 0 for score, _, _, _ in scored):
+        scored = [entry for entry in scored if entry[0] > 0]
+    kept, used = [], 0
+    for _, _, position, sentence in sorted(scored, reverse=True):
+        tokens = count_tokens(sentence)
+        if used + tokens > budget:
+            continue
+        kept.append((position, sentence))
+        used += tokens
+    if not kept:
+        return truncate_to_tokens(text, budget)
+    kept.sort()
+    # Mark gaps so the model does not read dropped sentences as contiguous text
+    pieces, previous = [], -1
+    for position, sentence in kept:
+        if position != previous + 1 and pieces:
+            pieces.append("...")
+        pieces.append(sentence)
+        previous = position
+    return " ".join(pieces)
+
+
+def pack_context(query, results, budget=CONTEXT_TOKEN_BUDGET, passage_limit=PASSAGE_TOKEN_LIMIT,
+                 vectors=None, query_vector=None):
+    """Join retrieved passages into at most budget tokens.
+
+    results are retrieval dicts with 'text' and optionally 'similarity'; vectors
+    (one per result) and query_vector enable embedding-space MMR, otherwise TF-IDF
+    over the candidates is used.
+    """
+    texts = [result['text'] for result in results if result.get('text')]
+    if not texts:
+        return ""
+    if vectors is not None and len(vectors) == len(texts):
+        vectors = normalize_rows(vectors)
+        if query_vector is not None:
+            relevance = vectors @ normalize_rows(query_vector)[0]
+        else:
+            relevance = [result.get('similarity', 0.0) for result in results if result.get('text')]
+    else:
+        vectors = lexical_vectors(texts + [query])
+        relevance = vectors[:-1] @ vectors[-1]
+        vectors = vectors[:-1]
+        similarities = [result.get('similarity') for result in results if result.get('text')]
+        if all(s is not None for s in similarities):
+            relevance = 0.5 * np.asarray(similarities, dtype=np.float32) + 0.5 * relevance
+
+    packed, remaining = [], budget
+    for index in mmr_select(relevance, vectors, len(texts)):
+        if remaining < MIN_PASSAGE_TOKENS:
+            break
+        passage = trim_passage(texts[index], query, min(passage_limit, remaining))
+        tokens = count_tokens(passage)
+        if tokens > remaining:
+            passage = truncate_to_tokens(passage, remaining)
+            tokens = count_tokens(passage)
+        packed.append(passage)
+        remaining -= tokens + 1  # newline separator
+    return "\n".join(packed)
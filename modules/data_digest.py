@@ -0,0 +1,394 @@
+"""
+Stratified statistical digest of a dataset for behavioral pattern analysis
+
+Replaces the first-ten-rows sample that used to go to the LLM with a compact
+summary of every row: outcome rates, effect sizes of training and controls,
+the segments that deviate most, survey pre/post deltas and a few stratified
+exemplar rows, cut to a fixed token budget. Partials are mergeable, so the
+digest is built shard by shard by the sharded ingestion engine.
+"""
+
+import math
+import re
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+
+from dataset_schemas import match_schema
+from token_utils import count_tokens
+
+DIGEST_TOKEN_BUDGET = 700
+MAX_SEGMENT_LEVELS = 15
+MIN_SEGMENT_SUPPORT = 20
+EXEMPLAR_SEGMENTS = 3
+
+_PRE_POST_PATTERNS = [
+    (re.compile(r'^pre_(.+)$'), 'post_{}'),
+    (re.compile(r'^(.+)_pre$'), '{}_post')
+]
+
+
+# ---------------------------------------------------------------------------
+# Column roles
+# ---------------------------------------------------------------------------
+
+def find_pre_post_pairs(df):
+    """Return [(measure, pre_column, post_column)] for numeric pre/post column pairs"""
+    pairs = []
+    for col in df.columns:
+        for pattern, post_format in _PRE_POST_PATTERNS:
+            match = pattern.match(str(col))
+            if not match:
+                continue
+            post = post_format.format(match.group(1))
+            if post in df.columns and pd.api.types.is_numeric_dtype(df[col].dtype) \
+                    and pd.api.types.is_numeric_dtype(df[post].dtype):
+                pairs.append((match.group(1), col, post))
+    return pairs
+
+
+def detect_roles(df):
+    """Outcome flags, treatment flags, segment and intervention columns, and pre/post pairs"""
+    schema = match_schema(df.columns)
+    if schema and 'roles' in schema:
+        roles = {key: [c for c in columns if c in df.columns] for key, columns in schema['roles'].items()}
+    else:
+        roles = {'outcomes': [], 'treatments': [], 'segments': [], 'interventions': []}
+        for col in df.columns:
+            dtype = df[col].dtype
+            name = str(col).lower()
+            if pd.api.types.is_bool_dtype(dtype):
+                roles['treatments' if 'train' in name else 'outcomes'].append(col)
+            elif isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(dtype) \
+                    or pd.api.types.is_object_dtype(dtype):
+                # A shard may hold a single level; the two-level minimum is applied once merged
+                if df[col].nunique(dropna=True) <= MAX_SEGMENT_LEVELS:
+                    is_intervention = any(token in name for token in ('intervention', 'training', 'treatment'))
+                    roles['interventions' if is_intervention else 'segments'].append(col)
+    roles['pre_post'] = find_pre_post_pairs(df)
+    return roles
+
+
+def _exemplar_columns(roles):
+    columns = []
+    for col in (roles['interventions'] + roles['segments'])[:EXEMPLAR_SEGMENTS] + roles['outcomes'][:3] \
+            + roles['treatments'][:2] + [c for _, pre, post in roles['pre_post'][:2] for c in (pre, post)]:
+        if col not in columns:
+            columns.append(col)
+    return columns
+
+
+# ---------------------------------------------------------------------------
+# Partial aggregates
+# ---------------------------------------------------------------------------
+
+def moments(values):
+    """(count, mean, M2) of a float series.
+
+    When every value is a whole number the mean and M2 are exact Fractions, so
+    combining shard moments gives the same result as one pass over all rows
+    (see moment_floats).
+    """
+    values = values.dropna()
+    count = len(values)
+    if not count:
+        return (0, 0.0, 0.0)
+    array = values.to_numpy(dtype=np.float64)
+    if np.abs(array).max() < 2 ** 31 and (array == np.round(array)).all():
+        # Integer sum of squares without int64 overflow: split |x| into 16-bit halves
+        magnitude = np.abs(array).astype(np.int64)
+        high, low = magnitude >> 16, magnitude & 0xFFFF
+        total = int(array.astype(np.int64).sum())
+        squares = (int((high * high).sum()) << 32) + (int((high * low).sum()) << 17) + int((low * low).sum())
+        return (count, Fraction(total, count), Fraction(count * squares - total * total, count))
+    mean = float(values.mean())
+    return (count, mean, float(((values - mean) ** 2).sum()))
+
+
+def combine_moments(a, b):
+    """Chan et al. pairwise combination of two (count, mean, M2) moments"""
+    (na, ma, qa), (nb, mb, qb) = a, b
+    if not na:
+        return b
+    if not nb:
+        return a
+    n = na + nb
+    delta = mb - ma
+    return (n, ma + delta * nb / n, qa + qb + delta * delta * na * nb / n)
+
+
+def moment_floats(moment):
+    """Merged moments with the mean and M2 as floats"""
+    count, mean, m2 = moment
+    return (count, float(mean), float(m2))
+
+
+def _group_rates(flags, key):
+    """{level: {outcome: [sum, count]}} for outcome flags grouped by key"""
+    grouped = flags.groupby(key, observed=True).agg(['sum', 'count'])
+    return {
+        level: {col: [float(row[(col, 'sum')]), int(row[(col, 'count')])] for col in flags.columns}
+        for level, row in grouped.iterrows()
+    }
+
+
+def digest_partial(df):
+    """Compute the mergeable digest aggregates for one shard"""
+    df = df.reset_index(drop=True)
+    roles = detect_roles(df)
+    outcomes = roles['outcomes']
+    flags = df[outcomes].astype('float64') if outcomes else None
+    groups = roles['segments'] + roles['interventions']
+
+    part = {'rows': len(df), 'roles': roles, 'outcomes': {}, 'groups': {}, 'treatments': {},
+            'pre_post': {}, 'exemplars': {}}
+    if outcomes:
+        part['outcomes'] = {col: [float(flags[col].sum()), int(flags[col].count())] for col in outcomes}
+        for col in roles['treatments']:
+            part['treatments'][col] = _group_rates(flags, df[col])
+
+    for col in groups:
+        part['groups'][col] = {
+            'counts': {level: int(n) for level, n in df[col].value_counts(dropna=True).items() if n},
+            'rates': _group_rates(flags, df[col]) if outcomes else {}
+        }
+
+    for measure, pre, post in roles['pre_post']:
+        pre_values = df[pre].astype('float64')
+        post_values = df[post].astype('float64')
+        diff = post_values - pre_values
+        valid = diff.notna()
+        by = {}
+        for col in groups:
+            by[col] = {
+                level: (moments(pre_values[index]), moments(post_values[index]), moments(diff[index]))
+                for level, index in df[valid].groupby(col, observed=True).groups.items()
+            }
+        part['pre_post'][measure] = {
+            'all': (moments(pre_values[valid]), moments(post_values[valid]), moments(diff[valid])),
+            'by': by
+        }
+
+    # Stratified exemplars: first row of each (segment, primary outcome) stratum, for every
+    # segment column, since which one is primary is only known once all shards are merged
+    candidates = list(dict.fromkeys(groups + outcomes[:3] + roles['treatments'][:2]
+                                    + [c for _, pre, post in roles['pre_post'][:2] for c in (pre, post)]))
+    for primary in [[col] for col in groups] + [[]]:
+        strata = primary + outcomes[:1]
+        if not strata:
+            continue
+        first_rows = df[strata].dropna().drop_duplicates()
+        part['exemplars'][tuple(primary)] = {
+            tuple(str(df.at[row_idx, col]) for col in strata): (row_idx, {col: df.at[row_idx, col] for col in candidates})
+            for row_idx in first_rows.index
+        }
+    return part
+
+
+def _merge_rates(target, rates):
+    for level, by_outcome in rates.items():
+        slot = target.setdefault(level, {})
+        for col, (total, count) in by_outcome.items():
+            current = slot.setdefault(col, [0.0, 0])
+            current[0] += total
+            current[1] += count
+
+
+def merge_digest_partials(partials):
+    """Merge shard digest partials (in shard order)"""
+    roles = {key: list(value) for key, value in partials[0]['roles'].items()}
+    for partial in partials[1:]:
+        for key in roles:
+            roles[key] = [c for c in roles[key] if c in partial['roles'][key]]
+
+    digest = {'rows': 0, 'roles': roles, 'outcomes': {}, 'groups': {}, 'treatments': {},
+              'pre_post': {}, 'exemplars': {}}
+    for shard_idx, partial in enumerate(partials):
+        digest['rows'] += partial['rows']
+        for col, (total, count) in partial['outcomes'].items():
+            current = digest['outcomes'].setdefault(col, [0.0, 0])
+            current[0] += total
+            current[1] += count
+        for col, rates in partial['treatments'].items():
+            _merge_rates(digest['treatments'].setdefault(col, {}), rates)
+        for col, group in partial['groups'].items():
+            merged = digest['groups'].setdefault(col, {'counts': {}, 'rates': {}})
+            for level, n in group['counts'].items():
+                merged['counts'][level] = merged['counts'].get(level, 0) + n
+            _merge_rates(merged['rates'], group['rates'])
+        for measure, stats in partial['pre_post'].items():
+            merged = digest['pre_post'].setdefault(measure, {'all': ((0, 0.0, 0.0),) * 3, 'by': {}})
+            merged['all'] = tuple(combine_moments(a, b) for a, b in zip(merged['all'], stats['all']))
+            for col, levels in stats['by'].items():
+                by = merged['by'].setdefault(col, {})
+                for level, level_moments in levels.items():
+                    by[level] = tuple(combine_moments(a, b)
+                                      for a, b in zip(by.get(level, ((0, 0.0, 0.0),) * 3), level_moments))
+        for primary, strata in partial['exemplars'].items():
+            merged = digest['exemplars'].setdefault(primary, {})
+            for key, (row_idx, values) in strata.items():
+                order = (shard_idx, row_idx)
+                if key not in merged or order < merged[key][0]:
+                    merged[key] = (order, values)
+
+    for stats in digest['pre_post'].values():
+        stats['all'] = tuple(moment_floats(m) for m in stats['all'])
+        for levels in stats['by'].values():
+            for level, level_moments in levels.items():
+                levels[level] = tuple(moment_floats(m) for m in level_moments)
+
+    # Unknown layouts decide segments per shard; drop any that grew too wide or stayed constant once merged
+    for key in ('segments', 'interventions'):
+        roles[key] = [c for c in roles[key]
+                      if 2 <= len(digest['groups'].get(c, {}).get('counts', {})) <= MAX_SEGMENT_LEVELS]
+    return digest
+
+
+def build_digest(df):
+    """Digest of an in-memory dataframe (single-process mode)"""
+    return merge_digest_partials([digest_partial(df)])
+
+
+# ---------------------------------------------------------------------------
+# Rendering
+# ---------------------------------------------------------------------------
+
+def _rate(total_count):
+    total, count = total_count
+    return total / count if count else math.nan
+
+
+def _format_value(value):
+    if isinstance(value, (bool, np.bool_)):
+        return "yes" if value else "no"
+    if isinstance(value, (float, np.floating)):
+        return f"{value:.2f}".rstrip('0').rstrip('.')
+    return str(value)
+
+
+def _cohens_h(p1, p2):
+    return 2 * math.asin(math.sqrt(p1)) - 2 * math.asin(math.sqrt(p2))
+
+
+def _digest_sections(digest):
+    """Candidate digest lines per section, most informative first"""
+    roles = digest['roles']
+    outcomes = [c for c in roles['outcomes'] if digest['outcomes'].get(c, [0, 0])[1]]
+    overall = {col: _rate(digest['outcomes'][col]) for col in outcomes}
+    sections = []
+
+    if outcomes:
+        rates = ", ".join(f"{col} {overall[col]:.1%}" for col in outcomes)
+        sections.append(("Overall outcome rates", [rates]))
+
+    effect_lines = []
+    for col in roles['treatments']:
+        levels = digest['treatments'].get(col, {})
+        treated = next((v for k, v in levels.items() if str(k) == 'True'), None)
+        control = next((v for k, v in levels.items() if str(k) == 'False'), None)
+        if not treated or not control:
+            continue
+        parts, strength = [], 0.0
+        for outcome in outcomes[:3]:
+            p1, p0 = _rate(treated[outcome]), _rate(control[outcome])
+            if math.isnan(p1) or math.isnan(p0):
+                continue
+            h = _cohens_h(p1, p0)
+            strength = max(strength, abs(h))
+            rr = f", RR {p1 / p0:.2f}" if p0 else ""
+            parts.append(f"{outcome} {p1:.1%} vs {p0:.1%} ({(p1 - p0) * 100:+.1f} pts{rr}, h={h:+.2f})")
+        if parts:
+            n1, n0 = treated[outcomes[0]][1], control[outcomes[0]][1]
+            effect_lines.append((strength, f"{col} yes (n={n1}) vs no (n={n0}): " + "; ".join(parts)))
+    if effect_lines:
+        sections.append(("Effect sizes", [line for _, line in sorted(effect_lines, key=lambda x: (-x[0], x[1]))]))
+
+    pre_post_lines = []
+    for measure, stats in digest['pre_post'].items():
+        (n, pre_mean, _), (_, post_mean, _), (_, diff_mean, diff_m2) = stats['all']
+        if n < 2:
+            continue
+        sd = math.sqrt(diff_m2 / (n - 1))
+        d = diff_mean / sd if sd else 0.0
+        line = f"{measure} (n={n}): pre {pre_mean:.2f} -> post {post_mean:.2f} (delta {diff_mean:+.2f}, d={d:+.2f})"
+        for col in roles['interventions'][:1]:
+            by = stats['by'].get(col, {})
+            # Ties broken by level name, so the order does not depend on how rows were sharded
+            ranked = sorted(by.items(), key=lambda x: (-x[1][2][1], str(x[0])))
+            deltas = [f"{level} {m[2][1]:+.2f}" for level, m in ranked if m[2][0]]
+            if deltas:
+                line += f"; by {col}: " + ", ".join(deltas)
+        pre_post_lines.append((abs(d), line))
+    if pre_post_lines:
+        sections.append(("Pre/post changes", [line for _, line in sorted(pre_post_lines, key=lambda x: (-x[0], x[1]))]))
+
+    segment_lines = []
+    for col in roles['segments'] + roles['interventions']:
+        group = digest['groups'].get(col, {})
+        for level, n in group.get('counts', {}).items():
+            if n < MIN_SEGMENT_SUPPORT:
+                continue
+            if outcomes:
+                primary = outcomes[0]
+                rates = group['rates'].get(level, {})
+                p, base = _rate(rates.get(primary, [0, 0])), overall[primary]
+                if math.isnan(p) or base in (0, 1):
+                    continue
+                z = (p - base) / math.sqrt(base * (1 - base) / n)
+                others = ", ".join(f"{o} {_rate(rates[o]):.1%}" for o in outcomes[1:3] if o in rates)
+                segment_lines.append((abs(z), f"{col}={level} (n={n}): {primary} {p:.1%} ({(p - base) * 100:+.1f} pts)"
+                                              + (f", {others}" if others else "")))
+            else:
+                for measure, stats in digest['pre_post'].items():
+                    moments = stats['by'].get(col, {}).get(level)
+                    (n_all, _, _), (_, _, _), (_, diff_all, m2_all) = stats['all']
+                    if not moments or moments[2][0] < MIN_SEGMENT_SUPPORT or n_all < 2:
+                        continue
+                    sd = math.sqrt(m2_all / (n_all - 1)) or 1.0
+                    shift = (moments[2][1] - diff_all) / sd
+                    segment_lines.append((abs(shift) * math.sqrt(moments[2][0]),
+                                          f"{col}={level} (n={moments[2][0]}): {measure} delta {moments[2][1]:+.2f} "
+                                          f"vs {diff_all:+.2f} overall"))
+    if segment_lines:
+        title = "Most deviating segments" + (f" (overall {outcomes[0]} {overall[outcomes[0]]:.1%})" if outcomes else "")
+        sections.append((title, [line for _, line in sorted(segment_lines, key=lambda x: (-x[0], x[1]))]))
+
+    exemplar_lines = []
+    primary = tuple((roles['interventions'] + roles['segments'])[:1])
+    columns = _exemplar_columns(roles)
+    for _, values in sorted(digest['exemplars'].get(primary, {}).values(), key=lambda item: item[0]):
+        exemplar_lines.append(" | ".join(f"{col}={_format_value(values[col])}" for col in columns
+                                         if col in values and not pd.isna(values[col])))
+    if exemplar_lines:
+        strata = " x ".join(((roles['interventions'] + roles['segments'])[:1] + roles['outcomes'][:1]))
+        sections.append((f"Stratified exemplars ({strata})", exemplar_lines))
+    return sections
+
+
+def render_digest(digest, dataset_name, token_budget=DIGEST_TOKEN_BUDGET):
+    """Render the digest as prompt text that fits the token budget"""
+    header = f"DIGEST OF {dataset_name} ({digest['rows']:,} rows; statistics cover all rows)"
+    sections = _digest_sections(digest)
+    used = count_tokens(header)
+    chosen = {title: [] for title, _ in sections}
+
+    # First give every section a few lines, then fill the remaining budget in section order
+    for quota in (3, None):
+        for title, lines in sections:
+            taken = chosen[title]
+            for i, line in enumerate(lines[:quota]):
+                if i in taken:
+                    continue
+                cost = count_tokens(line) + 2 + (0 if taken else count_tokens(title) + 1)
+                if used + cost > token_budget:
+                    continue
+                taken.append(i)
+                used += cost
+
+    out = [header]
+    for title, lines in sections:
+        if chosen[title]:
+            out.append(f"{title}:")
+            out.extend(f"- {lines[i]}" for i in sorted(chosen[title]))
+    return "\n".join(out)
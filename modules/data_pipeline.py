@@ -7,42 +7,59 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import json
+import hashlib
 from datetime import datetime
 import plotly.express as px
 import plotly.graph_objects as go
 from pathlib import Path
 import os
 from dotenv import load_dotenv
-import openai
-from openai import OpenAI
 import faiss
 import pickle
+import tempfile
 
 load_dotenv()
 
+from llm_clients import get_llm_clients, EMBEDDING_MODEL
+from dataset_schemas import read_csv_typed, apply_schema, memory_usage_mb
+from analytics_sql import AnalyticsCatalog
+from data_digest import render_digest
+from sharded_ingestion import (
+    ShardedIngestionEngine, SHARDED_INGESTION_MIN_BYTES, profile_dataframe, documents_from_profile, transcript_documents
+)
+
+def metadata_matches(metadata, where):
+    """True if every key of where equals the document's metadata value (case-insensitive)"""
+    return all(str(metadata.get(key, '')).lower() == str(value).lower() for key, value in where.items())
+
 class OpenAIVectorDB:
     """OpenAI-powered vector database for cybersecurity research"""
     
     def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self.documents = []
         self.embeddings = []
         self.metadata = []
         self.index = None
+    
+    @property
+    def client(self):
+        """Shared pooled clients (not stored, so the knowledge base stays picklable)"""
+        return get_llm_clients()
         
     def add_document(self, text, metadata):
         """Add document to knowledge base"""
+        self.add_documents([text], [metadata])
+    
+    def add_documents(self, texts, metadatas):
+        """Add documents to knowledge base with batched embedding requests"""
+        if not texts:
+            return
         try:
-            # Get embedding from OpenAI
-            response = self.client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-            embedding = response.data[0].embedding
+            embeddings = self.client.run(self.client.embed(list(texts), model=EMBEDDING_MODEL))
             
-            self.documents.append(text)
-            self.embeddings.append(embedding)
-            self.metadata.append(metadata)
+            self.documents.extend(texts)
+            self.embeddings.extend(embeddings)
+            self.metadata.extend(metadatas)
             
         except Exception as e:
             st.error(f"Error creating embedding: {e}")
@@ -74,29 +91,55 @@ class OpenAIVectorDB:
             
         try:
             # Get query embedding
-            response = self.client.embeddings.create(
-                model="text-embedding-3-small",
-                input=query_text
-            )
-            query_embedding = np.array([response.data[0].embedding]).astype('float32')
-            faiss.normalize_L2(query_embedding)
-            
-            # Search
-            scores, indices = self.index.search(query_embedding, top_k)
-            
-            results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx < len(self.documents) and score > 0.1:  # Lower similarity threshold
-                    results.append({
-                        'text': self.documents[idx],
-                        'metadata': self.metadata[idx],
-                        'similarity': float(score)
-                    })
-            return results
+            query_embedding = self.client.run(self.client.embed(query_text, model=EMBEDDING_MODEL))[0]
+            return self.search_embedding(query_embedding, top_k)
             
         except Exception as e:
             st.error(f"Error querying: {e}")
             return []
+    
+    def search_embedding(self, query_embedding, top_k=5, where=None):
+        """Search with an already computed query embedding (lets async callers embed on the client loop).
+        
+        where keeps only documents whose metadata matches every key (case-insensitive),
+        e.g. {'type': 'qualitative_transcript', 'role_family': 'clinical'}.
+        """
+        if self.index is None:
+            self.build_index()
+        if self.index is None:
+            return []
+        query_embedding = np.array([query_embedding]).astype('float32')
+        faiss.normalize_L2(query_embedding)
+        
+        # Search (a filtered search ranks every document; the flat index is exact anyway)
+        scores, indices = self.index.search(query_embedding, top_k if where is None else self.index.ntotal)
+        
+        results = []
+        for score, idx in zip(scores[0], indices[0]):
+            if 0 <= idx < len(self.documents) and score > 0.1:  # Lower similarity threshold
+                if where is not None and not metadata_matches(self.metadata[idx], where):
+                    continue
+                results.append({
+                    'text': self.documents[idx],
+                    'metadata': self.metadata[idx],
+                    'similarity': float(score),
+                    'index': int(idx)
+                })
+                if len(results) == top_k:
+                    break
+        return results
+    
+    def version(self):
+        """Cheap identity of the knowledge base contents (changes when documents are added)"""
+        if not self.documents:
+            return "empty"
+        return f"{len(self.documents)}:{hashlib.sha256(self.documents[-1].encode()).hexdigest()[:12]}"
+    
+    def result_vectors(self, results):
+        """Stored embeddings of search results (for redundancy-aware context packing)"""
+        if not results or any(result.get('index') is None for result in results):
+            return None
+        return np.array([self.embeddings[result['index']] for result in results], dtype='float32')
         
     def save(self, filepath):
         """Save knowledge base to file"""
@@ -140,14 +183,18 @@ class OpenAIVectorDB:
 
 class LLMDataProcessor:
     def __init__(self):
-        self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.llm = get_llm_clients()
         self.vector_db = OpenAIVectorDB()
+        self.catalog = AnalyticsCatalog()
         
     def safe_read_csv(self, file_obj):
-        """Safely read CSV from uploaded file object"""
+        """Safely read CSV (or Parquet) from uploaded file object into compact typed columns"""
         try:
             file_obj.seek(0)
-            df = pd.read_csv(file_obj)
+            if getattr(file_obj, 'name', '').lower().endswith('.parquet'):
+                df = apply_schema(pd.read_parquet(file_obj))
+            else:
+                df = read_csv_typed(file_obj)
             if df.empty:
                 raise ValueError("Empty CSV file")
             return df
@@ -157,58 +204,82 @@ class LLMDataProcessor:
             
     def extract_knowledge_from_dataframe(self, df, dataset_name):
         """Extract knowledge from dataframe and add to vector database"""
-        knowledge_texts = []
+        return self.extract_knowledge_from_profile(profile_dataframe(df), dataset_name)
+    
+    def extract_knowledge_from_upload(self, file_obj, dataset_name, progress_callback=None):
+        """Extract knowledge from an uploaded file, sharding large files across processes"""
+        size = getattr(file_obj, 'size', None) or len(file_obj.getbuffer())
+        if size < SHARDED_INGESTION_MIN_BYTES:
+            df = self.safe_read_csv(file_obj)
+            if df is None:
+                return None
+            self.register_dataset(df, dataset_name)
+            return self.extract_knowledge_from_dataframe(df, dataset_name)
+        
+        # Workers read the file themselves, so spill the upload to disk once
+        suffix = Path(getattr(file_obj, 'name', 'upload.csv')).suffix or '.csv'
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+            file_obj.seek(0)
+            tmp.write(file_obj.read())
+            temp_path = tmp.name
+        try:
+            profile = ShardedIngestionEngine().profile(temp_path, progress_callback)
+            self.register_dataset(temp_path, dataset_name)
+        except Exception as e:
+            st.error(f"Error profiling {dataset_name}: {str(e)}")
+            return None
+        finally:
+            os.remove(temp_path)
+        return self.extract_knowledge_from_profile(profile, dataset_name)
+    
+    def register_dataset(self, data, dataset_name):
+        """Register a dataframe or file with the SQL catalog for exact fact lookups"""
+        try:
+            if isinstance(data, pd.DataFrame):
+                return self.catalog.register_dataframe(data, dataset_name)
+            return self.catalog.register_file(data, dataset_name)
+        except Exception as e:
+            st.warning(f"Could not register {dataset_name} for SQL queries: {e}")
+            return None
+    
+    def extract_knowledge_from_profile(self, profile, dataset_name):
+        """Turn a (possibly shard-merged) dataset profile into knowledge base documents"""
+        # Start the pattern analysis first so it overlaps with building the column documents
+        digest = render_digest(profile['digest'], dataset_name)
+        pattern_future = self.llm.submit(self.analyze_behavioral_patterns_async(digest, dataset_name))
         
         # Extract column insights
-        for col in df.columns:
-            if df[col].dtype in ['object', 'bool']:
-                # Categorical analysis
-                value_counts = df[col].value_counts().head(5)
-                text = f"In {dataset_name}, column {col} shows: {dict(value_counts)}"
-                knowledge_texts.append(text)
-                self.vector_db.add_document(text, {
-                    'type': 'categorical_analysis',
-                    'dataset': dataset_name,
-                    'column': col
-                })
-                
-            elif df[col].dtype in ['int64', 'float64']:
-                # Numerical analysis
-                stats = df[col].describe()
-                text = f"In {dataset_name}, {col} has mean {stats['mean']:.2f}, std {stats['std']:.2f}, range {stats['min']:.2f}-{stats['max']:.2f}"
-                knowledge_texts.append(text)
-                self.vector_db.add_document(text, {
-                    'type': 'numerical_analysis', 
-                    'dataset': dataset_name,
-                    'column': col
-                })
+        knowledge_texts, knowledge_metadata = documents_from_profile(profile, dataset_name)
         
         # Extract behavioral patterns using Together AI
-        sample_data = df.head(10).to_string()
-        pattern_text = self.analyze_behavioral_patterns(sample_data, dataset_name)
+        pattern_text = pattern_future.result()
         if pattern_text and "Error:" not in pattern_text:
-            self.vector_db.add_document(pattern_text, {
+            knowledge_texts.append(pattern_text)
+            knowledge_metadata.append({
                 'type': 'behavioral_patterns',
                 'dataset': dataset_name
             })
-            knowledge_texts.append(pattern_text)
+        
+        # Embed all documents for this dataset in batched requests
+        self.vector_db.add_documents(knowledge_texts, knowledge_metadata)
         
         return knowledge_texts
     
-    def analyze_behavioral_patterns(self, sample_data, dataset_name):
+    def analyze_behavioral_patterns(self, digest, dataset_name):
         """Analyze behavioral patterns using Together AI Llama 3.1 8B"""
+        return self.llm.run(self.analyze_behavioral_patterns_async(digest, dataset_name))
+    
+    async def analyze_behavioral_patterns_async(self, digest, dataset_name):
+        """Async variant of analyze_behavioral_patterns for use with asyncio.gather"""
         try:
-            import together
-            together_client = together.Together(api_key=os.getenv("TOGETHER_API_KEY"))
-            
-            response = together_client.chat.completions.create(
-                model="meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
+            return await self.llm.chat(
                 messages=[{
                     "role": "user",
                     "content": f"""
-                    Analyze this cybersecurity research data from {dataset_name}:
+                    Analyze this statistical digest of cybersecurity research data from {dataset_name}.
+                    The rates, effect sizes and segment deviations are computed over all rows.
                     
-                    {sample_data}
+                    {digest}
                     
                     Extract key behavioral insights about:
                     - Phishing susceptibility patterns
@@ -216,13 +287,12 @@ class LLMDataProcessor:
                     - Risk factors and protective factors
                     - Training effectiveness indicators
                     
-                    Provide 2-3 concise insights in plain text format.
+                    Provide 2-3 concise insights in plain text format, citing the figures they rest on.
                     """
                 }],
                 max_tokens=300,
                 temperature=0.7
             )
-            return response.choices[0].message.content
         except Exception as e:
             return f"Error: {str(e)}"
 
@@ -339,16 +409,16 @@ def render_step1_ui():
         
         with col1:
             st.markdown("**Phishing simulation results**")
-            knowbe4_file = st.file_uploader("Upload KnowBe4 CSV", type=['csv'], key="knowbe4_upload")
+            knowbe4_file = st.file_uploader("Upload KnowBe4 CSV", type=['csv', 'parquet'], key="knowbe4_upload")
             if knowbe4_file:
                 st.session_state.uploaded_datasets['knowbe4'] = knowbe4_file
                 df = processor.safe_read_csv(knowbe4_file)
                 if df is not None:
-                    st.success(f"✅ {len(df)} records")
+                    st.success(f"✅ {len(df)} records ({memory_usage_mb(df):.1f} MB in memory)")
         
         with col2:
             st.markdown("**Behavioral surveys**")
-            survey_files = st.file_uploader("Upload Survey CSVs", type=['csv'], accept_multiple_files=True, key="survey_upload")
+            survey_files = st.file_uploader("Upload Survey CSVs", type=['csv', 'parquet'], accept_multiple_files=True, key="survey_upload")
             if survey_files:
                 st.session_state.uploaded_datasets['surveys'] = survey_files
                 total_records = sum(len(processor.safe_read_csv(f)) for f in survey_files if processor.safe_read_csv(f) is not None)
@@ -381,17 +451,13 @@ def render_step1_ui():
                     if st.session_state.uploaded_datasets['knowbe4']:
                         status_text.text("Processing KnowBe4 data...")
                         progress_bar.progress(0.3)
-                        df = processor.safe_read_csv(st.session_state.uploaded_datasets['knowbe4'])
-                        if df is not None:
-                            processor.extract_knowledge_from_dataframe(df, "KnowBe4 Data")
+                        if processor.extract_knowledge_from_upload(st.session_state.uploaded_datasets['knowbe4'], "KnowBe4 Data") is not None:
                             datasets_processed += 1
                     
                     for i, file in enumerate(st.session_state.uploaded_datasets['surveys']):
                         status_text.text(f"Processing survey {i+1}...")
                         progress_bar.progress(0.3 + (0.3 * (i+1) / len(st.session_state.uploaded_datasets['surveys'])))
-                        df = processor.safe_read_csv(file)
-                        if df is not None:
-                            processor.extract_knowledge_from_dataframe(df, f"Survey_{i+1}")
+                        if processor.extract_knowledge_from_upload(file, f"Survey_{i+1}") is not None:
                             datasets_processed += 1
                     
                     for i, file in enumerate(st.session_state.uploaded_datasets['transcripts']):
@@ -399,12 +465,8 @@ def render_step1_ui():
                         progress_bar.progress(0.6 + (0.2 * (i+1) / len(st.session_state.uploaded_datasets['transcripts'])))
                         df = processor.safe_read_csv(file)
                         if df is not None and 'transcript_text' in df.columns:
-                            for _, row in df.iterrows():
-                                if pd.notna(row['transcript_text']) and len(str(row['transcript_text'])) > 50:
-                                    processor.vector_db.add_document(
-                                        str(row['transcript_text']),
-                                        {'type': 'qualitative_transcript', 'dataset': f'transcript_{i+1}'}
-                                    )
+                            # Role, age band etc. go into the metadata for persona-filtered retrieval
+                            processor.vector_db.add_documents(*transcript_documents(df, f'transcript_{i+1}'))
                             datasets_processed += 1
                     
                     status_text.text("Building vector index...")
@@ -415,6 +477,7 @@ def render_step1_ui():
                     progress_bar.progress(1.0)
                     
                     st.session_state.vector_knowledge_base = processor.vector_db
+                    st.session_state.analytics_catalog = processor.catalog
                     st.session_state.processing_complete = True
                     st.session_state.kb_created = True
                     
@@ -505,11 +568,46 @@ def render_step1_ui():
                     st.write("• Broader search terms")
                     st.write("• Rebuilding the search index")
         
+        catalog = st.session_state.get('analytics_catalog')
+        if catalog and catalog.has_dataset('knowbe4'):
+            render_exact_facts_ui(catalog)
+        
         # Next step
         st.markdown("---")
         if st.button("Go to Persona Generation", type="primary", use_container_width=True):
             st.session_state.current_page = "Persona Generation"
             st.rerun()
 
+def render_exact_facts_ui(catalog):
+    """Exact KnowBe4 outcome rates from the SQL catalog"""
+    st.markdown("---")
+    st.subheader("Exact Facts (SQL)")
+    st.caption("Exact outcome rates computed over every KnowBe4 record")
+    
+    filter_col1, filter_col2, filter_col3 = st.columns(3)
+    filters = {}
+    with filter_col1:
+        filters['department'] = st.selectbox("Department", [None] + catalog.distinct_values('knowbe4', 'Department'),
+                                             format_func=lambda v: v or "Any")
+        filters['title'] = st.selectbox("Title", [None] + catalog.distinct_values('knowbe4', 'Title'),
+                                        format_func=lambda v: v or "Any")
+    with filter_col2:
+        filters['template'] = st.selectbox("Template", [None] + catalog.distinct_values('knowbe4', 'Template'),
+                                           format_func=lambda v: v or "Any")
+        filters['difficulty'] = st.selectbox("Difficulty", [None] + catalog.distinct_values('knowbe4', 'Difficulty'),
+                                             format_func=lambda v: v or "Any")
+    with filter_col3:
+        training = st.selectbox("Training", ["Any", "After training", "Untrained / before training"])
+        filters['after_training'] = {"Any": None, "After training": True}.get(training, False)
+        group_by = st.selectbox("Group by", [None, 'Department', 'Title', 'Location', 'Template', 'Difficulty'],
+                                format_func=lambda v: v or "No grouping")
+    
+    if group_by:
+        result, elapsed_ms = catalog.timed_template('knowbe4_outcome_rates_by', group_by=group_by, **filters)
+    else:
+        result, elapsed_ms = catalog.timed_template('knowbe4_outcome_rates', **filters)
+    st.dataframe(result, use_container_width=True)
+    st.caption(f"Query time: {elapsed_ms:.1f} ms")
+
 if __name__ == "__main__":
     render_step1_ui()
\ No newline at end of file
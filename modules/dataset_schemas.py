@@ -0,0 +1,340 @@
+"""
+Dataset schema registry and compact dtype inference
+
+Known layouts (KnowBe4 exports and the three behavioral surveys) map each column
+to a compact dtype: low-cardinality strings to categoricals, flags to nullable
+booleans, timestamps to datetime64 and scores to float32/int16. Unknown layouts
+get the same treatment through inference.
+"""
+
+import importlib.util
+import os
+
+import pandas as pd
+
+# Opt-in Arrow-backed pandas engine (CYPERSONA_ARROW_ENGINE=1)
+ARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+USE_ARROW_ENGINE = ARROW_AVAILABLE and os.getenv("CYPERSONA_ARROW_ENGINE", "0") == "1"
+
+# Inference thresholds for unknown layouts
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+DATETIME_MIN_PARSE_RATIO = 0.95
+BOOLEAN_STRINGS = {'true': True, 'false': False, 'yes': True, 'no': False}
+
+KNOWBE4_DATE_FORMAT = '%m/%d/%Y'
+KNOWBE4_TIMESTAMP_FORMAT = '%m/%d/%Y %H:%M'
+SURVEY_TIMESTAMP_FORMAT = 'ISO8601'
+
+KNOWBE4_SCHEMA = {
+    'name': 'knowbe4',
+    'signature': ['User ID', 'Campaign Name', 'Clicked', 'Reported', 'Phish-prone Percentage'],
+    'columns': {
+        'User ID': 'category',
+        'Email': 'category',
+        'First Name': 'category',
+        'Last Name': 'category',
+        'Department': 'category',
+        'Title': 'category',
+        'Location': 'category',
+        'Campaign Name': 'category',
+        'Template': 'category',
+        'Sent Date': 'datetime64[ns]',
+        'Opened': 'boolean',
+        'Clicked': 'boolean',
+        'Replied': 'boolean',
+        'Attachment Opened': 'boolean',
+        'Macro Enabled': 'boolean',
+        'Data Entered': 'boolean',
+        'Reported': 'boolean',
+        'Time to Click (seconds)': 'float32',
+        'Time to Report (seconds)': 'float32',
+        'IP Address': 'category',
+        'Browser': 'category',
+        'Operating System': 'category',
+        'Delivery Status': 'category',
+        'Difficulty': 'category',
+        'Phish-prone Percentage': 'float32',
+        'Current Risk Score': 'float32',
+        'Previous Training Completed': 'boolean',
+        'Training Completion Date': 'datetime64[ns]',
+        'Groups': 'category',
+        'Manager Email': 'category',
+        'Employee ID': 'category',
+        'Hire Date': 'datetime64[ns]',
+        'Active Directory': 'boolean',
+        'Division': 'category',
+        'Cost Center': 'category',
+        'Custom Field 1': 'category',
+        'Custom Field 2': 'category',
+        'Baseline Test Score': 'Int16',
+        'Last Training Score': 'float32',
+        'Security Awareness Proficiency': 'category',
+        'Risk Level': 'category',
+        'Failure Count (12 months)': 'Int16',
+        'Success Count (12 months)': 'Int16',
+        'Last Failure Date': 'datetime64[ns]',
+        'Campaign Type': 'category',
+        'Industry Template': 'category',
+        'Language': 'category',
+        'Time Zone': 'category',
+        'Mobile Device': 'boolean',
+        'VPN Connection': 'boolean',
+        'Two Factor Enabled': 'boolean',
+        'Password Manager': 'boolean'
+    },
+    'date_formats': {
+        'Sent Date': KNOWBE4_TIMESTAMP_FORMAT,
+        'Training Completion Date': KNOWBE4_DATE_FORMAT,
+        'Hire Date': KNOWBE4_DATE_FORMAT,
+        'Last Failure Date': KNOWBE4_DATE_FORMAT
+    },
+    # Column roles used by the statistical digest (data_digest.py)
+    'roles': {
+        'outcomes': ['Clicked', 'Reported', 'Data Entered', 'Opened', 'Attachment Opened', 'Macro Enabled', 'Replied'],
+        'treatments': ['Previous Training Completed', 'Two Factor Enabled', 'Password Manager'],
+        'segments': ['Title', 'Department', 'Difficulty', 'Template', 'Location', 'Risk Level',
+                     'Security Awareness Proficiency', 'Campaign Type'],
+        'interventions': []
+    }
+}
+
+EMOTIONAL_SURVEY_SCHEMA = {
+    'name': 'survey_emotional_behavioral',
+    'signature': ['participant_code', 'ei_emotional_awareness', 'phishing_behavior_pre', 'phishing_behavior_post'],
+    'columns': {
+        'participant_code': 'category',
+        'job_level': 'category',
+        'industry_sector': 'category',
+        'team_size': 'Int16',
+        'intervention_approach': 'category',
+        'ei_emotional_awareness': 'Int8',
+        'ei_emotion_regulation': 'Int8',
+        'ei_empathy_understanding': 'Int8',
+        'ei_social_skills': 'Int8',
+        'pmt_threat_vulnerability': 'Int8',
+        'pmt_threat_severity': 'Int8',
+        'pmt_response_efficacy': 'Int8',
+        'pmt_self_efficacy': 'Int8',
+        'fear_arousal_intensity': 'Int8',
+        'phishing_behavior_pre': 'Int8',
+        'phishing_behavior_post': 'Int8',
+        'social_observational_learning': 'Int8',
+        'social_peer_modeling': 'Int8',
+        'social_reinforcement_response': 'Int8',
+        'trust_in_organization': 'Int8',
+        'shame_guilt_response': 'Int8',
+        'pride_accomplishment': 'Int8',
+        'anger_frustration_level': 'Int8',
+        'confidence_reporting': 'Int8',
+        'habit_formation_strength': 'Int8',
+        'behavioral_persistence_days': 'Int16',
+        'relapse_incidents': 'Int8',
+        'data_collection_date': 'datetime64[ns]'
+    },
+    'date_formats': {'data_collection_date': SURVEY_TIMESTAMP_FORMAT},
+    'roles': {
+        'outcomes': [], 'treatments': [],
+        'segments': ['job_level', 'industry_sector'],
+        'interventions': ['intervention_approach']
+    }
+}
+
+MOTIVATION_SURVEY_SCHEMA = {
+    'name': 'survey_motivation_attitude',
+    'signature': ['response_id', 'sdt_autonomy_pre', 'sdt_autonomy_post', 'tpb_behavioral_intention'],
+    'columns': {
+        'response_id': 'category',
+        'department': 'category',
+        'company_size': 'category',
+        'tenure_months': 'Int16',
+        'training_method': 'category',
+        'sdt_autonomy_pre': 'Int8',
+        'sdt_autonomy_post': 'Int8',
+        'sdt_competence_pre': 'Int8',
+        'sdt_competence_post': 'Int8',
+        'sdt_relatedness_pre': 'Int8',
+        'sdt_relatedness_post': 'Int8',
+        'tpb_attitude_reporting': 'Int8',
+        'tpb_subjective_norms': 'Int8',
+        'tpb_perceived_control': 'Int8',
+        'tpb_behavioral_intention': 'Int8',
+        'intrinsic_motivation_score': 'Int8',
+        'extrinsic_motivation_score': 'Int8',
+        'amotivation_score': 'Int8',
+        'cognitive_attitude_change': 'Int8',
+        'affective_attitude_change': 'Int8',
+        'goal_commitment_level': 'Int8',
+        'social_influence_susceptibility': 'Int8',
+        'reward_sensitivity': 'Int8',
+        'punishment_sensitivity': 'Int8',
+        'engagement_duration_minutes': 'float32',
+        'motivation_sustainability_weeks': 'Int16',
+        'completion_timestamp': 'datetime64[ns]'
+    },
+    'date_formats': {'completion_timestamp': SURVEY_TIMESTAMP_FORMAT},
+    'roles': {
+        'outcomes': [], 'treatments': [],
+        'segments': ['department', 'company_size'],
+        'interventions': ['training_method']
+    }
+}
+
+STRESS_SURVEY_SCHEMA = {
+    'name': 'survey_psychological_stress',
+    'signature': ['participant_id', 'pre_email_opening_anxiety', 'post_email_opening_anxiety'],
+    'columns': {
+        'participant_id': 'category',
+        'role': 'category',
+        'age_group': 'category',
+        'work_experience_years': 'Int16',
+        'education_level': 'category',
+        'intervention_type': 'category',
+        'pre_email_opening_anxiety': 'Int8',
+        'post_email_opening_anxiety': 'Int8',
+        'pre_decision_making_stress': 'Int8',
+        'post_decision_making_stress': 'Int8',
+        'pre_cognitive_mental_effort': 'Int8',
+        'post_cognitive_mental_effort': 'Int8',
+        'pre_information_confusion': 'Int8',
+        'post_information_confusion': 'Int8',
+        'pre_time_pressure_perception': 'Int8',
+        'post_time_pressure_perception': 'Int8',
+        'emotional_self_control': 'Int8',
+        'frustration_tolerance_level': 'Int8',
+        'physiological_heart_rate_change': 'float32',
+        'cortisol_level_change': 'float32',
+        'response_time_seconds': 'float32',
+        'accuracy_improvement': 'float32',
+        'survey_completion_date': 'datetime64[ns]'
+    },
+    'date_formats': {'survey_completion_date': SURVEY_TIMESTAMP_FORMAT},
+    'roles': {
+        'outcomes': [], 'treatments': [],
+        'segments': ['role', 'age_group', 'education_level'],
+        'interventions': ['intervention_type']
+    }
+}
+
+SCHEMA_REGISTRY = [KNOWBE4_SCHEMA, EMOTIONAL_SURVEY_SCHEMA, MOTIVATION_SURVEY_SCHEMA, STRESS_SURVEY_SCHEMA]
+
+
+def match_schema(columns):
+    """Return the registered schema whose signature columns are all present, if any"""
+    columns = set(columns)
+    for schema in SCHEMA_REGISTRY:
+        if set(schema['signature']) <= columns:
+            return schema
+    return None
+
+
+def _infer_column_dtype(series):
+    """Pick a compact dtype for a column of an unknown layout"""
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(series.dtype):
+        values = series.dropna()
+        if values.empty:
+            return 'Int16'
+        for dtype, bits in (('Int8', 8), ('Int16', 16), ('Int32', 32)):
+            if -2 ** (bits - 1) <= values.min() and values.max() < 2 ** (bits - 1):
+                return dtype
+        return 'Int64'
+    if pd.api.types.is_float_dtype(series.dtype):
+        return 'float32'
+    if not (pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)):
+        return None
+
+    values = series.dropna()
+    if values.empty:
+        return None
+    # Flags with nulls are read as objects; accept real booleans or true/false/yes/no strings
+    if values.map(lambda v: isinstance(v, bool) or str(v).strip().lower() in BOOLEAN_STRINGS).all():
+        return 'boolean'
+    sample = values.head(1000).astype(str)
+    if any(token in str(series.name).lower() for token in ('date', 'time', 'timestamp')):
+        parsed = pd.to_datetime(sample, errors='coerce', format='mixed')
+        if parsed.notna().mean() >= DATETIME_MIN_PARSE_RATIO:
+            return 'datetime64[ns]'
+    if values.nunique() <= CATEGORY_MAX_UNIQUE_RATIO * len(values):
+        return 'category'
+    return None
+
+
+def infer_schema(df, name='inferred'):
+    """Infer a schema (same shape as the registered ones) for an unknown layout"""
+    columns = {}
+    for col in df.columns:
+        dtype = _infer_column_dtype(df[col])
+        if dtype:
+            columns[col] = dtype
+    return {'name': name, 'signature': [], 'columns': columns, 'date_formats': {}}
+
+
+def _to_boolean(series):
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return series.astype('boolean')
+    mapped = series.map(lambda v: v if isinstance(v, bool) or pd.isna(v) else BOOLEAN_STRINGS.get(str(v).strip().lower()))
+    return mapped.astype('boolean')
+
+
+def apply_schema(df, schema=None, text_columns=()):
+    """Convert a dataframe to the compact dtypes of a schema (matched or inferred when omitted).
+
+    Columns listed in text_columns are kept as read.
+    """
+    schema = schema or match_schema(df.columns) or infer_schema(df)
+    df = df.copy()
+    for col, dtype in schema['columns'].items():
+        if col not in df.columns or col in text_columns or str(df[col].dtype) == dtype:
+            continue
+        try:
+            if dtype == 'boolean':
+                df[col] = _to_boolean(df[col])
+            elif dtype.startswith('datetime64'):
+                fmt = schema.get('date_formats', {}).get(col, 'mixed')
+                df[col] = pd.to_datetime(df[col], format=fmt, errors='coerce')
+            elif dtype == 'category':
+                df[col] = df[col].astype('category')
+            else:
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+        except (TypeError, ValueError):
+            # Leave columns that do not fit the declared type as read
+            continue
+    return df
+
+
+def read_csv_typed(file_obj, text_columns=()):
+    """Read a CSV straight into compact dtypes.
+
+    Registered layouts pass their dtypes to the parser so strings never become
+    Python objects first; unknown layouts are inferred after a default read.
+    Columns in text_columns are read as plain strings.
+    """
+    header = pd.read_csv(file_obj, nrows=0).columns
+    file_obj.seek(0)
+    schema = match_schema(header)
+    text_dtypes = {col: str for col in text_columns}
+
+    if USE_ARROW_ENGINE:
+        df = pd.read_csv(file_obj, engine='pyarrow', dtype_backend='pyarrow', dtype=text_dtypes or None)
+        return apply_schema(df, schema, text_columns)
+    if schema is None:
+        return apply_schema(pd.read_csv(file_obj, dtype=text_dtypes or None), text_columns=text_columns)
+
+    parse_dtypes = {
+        col: dtype for col, dtype in schema['columns'].items()
+        if col in header and not dtype.startswith('datetime64')
+    }
+    parse_dtypes.update(text_dtypes)
+    try:
+        df = pd.read_csv(file_obj, dtype=parse_dtypes)
+    except (TypeError, ValueError):
+        # A value did not fit its declared dtype; fall back to converting after a default read
+        file_obj.seek(0)
+        df = pd.read_csv(file_obj, dtype=text_dtypes or None)
+    return apply_schema(df, schema, text_columns)
+
+
+def memory_usage_mb(df):
+    """Deep memory footprint of a dataframe in megabytes"""
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
@@ -0,0 +1,164 @@
+"""
+Intervention × persona matrix cache
+
+Every cell of a matrix run (one intervention tested against one persona) is
+stored in SQLite under a hash of (intervention text, persona ID and version,
+knowledge-base version, model, prompt version). Re-running a grid with one new
+intervention only computes the new row, and an edited persona only its column.
+A run records its grid when it starts; since each cell is committed as it
+finishes, a run interrupted by a crash resumes with just the missing cells.
+Runs belong to the browser session that started them, which can resume them
+or mark them abandoned; cells are shared by everyone.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+MATRIX_CACHE_PATH = Path(os.getenv("CYPERSONA_MATRIX_CACHE_PATH", ".cache/intervention_matrix.sqlite"))
+
+
+def text_hash(text):
+    return hashlib.sha256(text.strip().encode()).hexdigest()[:16]
+
+
+def persona_version(persona):
+    """Identity of a persona as tested: its ID plus its edit version"""
+    return f"{persona['id']}:{persona.get('version', 0)}"
+
+
+def cell_key(intervention_hash, persona_version, kb_version, model, prompt_version):
+    payload = json.dumps([intervention_hash, persona_version, kb_version, model, prompt_version])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class MatrixStore:
+    """Cached matrix cells plus run checkpoints"""
+
+    def __init__(self, path=MATRIX_CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS cells (
+                key TEXT PRIMARY KEY,
+                intervention_hash TEXT NOT NULL,
+                persona_version TEXT NOT NULL,
+                kb_version TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prediction TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                job_id TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                cells_total INTEGER NOT NULL,
+                spec TEXT NOT NULL,
+                session_id TEXT
+            )"""
+        )
+        # Run tables created before runs recorded their session
+        if 'session_id' not in {row['name'] for row in self._conn.execute("PRAGMA table_info(runs)")}:
+            self._conn.execute("ALTER TABLE runs ADD COLUMN session_id TEXT")
+        self._conn.commit()
+
+    # -- cells --------------------------------------------------------------
+
+    def get_cells(self, keys):
+        """{key: prediction} for the keys already computed"""
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, prediction FROM cells WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update({row['key']: row['prediction'] for row in rows})
+        return found
+
+    def save_cell(self, key, intervention_hash, persona_version, kb_version, model, prediction):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cells (key, intervention_hash, persona_version, kb_version, model, prediction, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, intervention_hash, persona_version, kb_version, model, prediction, datetime.now().isoformat())
+            )
+            self._conn.commit()
+
+    def cell_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cells").fetchone()[0]
+
+    # -- runs ---------------------------------------------------------------
+
+    def create_run(self, spec, cells_total, job_id=None, session_id=None):
+        """Checkpoint a grid (interventions, persona IDs, knowledge base) before computing it"""
+        run_id = str(uuid.uuid4())[:8]
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO runs (run_id, status, job_id, created_at, updated_at, cells_total, spec, session_id) "
+                "VALUES (?, 'running', ?, ?, ?, ?, ?, ?)",
+                (run_id, job_id, now, now, cells_total, json.dumps(spec), session_id)
+            )
+            self._conn.commit()
+        return run_id
+
+    def update_run(self, run_id, status=None, job_id=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET status = COALESCE(?, status), job_id = COALESCE(?, job_id), updated_at = ? "
+                "WHERE run_id = ?",
+                (status, job_id, datetime.now().isoformat(), run_id)
+            )
+            self._conn.commit()
+
+    def get_run(self, run_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        run = dict(row)
+        run['spec'] = json.loads(run['spec'])
+        return run
+
+    def abandon_run(self, run_id):
+        """Stop offering a run for resumption (its cached cells stay)"""
+        self.update_run(run_id, status='abandoned')
+
+    def unfinished_runs(self, session_id, limit=10):
+        """A session's runs that were started but neither completed nor abandoned (newest first)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT run_id, status, job_id, created_at, cells_total, spec FROM runs "
+                "WHERE status NOT IN ('completed', 'abandoned') AND session_id = ? "
+                "ORDER BY created_at DESC LIMIT ?", (session_id, limit)
+            ).fetchall()
+        return [{**dict(row), 'spec': json.loads(row['spec'])} for row in rows]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_matrix_store():
+    """Process-wide matrix cache"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MatrixStore()
+        return _store
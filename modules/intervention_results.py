@@ -0,0 +1,93 @@
+"""
+Columnar table of intervention test results
+
+Predictions are parsed into typed scores once, when they are generated
+(intervention_testing.prediction_entry). This module lays those scores out as
+one row per (test, persona) with categorical dimensions and float32 score
+columns, so aggregates such as mean effectiveness by industry or intervention
+type are vectorized group-bys instead of re-reads of the prediction text.
+Ensemble predictions also carry a small-sample (Student t) confidence interval
+per score, with the sample variance shrunk toward a prior spread so that a few
+agreeing samples do not yield a zero-width interval.
+"""
+
+import numpy as np
+import pandas as pd
+
+SCORE_COLUMNS = {'engagement_pct': 'Engagement (%)', 'effectiveness_score': 'Effectiveness (0-10)'}
+CI_LEVEL = 0.9
+# Two-sided 90% Student t critical values by degrees of freedom (normal beyond the table)
+T_CRITICAL_90 = {1: 6.314, 2: 2.920, 3: 2.353, 4: 2.132, 5: 2.015, 6: 1.943, 7: 1.895, 8: 1.860, 9: 1.833,
+                 10: 1.812, 12: 1.782, 15: 1.753, 20: 1.725, 30: 1.697}
+# Typical sample-to-sample spread of each score, worth one pseudo-observation of variance
+SCORE_PRIOR_STD = {'engagement_pct': 10.0, 'effectiveness_score': 1.0}
+DIMENSIONS = {
+    'persona_industry': 'Industry',
+    'intervention_type': 'Intervention type',
+    'target_behavior': 'Target behavior',
+    'delivery_method': 'Delivery method',
+    'test_id': 'Test'
+}
+
+
+def results_frame(test_results):
+    """One row per persona result across test records (NaN where a score is missing)"""
+    columns = {name: [] for name in ['test_id', 'intervention_type', 'target_behavior', 'delivery_method',
+                                     'persona_id', 'persona_name', 'persona_industry', 'timestamp']}
+    scores = {name: [] for name in SCORE_COLUMNS}
+    scores.update({f"{name}_{bound}": [] for name in SCORE_COLUMNS for bound in ('low', 'high')})
+    samples = []
+    for test in test_results:
+        for persona_id, result in test['results'].items():
+            columns['test_id'].append(test['test_id'])
+            columns['intervention_type'].append(test.get('intervention_type'))
+            columns['target_behavior'].append(test.get('target_behavior'))
+            columns['delivery_method'].append(test.get('delivery_method'))
+            columns['persona_id'].append(persona_id)
+            columns['persona_name'].append(result['persona_name'])
+            columns['persona_industry'].append(result['persona_industry'])
+            columns['timestamp'].append(test['timestamp'])
+            for name in SCORE_COLUMNS:
+                scores[name].append(np.nan if result.get(name) is None else result[name])
+                low, high = result.get(f"{name}_ci") or (None, None)
+                scores[f"{name}_low"].append(np.nan if low is None else low)
+                scores[f"{name}_high"].append(np.nan if high is None else high)
+            samples.append(result.get('samples', 1))
+    frame = pd.DataFrame({name: pd.Categorical(values) for name, values in columns.items()
+                          if name not in ('persona_name', 'timestamp')})
+    frame['persona_name'] = columns['persona_name']
+    frame['timestamp'] = pd.to_datetime(pd.Series(columns['timestamp'], dtype=object), errors='coerce',
+                                        format='ISO8601')
+    for name, values in scores.items():
+        frame[name] = np.asarray(values, dtype=np.float32)
+    frame['samples'] = np.asarray(samples, dtype=np.int16)
+    return frame
+
+
+def mean_ci(values, prior_std, prior_weight=1.0):
+    """90% t interval of the mean of values (None entries ignored).
+
+    The sample variance is pooled with prior_std**2 weighted as prior_weight
+    observations, so two or three identical samples still give a wide interval.
+    Returns (low, high), or None with fewer than two values.
+    """
+    values = np.asarray([value for value in values if value is not None], dtype=np.float64)
+    n = len(values)
+    if n < 2:
+        return None
+    variance = (prior_weight * prior_std ** 2 + (n - 1) * values.var(ddof=1)) / (prior_weight + n - 1)
+    t = next((T_CRITICAL_90[df] for df in sorted(T_CRITICAL_90) if df >= n - 1), 1.645)
+    half_width = t * np.sqrt(variance / n)
+    mean = values.mean()
+    return float(mean - half_width), float(mean + half_width)
+
+
+def aggregate_results(frame, by='persona_industry'):
+    """Mean and count of every score per value of a dimension"""
+    grouped = frame.groupby(by, observed=True)
+    summary = grouped[list(SCORE_COLUMNS)].mean().astype('float64').round(2)
+    summary.columns = [f"Mean {SCORE_COLUMNS[name]}" for name in SCORE_COLUMNS]
+    summary.insert(0, 'Predictions', grouped.size())
+    summary.insert(1, 'Scored', grouped['effectiveness_score'].count())
+    summary.index.name = DIMENSIONS.get(by, by)
+    return summary.sort_values(summary.columns[-1], ascending=False)
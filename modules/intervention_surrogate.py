@@ -0,0 +1,188 @@
+"""
+Surrogate model for pre-screening interventions
+
+A Bayesian ridge regression, trained on accumulated test results, predicts the
+engagement and effectiveness scores of an (intervention, persona) pair from the
+persona's trait vector and the intervention's type, target behavior, delivery
+method and text embedding (plus trait interactions with each). Scoring a whole
+candidate grid is a couple of matrix products, so hundreds of wordings can be
+ranked locally and only the most promising or most uncertain pairs sent to the
+LLM. Every prediction carries a predictive standard deviation for that choice.
+"""
+
+import numpy as np
+import pandas as pd
+
+from intervention_results import SCORE_COLUMNS, results_frame
+from persona_traits import TRAIT_KEYS, trait_vector
+
+RIDGE_ALPHA = 10.0
+EMBEDDING_FEATURES = 16
+CATEGORY_FIELDS = ['intervention_type', 'target_behavior', 'delivery_method']
+# Scale and uninformed prior of each score (used until there is training data), and its valid range
+SCORE_SCALE = {'engagement_pct': (50.0, 20.0), 'effectiveness_score': (5.0, 2.0)}
+SCORE_RANGES = {'engagement_pct': (0.0, 100.0), 'effectiveness_score': (0.0, 10.0)}
+TRAIT_CENTER, TRAIT_SCALE = 5.0, 2.5
+INTERVAL_Z = 1.645  # two-sided 90% interval
+
+
+def training_rows(test_results, personas):
+    """One row per scored persona result: intervention fields, persona ID and scores.
+
+    personas maps persona ID to record; results for personas no longer in it are dropped.
+    """
+    frame = results_frame(test_results)
+    if frame.empty:
+        return pd.DataFrame(columns=['intervention', *CATEGORY_FIELDS, 'persona_id', *SCORE_COLUMNS])
+    texts = {test['test_id']: test['intervention'] for test in test_results}
+    rows = pd.DataFrame({
+        'intervention': frame['test_id'].astype(str).map(texts),
+        **{field: frame[field].astype(object) for field in CATEGORY_FIELDS},
+        'persona_id': frame['persona_id'].astype(str),
+        **{name: frame[name].astype('float64') for name in SCORE_COLUMNS}
+    })
+    rows = rows[rows['persona_id'].isin(list(personas)) & rows[list(SCORE_COLUMNS)].notna().all(axis=1)]
+    return rows.reset_index(drop=True)
+
+
+def _interactions(traits, features):
+    """Row-wise outer product of trait and intervention features, flattened"""
+    return (traits[:, :, None] * features[:, None, :]).reshape(len(traits), traits.shape[1] * features.shape[1])
+
+
+class InterventionSurrogate:
+    """Ridge regression over persona traits and intervention features, with predictive uncertainty"""
+
+    def __init__(self, personas, embeddings=None, alpha=RIDGE_ALPHA):
+        """personas: {persona_id: record}; embeddings: {intervention text: vector} (optional)"""
+        self.traits = {persona_id: self._traits(persona) for persona_id, persona in personas.items()}
+        self.embeddings = embeddings or {}
+        self.alpha = alpha
+        self.vocabularies = {field: [] for field in CATEGORY_FIELDS}
+        self.projection = None
+        dimension = len(next(iter(self.embeddings.values()))) if self.embeddings else 0
+        if dimension:
+            rng = np.random.default_rng(0)
+            self.projection = rng.standard_normal((dimension, EMBEDDING_FEATURES)) / np.sqrt(EMBEDDING_FEATURES)
+        self.rows = 0
+        self.weights = None
+
+    @staticmethod
+    def _traits(persona):
+        traits = trait_vector(persona).astype(np.float64)
+        return (np.where(np.isnan(traits), TRAIT_CENTER, traits) - TRAIT_CENTER) / TRAIT_SCALE
+
+    def features(self, rows):
+        """Design matrix of a frame with intervention, category and persona_id columns"""
+        n = len(rows)
+        # Look each persona and wording up once, then broadcast to its rows
+        codes, persona_ids = pd.factorize(rows['persona_id'])
+        traits = np.stack([self.traits[persona_id] for persona_id in persona_ids])[codes] if n \
+            else np.zeros((0, len(TRAIT_KEYS)))
+        blocks = [np.ones((n, 1)), traits]
+        for field in CATEGORY_FIELDS:
+            onehot = np.zeros((n, len(self.vocabularies[field])))
+            codes = pd.Categorical(rows[field].astype(str), categories=self.vocabularies[field]).codes
+            onehot[np.flatnonzero(codes >= 0), codes[codes >= 0]] = 1.0
+            blocks += [onehot, _interactions(traits, onehot)]
+        if self.projection is not None:
+            codes, texts = pd.factorize(rows['intervention'])
+            zero = np.zeros(self.projection.shape[0])
+            text = np.stack([np.asarray(self.embeddings.get(text, zero)) for text in texts])[codes] if n \
+                else np.zeros((0, self.projection.shape[0]))
+            text = text @ self.projection
+            blocks += [text, _interactions(traits, text)]
+        return np.hstack(blocks)
+
+    def fit(self, rows):
+        """Fit both score models on training rows (see training_rows)"""
+        for field in CATEGORY_FIELDS:
+            self.vocabularies[field] = sorted({str(value) for value in rows[field] if value is not None})
+        X = self.features(rows)
+        self.rows = len(rows)
+        self.centers = np.array([SCORE_SCALE[name][0] if rows.empty else rows[name].mean() for name in SCORE_COLUMNS])
+        self.scales = np.array([SCORE_SCALE[name][1] for name in SCORE_COLUMNS])
+        Y = (rows[list(SCORE_COLUMNS)].to_numpy(dtype=np.float64) - self.centers) / self.scales
+        self.precision = np.linalg.inv(X.T @ X + self.alpha * np.eye(X.shape[1]))
+        self.weights = self.precision @ X.T @ Y
+        # Noise level from the residuals, using the effective degrees of freedom of the fit
+        if self.rows:
+            dof = np.trace(X @ self.precision @ X.T)
+            residual = ((Y - X @ self.weights) ** 2).sum(axis=0) / max(self.rows - dof, 1.0)
+            self.noise = np.sqrt(np.maximum(residual, 0.05 ** 2))
+        else:
+            self.noise = np.ones(len(SCORE_COLUMNS))
+        return self
+
+    def predict(self, rows):
+        """Frame of predicted mean and std for every score of every row"""
+        X = self.features(rows)
+        means = X @ self.weights * self.scales + self.centers
+        spread = np.sqrt(1.0 + ((X @ self.precision) * X).sum(axis=1))[:, None]
+        stds = spread * self.noise * self.scales
+        predictions = pd.DataFrame(index=rows.index)
+        for k, name in enumerate(SCORE_COLUMNS):
+            predictions[name] = np.clip(means[:, k], *SCORE_RANGES[name])
+            predictions[f"{name}_std"] = stds[:, k]
+        return predictions
+
+
+def candidate_rows(candidates, details, persona_ids):
+    """Every (candidate text, persona) pair, with the shared intervention details"""
+    pairs = [(i, j) for i in range(len(candidates)) for j in range(len(persona_ids))]
+    return pd.DataFrame({
+        'candidate': [i for i, _ in pairs],
+        'persona': [j for _, j in pairs],
+        'intervention': [candidates[i] for i, _ in pairs],
+        **{field: details.get(field) for field in CATEGORY_FIELDS},
+        'persona_id': [persona_ids[j] for _, j in pairs]
+    })
+
+
+def select_pairs(predictions, k, exploration=1.0, exclude=(), score='effectiveness_score'):
+    """Indices of the k rows with the highest upper confidence bound (mean + exploration × std).
+
+    exploration 0 picks the most promising pairs; larger values favor the most uncertain ones.
+    """
+    bound = predictions[score] + exploration * predictions[f"{score}_std"]
+    bound = bound.drop(index=[index for index in exclude if index in bound.index])
+    return bound.nlargest(k).index.tolist()
+
+
+def accuracy_report(rows, personas, embeddings=None, folds=5, alpha=RIDGE_ALPHA):
+    """Cross-validated accuracy of the surrogate per score.
+
+    Folds are grouped by intervention text, so the report measures how well scores
+    of unseen wordings are predicted. Compared against predicting the training mean.
+    """
+    groups = rows['intervention'].astype(str).to_numpy()
+    wordings = pd.unique(groups)
+    folds = min(folds, len(wordings))
+    if folds < 2:
+        return None
+    fold_of = {wording: k % folds for k, wording in enumerate(wordings)}
+    assignment = np.array([fold_of[group] for group in groups])
+    predicted = pd.DataFrame(index=rows.index, columns=[f"{name}{suffix}" for name in SCORE_COLUMNS
+                                                       for suffix in ('', '_std', '_baseline')], dtype=np.float64)
+    for k in range(folds):
+        train, test = rows[assignment != k], rows[assignment == k]
+        fold_predictions = InterventionSurrogate(personas, embeddings, alpha).fit(train).predict(test)
+        for name in SCORE_COLUMNS:
+            predicted.loc[test.index, name] = fold_predictions[name]
+            predicted.loc[test.index, f"{name}_std"] = fold_predictions[f"{name}_std"]
+            predicted.loc[test.index, f"{name}_baseline"] = train[name].mean()
+
+    report = {}
+    for name, label in SCORE_COLUMNS.items():
+        actual, estimate = rows[name], predicted[name]
+        error = estimate - actual
+        report[label] = {
+            'MAE': error.abs().mean(),
+            'RMSE': np.sqrt((error ** 2).mean()),
+            'Baseline MAE': (predicted[f"{name}_baseline"] - actual).abs().mean(),
+            'Rank correlation': actual.rank().corr(estimate.rank()),
+            '90% interval coverage': (error.abs() <= INTERVAL_Z * predicted[f"{name}_std"]).mean()
+        }
+    frame = pd.DataFrame(report).T.astype('float64').round(3)
+    frame.insert(0, 'Pairs', len(rows))
+    return frame
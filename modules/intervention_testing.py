@@ -11,16 +11,54 @@ import os
 from dotenv import load_dotenv
 import plotly.express as px
 import plotly.graph_objects as go
+import re
 import uuid
+import asyncio
+import time
 from datetime import datetime
-import together
+import numpy as np
 
 load_dotenv()
 
+from llm_clients import get_llm_clients, TOGETHER_MODEL, CHAT_CONCURRENCY
+from llm_cache import DETERMINISTIC_SEED
+from persona_schema import SCORE_FIELDS, persona_profile, persona_prompt_text, persona_score
+from context_packing import CANDIDATE_COUNT, lexical_vectors, pack_context
+from sharded_ingestion import age_band, role_family
+from persona_store import get_persona_store
+from intervention_results import (
+    CI_LEVEL, DIMENSIONS, SCORE_COLUMNS, SCORE_PRIOR_STD, aggregate_results, mean_ci, results_frame
+)
+from intervention_surrogate import InterventionSurrogate, accuracy_report, candidate_rows, select_pairs, training_rows
+from intervention_matrix import cell_key, get_matrix_store, persona_version, text_hash
+from job_runner import ACTIVE_STATUSES, current_session_id, get_job_runner, render_job_history, render_job_panel
+
+# A failed prediction is retried on its own (after the SDK's own retries), with exponential backoff
+PREDICTION_RETRIES = int(os.getenv("CYPERSONA_PREDICTION_RETRIES", "2"))
+RETRY_BACKOFF = float(os.getenv("CYPERSONA_RETRY_BACKOFF", "1.0"))
+
+# Persona-specific grounding added to the shared intervention context
+DELTA_TOKEN_BUDGET = int(os.getenv("CYPERSONA_DELTA_TOKENS", "300"))
+DELTA_CANDIDATES = 4
+
+# Ensemble predictions: samples per (intervention, persona) pair and the CI width at which sampling stops.
+# Each sample has its own seed, so an ensemble is reproducible and served from the response cache.
+# With the prior-pooled t interval, agreeing samples reach the Standard widths at 3 and the Detailed ones at 4.
+ENSEMBLE_PROFILES = {
+    'Quick': None,
+    'Standard': {'min_samples': 3, 'max_samples': 6, 'step': 1,
+                 'max_width': {'engagement_pct': 20.0, 'effectiveness_score': 2.0}},
+    'Detailed': {'min_samples': 4, 'max_samples': 10, 'step': 2,
+                 'max_width': {'engagement_pct': 12.0, 'effectiveness_score': 1.2}}
+}
+
+# Part of every matrix cell key: bump when build_prediction_prompt changes so cached cells are recomputed
+PREDICTION_PROMPT_VERSION = 1
+
 class InterventionTester:
     def __init__(self):
-        self.model_name = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo"
-        self.together_client = None
+        self.model_name = TOGETHER_MODEL
+        self.llm = None
         self.together_api_key = os.getenv("TOGETHER_API_KEY")
 
     def check_api_connection(self):
@@ -30,7 +68,7 @@ class InterventionTester:
             return False
         
         try:
-            self.together_client = together.Together(api_key=self.together_api_key)
+            self.llm = get_llm_clients()
             return True
         except Exception as e:
             st.error(f"Failed to connect to Together AI: {e}")
@@ -38,7 +76,190 @@ class InterventionTester:
 
     def test_intervention(self, intervention_description, persona_description, knowledge_base):
         """Test intervention against persona using knowledge base"""
-        prompt = f"""
+        return self._query_llm(self.build_prediction_prompt(intervention_description, persona_description, knowledge_base))
+
+    def test_intervention_many(self, intervention_description, persona_descriptions, knowledge_base,
+                               max_concurrency=CHAT_CONCURRENCY, knowledge_deltas=None):
+        """Test one intervention against many personas concurrently.
+        
+        Yields (index, prediction) as each completion finishes, up to max_concurrency
+        in flight, so a wide test takes roughly as long as one call. Failed predictions
+        are retried individually; one that keeps failing yields its "Error: ..." text.
+        knowledge_deltas optionally adds persona-specific context (one per persona)
+        to the shared knowledge_base.
+        """
+        persona_descriptions = list(persona_descriptions)
+        if not self.llm and not self.check_api_connection():
+            for index in range(len(persona_descriptions)):
+                yield index, "API connection failed"
+            return
+        
+        knowledge_deltas = knowledge_deltas or [""] * len(persona_descriptions)
+        coros = [
+            self._query_llm_with_retries(self.build_prediction_prompt(
+                intervention_description, persona_description, combine_context(knowledge_base, delta)
+            ))
+            for persona_description, delta in zip(persona_descriptions, knowledge_deltas)
+        ]
+        for index, prediction in self.llm.iter_completed(coros, max_concurrency):
+            if isinstance(prediction, Exception):
+                prediction = f"Error: {str(prediction)}"
+            yield index, prediction
+
+    def test_matrix(self, interventions, personas, knowledge_base, matrix_store=None, max_concurrency=CHAT_CONCURRENCY,
+                    vector_db=None, pairs=None):
+        """Test every intervention text against every persona record, reusing cached cells.
+        
+        pairs optionally restricts the grid to some (intervention_index, persona_index) cells.
+        Yields (intervention_index, persona_index, prediction, cached): cached cells first,
+        then new ones as they finish. Each new cell is saved right away, so a grid that
+        is interrupted resumes with only its missing cells; failed cells are not cached.
+        With vector_db, rows that still have missing cells are grounded by retrieval
+        (once per intervention) and the knowledge-base contents are part of the key.
+        """
+        matrix_store = matrix_store or get_matrix_store()
+        kb_version = text_hash(knowledge_base if vector_db is None else f"{knowledge_base}|{vector_db.version()}")
+        intervention_hashes = [text_hash(intervention) for intervention in interventions]
+        persona_versions = [persona_version(persona) for persona in personas]
+        if pairs is None:
+            pairs = [(i, j) for i in range(len(interventions)) for j in range(len(personas))]
+        cells = [
+            (i, j, cell_key(intervention_hashes[i], persona_versions[j], kb_version, self.model_name, PREDICTION_PROMPT_VERSION))
+            for i, j in pairs
+        ]
+        cached = matrix_store.get_cells(key for _, _, key in cells)
+        for i, j, key in cells:
+            if key in cached:
+                yield i, j, cached[key], True
+        
+        missing = [cell for cell in cells if cell[2] not in cached]
+        if not missing:
+            return
+        if not self.llm and not self.check_api_connection():
+            for i, j, _ in missing:
+                yield i, j, "API connection failed", False
+            return
+        
+        rows = sorted({i for i, _, _ in missing})
+        groundings = dict(zip(rows, self.retrieve_grounding([interventions[i] for i in rows], vector_db, personas)
+                              if vector_db is not None else [("", {})] * len(rows)))
+        persona_texts = [persona_prompt_text(persona) for persona in personas]
+        coros = [
+            self._query_llm_with_retries(self.build_prediction_prompt(
+                interventions[i], persona_texts[j],
+                combine_context(groundings[i][0], knowledge_base, groundings[i][1].get(personas[j]['id']))
+            ))
+            for i, j, _ in missing
+        ]
+        for index, prediction in self.llm.iter_completed(coros, max_concurrency):
+            i, j, key = missing[index]
+            if isinstance(prediction, Exception):
+                prediction = f"Error: {str(prediction)}"
+            if not prediction.startswith(("Error:", "API connection failed")):
+                matrix_store.save_cell(key, intervention_hashes[i], persona_versions[j], kb_version, self.model_name,
+                                       prediction)
+            yield i, j, prediction, False
+
+    def test_intervention_ensemble(self, intervention_description, persona_descriptions, knowledge_base,
+                                   max_concurrency=CHAT_CONCURRENCY, knowledge_deltas=None, profile='Standard'):
+        """Like test_intervention_many, but each persona gets an adaptive ensemble of samples.
+        
+        Yields (index, ensemble) where ensemble is the dict returned by _predict_ensemble.
+        Pairs are fanned out so that about max_concurrency completions are in flight.
+        """
+        settings = ENSEMBLE_PROFILES[profile]
+        persona_descriptions = list(persona_descriptions)
+        if not self.llm and not self.check_api_connection():
+            for index in range(len(persona_descriptions)):
+                yield index, {'prediction': "API connection failed", 'samples': 0, 'scores': {}}
+            return
+        
+        knowledge_deltas = knowledge_deltas or [""] * len(persona_descriptions)
+        coros = [
+            self._predict_ensemble(self.build_prediction_prompt(
+                intervention_description, persona_description, combine_context(knowledge_base, delta)
+            ), **settings)
+            for persona_description, delta in zip(persona_descriptions, knowledge_deltas)
+        ]
+        for index, ensemble in self.llm.iter_completed(coros, max(1, max_concurrency // settings['min_samples'])):
+            if isinstance(ensemble, Exception):
+                ensemble = {'prediction': f"Error: {str(ensemble)}", 'samples': 0, 'scores': {}}
+            yield index, ensemble
+
+    async def _predict_ensemble(self, prompt, min_samples, max_samples, step, max_width):
+        """Sample one prompt until every score's confidence interval is narrow enough.
+        
+        Starts with min_samples concurrent samples, then adds step at a time up to
+        max_samples. Returns {'prediction': the sample closest to the mean scores,
+        'samples': calls made, 'scores': {score: [per-sample values]}, '<score>': mean,
+        '<score>_ci': (low, high) or None}.
+        """
+        predictions, parsed = [], []
+        while True:
+            batch = min_samples if not predictions else min(step, max_samples - len(predictions))
+            seeds = range(DETERMINISTIC_SEED + len(predictions), DETERMINISTIC_SEED + len(predictions) + batch)
+            for prediction in await asyncio.gather(*[self._query_llm_with_retries(prompt, seed=seed) for seed in seeds]):
+                predictions.append(prediction)
+                parsed.append(parse_prediction(prediction))
+            intervals = {key: mean_ci([scores[key] for scores in parsed], SCORE_PRIOR_STD[key]) for key in SCORE_COLUMNS}
+            narrow = all(interval is not None and interval[1] - interval[0] <= max_width[key]
+                         for key, interval in intervals.items())
+            if narrow or len(predictions) >= max_samples:
+                break
+        
+        ensemble = {'samples': len(predictions), 'scores': {key: [scores[key] for scores in parsed] for key in SCORE_COLUMNS}}
+        for key in SCORE_COLUMNS:
+            values = [value for value in ensemble['scores'][key] if value is not None]
+            ensemble[key] = round(sum(values) / len(values), 2) if values else None
+            ensemble[f"{key}_ci"] = tuple(round(bound, 2) for bound in intervals[key]) if intervals[key] else None
+        
+        # Representative text: the successful sample whose scores are closest to the ensemble means
+        def distance(index):
+            scores = parsed[index]
+            if predictions[index].startswith(("Error:", "API connection failed")):
+                return float('inf')
+            return sum(abs(scores[key] - ensemble[key]) / (100 if key == 'engagement_pct' else 10)
+                       if scores[key] is not None and ensemble[key] is not None else 1.0 for key in SCORE_COLUMNS)
+        ensemble['prediction'] = predictions[min(range(len(predictions)), key=distance)]
+        return ensemble
+
+    def retrieve_grounding(self, interventions, vector_db, personas=()):
+        """Research grounding for each intervention, retrieved once and shared by every persona.
+        
+        All interventions are embedded in one request, then each is searched and packed
+        once. Persona-specific deltas reuse that embedding for transcript lookups filtered
+        on the persona's role family (or else age band), one lookup per distinct segment.
+        Returns [(shared_context, {persona_id: delta})], empty when retrieval fails.
+        """
+        interventions = list(interventions)
+        if not interventions or vector_db is None or not getattr(vector_db, 'documents', None):
+            return [("", {})] * len(interventions)
+        if not self.llm and not self.check_api_connection():
+            return [("", {})] * len(interventions)
+        queries = [f"{intervention} cybersecurity intervention behavior change" for intervention in interventions]
+        try:
+            query_vectors = self.llm.run(self.llm.embed(queries))
+        except Exception:
+            return [("", {})] * len(interventions)
+        
+        segments = {persona['id']: persona_segment(persona) for persona in personas}
+        groundings = []
+        for query, query_vector in zip(queries, query_vectors):
+            results = vector_db.search_embedding(query_vector, top_k=CANDIDATE_COUNT)
+            shared = pack_context(query, results, vectors=vector_db.result_vectors(results), query_vector=query_vector)
+            shared_indexes = {result['index'] for result in results}
+            deltas = {segment: segment_delta(vector_db, query, query_vector, segment, shared_indexes)
+                      for segment in set(segments.values())}
+            groundings.append((shared, {persona_id: deltas[segment] for persona_id, segment in segments.items()
+                                        if deltas[segment]}))
+        return groundings
+
+    def test_intervention_stream(self, intervention_description, persona_description, knowledge_base):
+        """Yield the prediction text accumulated so far as tokens arrive"""
+        yield from self._stream_llm(self.build_prediction_prompt(intervention_description, persona_description, knowledge_base))
+
+    def build_prediction_prompt(self, intervention_description, persona_description, knowledge_base):
+        return f"""
         You are a cybersecurity research expert. Predict intervention outcomes.
 
         INTERVENTION DESCRIPTION:
@@ -60,30 +281,404 @@ class InterventionTester:
 
         Format response as structured analysis with clear sections and specific percentages/scores.
         """
-        
-        return self._query_llm(prompt)
 
     def _query_llm(self, prompt):
         """Query Together AI LLM"""
-        if not self.together_client:
+        if not self.llm:
             if not self.check_api_connection():
                 return "API connection failed"
         
+        return self.llm.run(self._query_llm_async(prompt))
+
+    def _stream_llm(self, prompt):
+        """Stream Together AI LLM output, yielding the accumulated text"""
+        if not self.llm:
+            if not self.check_api_connection():
+                yield "API connection failed"
+                return
+        
+        text = ""
         try:
-            response = self.together_client.chat.completions.create(
+            for delta in self.llm.iter_stream(self.llm.stream_chat(
+                prompt, model=self.model_name, max_tokens=600, temperature=0.7
+            )):
+                text += delta
+                yield text
+        except Exception as e:
+            yield f"{text}\nError: {str(e)}" if text else f"Error: {str(e)}"
+
+    async def _query_llm_async(self, prompt):
+        """Query Together AI LLM from a coroutine (for asyncio.gather fan-out)"""
+        try:
+            return await self.llm.chat(
+                prompt,
                 model=self.model_name,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
                 max_tokens=600,
-                temperature=0.7,
-                stream=False
+                temperature=0.7
             )
-            
-            return response.choices[0].message.content
         except Exception as e:
             return f"Error: {str(e)}"
 
+    async def _query_llm_with_retries(self, prompt, retries=PREDICTION_RETRIES, seed=None):
+        """Query the LLM, retrying this prompt alone when it fails"""
+        params = {'seed': seed} if seed is not None else {}
+        for attempt in range(retries + 1):
+            try:
+                return await self.llm.chat(prompt, model=self.model_name, max_tokens=600, temperature=0.7, **params)
+            except Exception as e:
+                if attempt == retries:
+                    return f"Error: {str(e)}"
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+def combine_context(*parts):
+    """Join the non-empty context blocks of a prediction prompt"""
+    return "\n\n".join(part.strip() for part in parts if part and part.strip())
+
+def persona_segment(persona):
+    """(role family, age band) of a persona, matching the transcript metadata"""
+    profile = persona_profile(persona)
+    return role_family(profile.get('job_title') or ''), age_band(profile.get('age'))
+
+def segment_delta(vector_db, query, query_vector, segment, exclude=()):
+    """Transcript evidence from participants like the persona, not already in the shared context"""
+    family, band = segment
+    for field, value in (('role_family', family), ('age_band', band)):
+        if not value:
+            continue
+        results = [
+            result for result in vector_db.search_embedding(
+                query_vector, top_k=DELTA_CANDIDATES, where={'type': 'qualitative_transcript', field: value})
+            if result['index'] not in exclude
+        ]
+        if results:
+            packed = pack_context(query, results, budget=DELTA_TOKEN_BUDGET, vectors=vector_db.result_vectors(results),
+                                  query_vector=query_vector)
+            label = value.replace('_', ' ') if field == 'role_family' else f"aged in their {value}"
+            return f"EVIDENCE FROM SIMILAR PARTICIPANTS ({label}):\n{packed}"
+    return ""
+
+PREDICTION_SECTIONS = [
+    ('engagement', 'ENGAGEMENT'),
+    ('behavioral_change', 'BEHAVIORAL CHANGE'),
+    ('success_factors', 'SUCCESS FACTOR'),
+    ('resistance_factors', 'RESISTANCE FACTOR'),
+    ('effectiveness', 'EFFECTIVENESS'),
+    ('recommendations', 'RECOMMENDATION')
+]
+
+def parse_intervention_sections(prediction):
+    """Split a (possibly partial) prediction into its numbered sections and pull out the scores"""
+    sections = {key: '' for key, _ in PREDICTION_SECTIONS}
+    current_section = None
+    for line in prediction.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        line_upper = line.upper().lstrip('#*0123456789. ')
+        header = next((key for key, marker in PREDICTION_SECTIONS if line_upper.startswith(marker)), None)
+        if header:
+            current_section = header
+            # Scores are often on the header line itself ("ENGAGEMENT LIKELIHOOD (0-100%): 65%")
+            rest = line.split(':', 1)[1].strip() if ':' in line else ''
+            if rest:
+                sections[header] += rest + '\n'
+            continue
+        if current_section:
+            sections[current_section] += line + '\n'
+    
+    sections['engagement_pct'] = _extract_score(sections['engagement'], r'\s*%', 100, fractions=True)
+    sections['effectiveness_score'] = _extract_score(sections['effectiveness'], r'\s*(?:/\s*10|out of 10)(?!\d)', 10)
+    return sections
+
+# Scale descriptions ("(0-100%)", "on a scale of 1-10") that are not scores themselves
+SCALE_MENTION = re.compile(r'(?<![\d.])[01]\s*(?:-|–|to)\s*10{1,2}(?![\d.])\s*%?')
+SCORE_NUMBER = r'(?<![\d.])(\d{1,3}(?:\.\d+)?)(?:\s*(?:-|–|to)\s*(\d{1,3}(?:\.\d+)?))?'
+# A bare number right after one of these words is the score the model settled on
+SCORE_CUE = r'\b(?:rat(?:e|ed|ing)|scor(?:e|ed|ing)|estimat(?:e|ed|ion))\b[^\d\n]{0,30}?'
+
+def _extract_score(text, unit, maximum, fractions=False):
+    """Score in a section: an explicit one ("65%", "7/10", "7 out of 10") wins; otherwise the
+    last bare number in 0..maximum after "rate"/"score"/"estimate", else the last bare number.
+    An estimate range ("60-70%") gives its midpoint. With fractions, a bare decimal of at
+    most 1 ("0.65") is read as a fraction of maximum."""
+    text = SCALE_MENTION.sub(' ', text)
+    explicit = re.search(SCORE_NUMBER + unit, text, re.IGNORECASE)
+    if explicit:
+        candidates = [explicit]
+    else:
+        bare = SCORE_NUMBER + r'(?!\s*%)'
+        cued = list(re.finditer(SCORE_CUE + bare, text, re.IGNORECASE))
+        candidates = cued[::-1] + list(re.finditer(bare, text))[::-1]
+    for match in candidates:
+        values = [float(group) for group in match.groups() if group is not None]
+        value = sum(values) / len(values)
+        if fractions and not explicit and value <= 1 and '.' in match.group(1):
+            value = round(value * maximum, 6)
+        if 0 <= value <= maximum:
+            return value
+    return None
+
+def parse_prediction(prediction):
+    """Typed scores of a finished prediction (None where missing or out of range)"""
+    if prediction.startswith(("Error:", "API connection failed")):
+        return {'engagement_pct': None, 'effectiveness_score': None}
+    sections = parse_intervention_sections(prediction)
+    engagement, effectiveness = sections['engagement_pct'], sections['effectiveness_score']
+    return {
+        'engagement_pct': engagement if engagement is not None and 0 <= engagement <= 100 else None,
+        'effectiveness_score': effectiveness if effectiveness is not None and 0 <= effectiveness <= 10 else None
+    }
+
+def prediction_entry(persona, prediction):
+    """Result entry for one persona; the scores are parsed here, once"""
+    return {
+        'persona_name': persona['name'],
+        'persona_industry': persona['industry'],
+        'prediction': prediction,
+        **parse_prediction(prediction)
+    }
+
+def ensemble_entry(persona, ensemble):
+    """Result entry for an ensemble prediction: mean scores, intervals and per-sample scores"""
+    entry = prediction_entry(persona, ensemble['prediction'])
+    for key in SCORE_COLUMNS:
+        if key in ensemble:
+            entry[key] = ensemble[key]
+            entry[f"{key}_ci"] = ensemble[f"{key}_ci"]
+    entry['samples'] = ensemble['samples']
+    entry['sample_scores'] = ensemble['scores']
+    return entry
+
+def render_streaming_prediction(placeholder, prediction):
+    """Show a partially streamed prediction with its scores as soon as they are parsed"""
+    sections = parse_intervention_sections(prediction)
+    with placeholder.container():
+        score_col1, score_col2 = st.columns(2)
+        with score_col1:
+            st.metric("Engagement", f"{sections['engagement_pct']:.0f}%" if sections['engagement_pct'] is not None else "…")
+        with score_col2:
+            st.metric("Effectiveness", f"{sections['effectiveness_score']:g}/10" if sections['effectiveness_score'] is not None else "…")
+        st.markdown(prediction)
+
+def intervention_test_job(job, tester, test_record, personas, knowledge_base, vector_db=None, ensemble='Quick'):
+    """Background job: predict for all personas concurrently, publishing each as it completes.
+    
+    With vector_db the intervention is grounded by one retrieval shared by all
+    personas (plus small persona-specific deltas). Any ensemble profile other than
+    'Quick' samples each persona adaptively and records mean scores with
+    confidence intervals. A cancelled run returns the predictions finished so far.
+    """
+    deltas = {}
+    if vector_db is not None:
+        job.progress(0, len(personas), "Retrieving research grounding...")
+        (grounding, deltas), = tester.retrieve_grounding([test_record['intervention']], vector_db, personas)
+        test_record['grounding'] = grounding
+        knowledge_base = combine_context(grounding, knowledge_base)
+    job.progress(0, len(personas), f"Testing against {len(personas)} persona(s)...")
+    results = {}
+    arguments = (test_record['intervention'], [persona_prompt_text(persona) for persona in personas], knowledge_base)
+    knowledge_deltas = [deltas.get(persona['id'], "") for persona in personas]
+    if ENSEMBLE_PROFILES.get(ensemble):
+        test_record['ensemble'] = ensemble
+        predictions = tester.test_intervention_ensemble(*arguments, knowledge_deltas=knowledge_deltas, profile=ensemble)
+    else:
+        predictions = tester.test_intervention_many(*arguments, knowledge_deltas=knowledge_deltas)
+    try:
+        for index, prediction in predictions:
+            persona = personas[index]
+            if isinstance(prediction, dict):
+                results[persona['id']] = ensemble_entry(persona, prediction)
+                prediction = prediction['prediction']
+            else:
+                results[persona['id']] = prediction_entry(persona, prediction)
+            job.add_result({'persona_id': persona['id'], **results[persona['id']]})
+            job.preview(prediction)
+            job.progress(len(results), len(personas), f"{persona['name']} done ({len(results)}/{len(personas)})")
+            if job.cancelled:
+                break
+    finally:
+        # Closing the generator cancels predictions still in flight
+        predictions.close()
+    
+    # Completion order is arbitrary; keep the selection order for display
+    test_record['results'] = {persona['id']: results[persona['id']] for persona in personas if persona['id'] in results}
+    test_record['personas_tested'] = len(test_record['results'])
+    return test_record
+
+def matrix_test_job(job, tester, interventions, persona_ids, knowledge_base, details, run_id=None, vector_db=None):
+    """Background job: test every intervention against every persona, one test record per intervention.
+    
+    The grid is checkpointed as a matrix run first; resuming it (run_id) reads the
+    same grid back and only computes the cells that are not cached yet.
+    """
+    matrix_store = get_matrix_store()
+    if run_id is None:
+        run_id = matrix_store.create_run(
+            {'interventions': interventions, 'persona_ids': persona_ids, 'knowledge_base': knowledge_base,
+             'details': details, 'grounded': vector_db is not None},
+            len(interventions) * len(persona_ids), job.job_id, job.session_id
+        )
+    else:
+        matrix_store.update_run(run_id, status='running', job_id=job.job_id)
+    
+    # Personas deleted since the run started drop out of the grid
+    personas = get_persona_store().get_many(persona_ids)
+    total = len(interventions) * len(personas)
+    timestamp = datetime.now().isoformat()
+    tests = [{
+        'test_id': f"{run_id}-{i + 1}",
+        'intervention': intervention,
+        **details,
+        'personas_tested': 0,
+        'results': {},
+        'timestamp': timestamp,
+        'matrix_run': run_id
+    } for i, intervention in enumerate(interventions)]
+    
+    done = cached = failed = 0
+    job.progress(0, total, f"Scheduling {total} cell(s)...")
+    cells = tester.test_matrix(interventions, personas, knowledge_base, matrix_store, vector_db=vector_db)
+    try:
+        for i, j, prediction, from_cache in cells:
+            persona = personas[j]
+            tests[i]['results'][persona['id']] = prediction_entry(persona, prediction)
+            done += 1
+            cached += from_cache
+            failed += prediction.startswith(("Error:", "API connection failed"))
+            if not from_cache:
+                job.preview(prediction)
+            job.progress(done, total, f"{done}/{total} cell(s), {cached} from cache")
+            if job.cancelled:
+                break
+    finally:
+        cells.close()
+    
+    for test in tests:
+        test['results'] = {p['id']: test['results'][p['id']] for p in personas if p['id'] in test['results']}
+        test['personas_tested'] = len(test['results'])
+    # A run with failed or skipped cells stays resumable (and dismissable) as 'incomplete'
+    matrix_store.update_run(run_id, status='completed' if done == total and not failed else 'incomplete')
+    return {'run_id': run_id, 'cached': cached, 'failed': failed, 'tests': tests}
+
+def screening_job(job, tester, candidates, persona_ids, knowledge_base, details, test_results, rounds=3,
+                  per_round=8, exploration=1.0, vector_db=None):
+    """Background job: rank candidate wordings with the surrogate, testing only the pairs it picks.
+    
+    Each round refits the surrogate on all results so far (the session's earlier
+    tests plus this run's), scores every untested candidate × persona pair and sends
+    the per_round pairs with the highest upper confidence bound to the LLM through
+    the matrix cache. Returns the tested pairs as one test record per candidate plus
+    a report: the final ranking, per-round error on the pairs it chose, and
+    cross-validated accuracy. With vector_db, tested pairs are grounded in the
+    knowledge base like a regular matrix test.
+    """
+    store = get_persona_store()
+    personas = store.get_many(persona_ids)
+    persona_ids = [persona['id'] for persona in personas]
+    library = {persona['id']: persona for persona in personas}
+    library.update({persona['id']: persona for persona in store.get_many(
+        {pid for test in test_results for pid in test['results']} - set(library))})
+    
+    # The tester may never have connected on the script thread; the job needs the clients either way
+    if tester.llm is None:
+        tester.llm = get_llm_clients()
+    
+    # One batched embedding call for every wording. Candidates share their intervention fields, so
+    # without embeddings they are told apart by TF-IDF vectors of their text instead.
+    job.progress(0, rounds * per_round, f"Embedding {len(candidates)} candidate(s)...")
+    texts = list(dict.fromkeys(candidates + [test['intervention'] for test in test_results]))
+    try:
+        embeddings, text_features = dict(zip(texts, tester.llm.run(tester.llm.embed(texts)))), 'embedding'
+    except Exception as e:
+        job.progress(0, rounds * per_round, f"Embeddings unavailable ({e}); using lexical text features")
+        embeddings, text_features = dict(zip(texts, lexical_vectors(texts))), 'lexical'
+    
+    timestamp = datetime.now().isoformat()
+    run_id = str(uuid.uuid4())[:8]
+    tests = [{
+        'test_id': f"screen-{run_id}-{i + 1}",
+        'intervention': candidate,
+        **details,
+        'personas_tested': 0,
+        'results': {},
+        'timestamp': timestamp,
+        'screening_run': run_id
+    } for i, candidate in enumerate(candidates)]
+    grid = candidate_rows(candidates, details, persona_ids)
+    tested, history = set(), []
+    for round_number in range(1, rounds + 1):
+        training = training_rows(test_results + tests, library)
+        started = time.perf_counter()
+        surrogate = InterventionSurrogate(library, embeddings).fit(training)
+        predictions = surrogate.predict(grid)
+        selected = select_pairs(predictions, per_round, exploration, exclude=tested)
+        scoring_ms = (time.perf_counter() - started) * 1000
+        if not selected:
+            break
+        
+        job.progress(len(tested), rounds * per_round, f"Round {round_number}: testing {len(selected)} pair(s)...")
+        cells = tester.test_matrix(candidates, personas, knowledge_base, vector_db=vector_db,
+                                   pairs=[(grid.at[index, 'candidate'], grid.at[index, 'persona']) for index in selected])
+        try:
+            for i, j, prediction, _ in cells:
+                tests[i]['results'][persona_ids[j]] = prediction_entry(personas[j], prediction)
+                job.preview(prediction)
+                if job.cancelled:
+                    break
+        finally:
+            cells.close()
+        tested.update(selected)
+        
+        # The surrogate's error on pairs it had not seen yet
+        actual = [tests[grid.at[index, 'candidate']]['results'].get(grid.at[index, 'persona_id'], {})
+                  .get('effectiveness_score') for index in selected]
+        errors = [abs(predictions.at[index, 'effectiveness_score'] - score)
+                  for index, score in zip(selected, actual) if score is not None]
+        history.append({'Round': round_number, 'Training pairs': len(training), 'Pairs tested': len(selected),
+                        'Scoring (ms)': round(scoring_ms, 1),
+                        'Effectiveness MAE': round(float(np.mean(errors)), 2) if errors else None})
+        job.progress(len(tested), rounds * per_round, f"Round {round_number} done, {len(tested)} pair(s) tested")
+        if job.cancelled:
+            break
+    
+    # Final ranking of every candidate from everything learned
+    training = training_rows(test_results + tests, library)
+    predictions = InterventionSurrogate(library, embeddings).fit(training).predict(grid)
+    predictions['candidate'] = grid['candidate']
+    ranking = predictions.groupby('candidate').mean()
+    ranking = pd.DataFrame({
+        'Intervention': [candidates[i] for i in ranking.index],
+        'Predicted effectiveness': ranking['effectiveness_score'].round(2),
+        'Uncertainty (±)': ranking['effectiveness_score_std'].round(2),
+        'Predicted engagement (%)': ranking['engagement_pct'].round(1),
+        'Pairs tested': [len(tests[i]['results']) for i in ranking.index]
+    }).sort_values('Predicted effectiveness', ascending=False)
+    accuracy = accuracy_report(training, library, embeddings)
+    
+    for test in tests:
+        test['results'] = {pid: test['results'][pid] for pid in persona_ids if pid in test['results']}
+        test['personas_tested'] = len(test['results'])
+    return {'tests': tests, 'screening': {
+        'run_id': run_id,
+        'text_features': text_features,
+        'ranking': ranking.to_dict('records'),
+        'rounds': history,
+        'accuracy': None if accuracy is None else accuracy.reset_index(names='Score').to_dict('records')
+    }}
+
+def collect_test_job(job):
+    """Copy a finished test, matrix or screening job's records into this session's results (once)"""
+    result = job['result']
+    if not result:
+        return
+    if result.get('screening'):
+        st.session_state.screening_report = result['screening']
+    known = {r['test_id'] for r in st.session_state.test_results}
+    for test_record in result.get('tests', [result]):
+        if test_record['results'] and test_record['test_id'] not in known:
+            st.session_state.test_results.append(test_record)
+            st.session_state.show_latest_results = True
+
 def render_intervention_testing_ui():
     """Linear single page UI for intervention testing"""
     
@@ -95,7 +690,8 @@ def render_intervention_testing_ui():
         st.warning("⚠️ Complete Step 1 data processing first")
         return
     
-    if not st.session_state.get('generated_personas', []):
+    store = get_persona_store()
+    if not store.count():
         st.warning("⚠️ Generate personas in Step 2 first")
         return
     
@@ -149,29 +745,62 @@ def render_intervention_testing_ui():
             value="Research shows 22% average click rate, executives 6%, admin 22%. Time pressure increases risk 40%. Training reduces susceptibility 30%.",
             height=120,
             help="This context will inform the AI predictions")
+        # One retrieval per intervention, shared by every persona in the run
+        vector_db = st.session_state.get('vector_knowledge_base')
+        ground_in_kb = st.checkbox("Ground in research knowledge base", value=vector_db is not None,
+                                   disabled=vector_db is None,
+                                   help="Retrieve passages relevant to the intervention once and share them across "
+                                        "personas, plus transcript evidence from similar participants")
+        grounding_db = vector_db if ground_in_kb else None
     
     # SECTION 2: Select Personas
     st.markdown("---")
     st.markdown("## 2. Select Target Personas")
     
-    # Persona selection with preview
-    persona_options = {p['id']: f"{p['name']} ({p['industry']})" 
-                     for p in st.session_state.generated_personas}
+    # Filter personas in the store on industry and their typed behavioral scores
+    score_labels = dict(SCORE_FIELDS)
+    filter_col1, filter_col2, filter_col3 = st.columns(3)
+    with filter_col1:
+        industry_filter = st.selectbox("Industry", ["All"] + [i for i in store.distinct('industry') if i])
+    with filter_col2:
+        filter_score = st.selectbox("Filter by score", list(score_labels.keys()), format_func=lambda k: score_labels[k])
+    with filter_col3:
+        min_score = st.slider(f"Minimum {score_labels[filter_score]}", 0.0, 10.0, 0.0, 0.5)
+    
+    # Persona selection with preview: the newest matches plus anything already selected
+    summaries = store.list_summaries(
+        limit=200,
+        industry=None if industry_filter == "All" else industry_filter,
+        min_scores={filter_score: min_score}
+    )
+    persona_options = {p['id']: f"{p['name']} ({p['industry']})" for p in summaries}
+    for persona in store.get_many(st.session_state.get('selected_persona_ids', [])):
+        persona_options.setdefault(persona['id'], f"{persona['name']} ({persona['industry']})")
+    if 'selected_persona_ids' in st.session_state:
+        # Drop selections whose persona was deleted in Step 2
+        st.session_state.selected_persona_ids = [
+            pid for pid in st.session_state.selected_persona_ids if pid in persona_options
+        ]
     
     selected_personas = st.multiselect(
         "Choose personas to test against:",
         list(persona_options.keys()),
         format_func=lambda x: persona_options[x],
-        help="Select one or more personas for testing"
+        help="Select one or more personas for testing",
+        key='selected_persona_ids'
     )
     
     # Show selected persona previews
     if selected_personas:
         st.markdown("**Selected Personas Preview:**")
         for persona_id in selected_personas:
-            persona = next(p for p in st.session_state.generated_personas if p['id'] == persona_id)
+            persona = store.get(persona_id)
             with st.expander(f"📄 {persona['name']} ({persona['industry']})", expanded=False):
-                # Show first 200 characters of persona description
+                # Show the behavioral scores and the first 200 characters of the profile
+                scores = [f"{label}: {persona_score(persona, key):g}/10" for key, label in SCORE_FIELDS
+                          if persona_score(persona, key) is not None]
+                if scores:
+                    st.caption(" | ".join(scores))
                 preview_text = persona['llm_output'][:200] + "..." if len(persona['llm_output']) > 200 else persona['llm_output']
                 st.write(preview_text)
     
@@ -193,13 +822,22 @@ def render_intervention_testing_ui():
         st.info(f"Target Personas: {len(selected_personas)} selected")
         
         col1, col2 = st.columns([3, 1])
+        with col2:
+            # Test settings (read before the run button below uses them)
+            st.markdown("**Settings**")
+            confidence_level = st.selectbox(
+                "Confidence", ["Quick", "Standard", "Detailed"], index=0,
+                help="Quick: one LLM call per persona. Standard: 3 to 6 calls per persona and Detailed: 4 to 10 "
+                     "(seeded samples, stopping early once the scores' confidence intervals are narrow enough), "
+                     "so Standard costs at least 3× the calls of Quick."
+            )
+        
         with col1:
             if st.button("Run Intervention Tests", type="primary", use_container_width=True):
-                with st.spinner("Running AI-powered intervention analysis..."):
-                    
+                if tester.llm or tester.check_api_connection():
                     # Create test record
                     test_id = str(uuid.uuid4())[:8]
-                    test_results = {
+                    test_record = {
                         'test_id': test_id,
                         'intervention': intervention_text,
                         'intervention_type': intervention_type,
@@ -210,50 +848,123 @@ def render_intervention_testing_ui():
                         'timestamp': datetime.now().isoformat()
                     }
                     
-                    # Progress tracking
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    # Run tests for each persona
-                    for i, persona_id in enumerate(selected_personas):
-                        persona = next(p for p in st.session_state.generated_personas if p['id'] == persona_id)
-                        
-                        # Update progress
-                        progress = (i + 1) / len(selected_personas)
-                        progress_bar.progress(progress)
-                        status_text.text(f"Testing against {persona['name']}... ({i+1}/{len(selected_personas)})")
-                        
-                        # Run prediction
-                        result = tester.test_intervention(
-                            intervention_text,
-                            persona['description'] + "\n" + persona['llm_output'],
-                            kb_summary
-                        )
-                        
-                        test_results['results'][persona_id] = {
-                            'persona_name': persona['name'],
-                            'persona_industry': persona['industry'],
-                            'prediction': result
-                        }
-                    
-                    # Complete
-                    progress_bar.progress(1.0)
-                    status_text.text("Analysis complete!")
-                    
-                    # Store results
-                    st.session_state.test_results.append(test_results)
-                    
-                    st.success(f"✅ Tests completed! Test ID: {test_id}")
-                    # st.balloons()
-                    
-                    # Auto-scroll to results
-                    st.session_state.show_latest_results = True
+                    # The analysis runs as a background job; results are collected when it ends
+                    job_id = get_job_runner().submit(
+                        'intervention_test', f"Test {test_id}: {intervention_type}", intervention_test_job,
+                        tester, test_record, store.get_many(selected_personas), kb_summary, grounding_db,
+                        confidence_level, session_id=current_session_id()
+                    )
+                    st.session_state.setdefault('test_jobs', []).append(job_id)
+                    st.rerun()
+    
+    # Matrix mode: several intervention variants against the same personas, cached per cell
+    with st.expander("🧮 Matrix Mode: Compare Intervention Variants", expanded=False):
+        variants_text = st.text_area(
+            "Intervention variants (one per line):",
+            height=120,
+            help="Every variant is tested against every selected persona. Cells already computed for the same "
+                 "variant, persona version, research context and model are reused."
+        )
+        include_main = st.checkbox("Also include the intervention described above", value=bool(intervention_text.strip()))
+        variants = ([intervention_text.strip()] if include_main and intervention_text.strip() else []) + \
+            [line.strip() for line in variants_text.splitlines() if line.strip()]
+        variants = list(dict.fromkeys(variants))
+        st.caption(f"{len(variants)} intervention(s) × {len(selected_personas)} persona(s) = "
+                   f"{len(variants) * len(selected_personas)} cell(s)")
+        if st.button("Run Matrix", disabled=not (variants and selected_personas), use_container_width=True):
+            if tester.llm or tester.check_api_connection():
+                details = {'intervention_type': intervention_type, 'target_behavior': target_behavior,
+                           'delivery_method': delivery_method}
+                job_id = get_job_runner().submit(
+                    'intervention_test', f"Matrix: {len(variants)} × {len(selected_personas)}", matrix_test_job,
+                    tester, variants, list(selected_personas), kb_summary, details, vector_db=grounding_db,
+                    session_id=current_session_id()
+                )
+                st.session_state.setdefault('test_jobs', []).append(job_id)
+                st.rerun()
+
+        # This session's grids that did not complete (job died, cancelled or with failed
+        # cells) continue from their cached cells, or can be dismissed
+        runner = get_job_runner()
+        for run in get_matrix_store().unfinished_runs(current_session_id()):
+            job = runner.get(run['job_id']) if run['job_id'] else None
+            if job and job['status'] in ACTIVE_STATUSES:
+                continue
+            spec = run['spec']
+            resume_col, dismiss_col = st.columns([4, 1])
+            with dismiss_col:
+                if st.button("Dismiss", key=f"dismiss_matrix_{run['run_id']}", use_container_width=True):
+                    get_matrix_store().abandon_run(run['run_id'])
+                    st.rerun()
+            with resume_col:
+                resume = st.button(
+                    f"Resume matrix {run['run_id']} ({len(spec['interventions'])} × {len(spec['persona_ids'])}, "
+                    f"{'incomplete' if run['status'] == 'incomplete' else 'interrupted'}, "
+                    f"started {run['created_at'][:16].replace('T', ' ')})",
+                    key=f"resume_matrix_{run['run_id']}", use_container_width=True
+                )
+            if resume:
+                if tester.llm or tester.check_api_connection():
+                    job_id = runner.submit(
+                        'intervention_test', f"Matrix {run['run_id']} (resumed)", matrix_test_job, tester,
+                        spec['interventions'], spec['persona_ids'], spec['knowledge_base'], spec['details'],
+                        run_id=run['run_id'], vector_db=vector_db if spec.get('grounded') else None,
+                        session_id=current_session_id()
+                    )
+                    st.session_state.setdefault('test_jobs', []).append(job_id)
+                    st.rerun()
+
+    # Screening: rank many candidate wordings with the surrogate, testing only the pairs it picks
+    with st.expander("🔬 Screen Candidate Interventions", expanded=False):
+        candidates_text = st.text_area(
+            "Candidate wordings (one per line):",
+            height=150,
+            help="A local model trained on your test results scores every candidate × persona pair. "
+                 "Each round only the most promising or most uncertain pairs are sent to the LLM, "
+                 "and the model is refit on their results."
+        )
+        candidates = list(dict.fromkeys(line.strip() for line in candidates_text.splitlines() if line.strip()))
+        screen_col1, screen_col2, screen_col3 = st.columns(3)
+        with screen_col1:
+            rounds = st.number_input("Rounds", min_value=1, max_value=10, value=3)
+        with screen_col2:
+            per_round = st.number_input("LLM tests per round", min_value=1, max_value=100, value=8)
+        with screen_col3:
+            exploration = st.slider("Exploration", 0.0, 3.0, 1.0, 0.5,
+                                    help="0 tests the pairs predicted best; higher values favor uncertain pairs")
+        st.caption(f"{len(candidates)} candidate(s) × {len(selected_personas)} persona(s) = "
+                   f"{len(candidates) * len(selected_personas)} pair(s); at most {rounds * per_round} LLM test(s)")
+        if st.button("Screen Candidates", disabled=not (candidates and selected_personas), use_container_width=True):
+            if tester.llm or tester.check_api_connection():
+                details = {'intervention_type': intervention_type, 'target_behavior': target_behavior,
+                           'delivery_method': delivery_method}
+                job_id = get_job_runner().submit(
+                    'intervention_test', f"Screening: {len(candidates)} candidate(s)", screening_job, tester,
+                    candidates, list(selected_personas), kb_summary, details, list(st.session_state.test_results),
+                    int(rounds), int(per_round), exploration, vector_db=grounding_db, session_id=current_session_id()
+                )
+                st.session_state.setdefault('test_jobs', []).append(job_id)
+                st.rerun()
         
-        with col2:
-            # Test settings
-            st.markdown("**Settings**")
-            confidence_level = st.selectbox("Confidence", 
-                ["Standard", "Detailed", "Quick"], index=0)
+        report = st.session_state.get('screening_report')
+        if report:
+            st.markdown(f"**Latest screening ({report['run_id']})**")
+            st.dataframe(pd.DataFrame(report['ranking']), use_container_width=True, hide_index=True)
+            if report['rounds']:
+                st.markdown("Surrogate error on the pairs it chose, before seeing their results:")
+                st.dataframe(pd.DataFrame(report['rounds']), use_container_width=True, hide_index=True)
+            if report['accuracy']:
+                st.markdown("Cross-validated surrogate accuracy (held-out wordings):")
+                st.dataframe(pd.DataFrame(report['accuracy']), use_container_width=True, hide_index=True)
+            else:
+                st.caption("Accuracy report needs results for at least two wordings.")
+            if report['text_features'] == 'lexical':
+                st.caption("Embeddings were unavailable; wordings were compared by their TF-IDF word vectors.")
+
+    # Running and just-finished test jobs (they keep running across reruns)
+    render_job_panel('test_jobs', on_finished=collect_test_job,
+                     render_preview=lambda prediction: render_streaming_prediction(st.empty(), prediction))
+    render_job_history('intervention_test', 'test_jobs', attach_label="Load Results")
     
     # SECTION 4: Results
     st.markdown("---")
@@ -279,8 +990,12 @@ def render_intervention_testing_ui():
             index=len(test_options)-1 if st.session_state.get('selected_test_id') else 0
         )
         
+        # Typed scores of every result, laid out column-wise (parsed when the predictions were made)
+        frame = results_frame(st.session_state.test_results)
+        
         if selected_test:
             test_data = next(r for r in st.session_state.test_results if r['test_id'] == selected_test)
+            test_frame = frame[frame['test_id'] == selected_test]
             
             # Test overview metrics
             col1, col2, col3, col4 = st.columns(4)
@@ -293,15 +1008,37 @@ def render_intervention_testing_ui():
             with col4:
                 st.metric("Date", test_data['timestamp'][:10])
             
+            score_col1, score_col2 = st.columns(2)
+            with score_col1:
+                engagement = test_frame['engagement_pct'].mean()
+                st.metric("Mean Engagement", f"{engagement:.0f}%" if pd.notna(engagement) else "n/a")
+            with score_col2:
+                effectiveness = test_frame['effectiveness_score'].mean()
+                st.metric("Mean Effectiveness", f"{effectiveness:.1f}/10" if pd.notna(effectiveness) else "n/a")
+            
             # Intervention summary
             st.markdown("**Tested Intervention:**")
             st.info(test_data['intervention'])
+            if test_data.get('grounding'):
+                with st.expander("Research grounding used", expanded=False):
+                    st.text(test_data['grounding'])
             
             # Results display
             st.markdown("**Prediction Results:**")
             
             for persona_id, result_data in test_data['results'].items():
                 with st.expander(f"{result_data['persona_name']} ({result_data['persona_industry']})", expanded=True):
+                    scores = []
+                    for key, label in SCORE_COLUMNS.items():
+                        if result_data.get(key) is None:
+                            continue
+                        interval = result_data.get(f"{key}_ci")
+                        scores.append(f"{label}: {result_data[key]:g}" +
+                                      (f" ({CI_LEVEL:.0%} CI {interval[0]:g}–{interval[1]:g})" if interval else ""))
+                    if result_data.get('samples', 1) > 1:
+                        scores.append(f"{result_data['samples']} samples")
+                    if scores:
+                        st.caption(" | ".join(scores))
                     st.write(result_data['prediction'])
             
             # Export functionality
@@ -320,19 +1057,24 @@ def render_intervention_testing_ui():
                 )
             
             with col2:
-                # CSV export
-                csv_data = []
-                for persona_id, result in test_data['results'].items():
-                    csv_data.append({
-                        'Test_ID': test_data['test_id'],
-                        'Persona': result['persona_name'],
-                        'Industry': result['persona_industry'],
-                        'Intervention_Type': test_data['intervention_type'],
-                        'Result_Length': len(result['prediction']),
-                        'Date': test_data['timestamp'][:10]
-                    })
-                
-                csv_df = pd.DataFrame(csv_data)
+                # CSV export of the typed score columns
+                csv_df = pd.DataFrame({
+                    'Test_ID': test_frame['test_id'].astype(str),
+                    'Persona': test_frame['persona_name'],
+                    'Industry': test_frame['persona_industry'].astype(str),
+                    'Intervention_Type': test_frame['intervention_type'].astype(str),
+                    'Target_Behavior': test_frame['target_behavior'].astype(str),
+                    'Delivery_Method': test_frame['delivery_method'].astype(str),
+                    'Engagement_Pct': test_frame['engagement_pct'],
+                    'Effectiveness_Score': test_frame['effectiveness_score'],
+                    'Engagement_CI_Low': test_frame['engagement_pct_low'],
+                    'Engagement_CI_High': test_frame['engagement_pct_high'],
+                    'Effectiveness_CI_Low': test_frame['effectiveness_score_low'],
+                    'Effectiveness_CI_High': test_frame['effectiveness_score_high'],
+                    'Samples': test_frame['samples'],
+                    'Result_Length': [len(test_data['results'][pid]['prediction']) for pid in test_frame['persona_id']],
+                    'Date': test_data['timestamp'][:10]
+                })
                 csv_string = csv_df.to_csv(index=False)
                 
                 st.download_button(
@@ -371,8 +1113,15 @@ def render_intervention_testing_ui():
             })
         
         df = pd.DataFrame(history_data)
+        by_test = frame.groupby('test_id', observed=True)[list(SCORE_COLUMNS)].mean().astype('float64')
+        for column, label in SCORE_COLUMNS.items():
+            df[f"Mean {label}"] = df['Test ID'].map(by_test[column]).round(2)
         st.dataframe(df, use_container_width=True)
         
+        # Vectorized aggregates over every prediction in the session
+        group_by = st.selectbox("Compare scores by", [d for d in DIMENSIONS if d != 'test_id'], format_func=DIMENSIONS.get)
+        st.dataframe(aggregate_results(frame, group_by), use_container_width=True)
+        
         # History actions
         col1, col2, col3 = st.columns(3)
         
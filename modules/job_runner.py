@@ -0,0 +1,319 @@
+"""
+Background job runner
+
+Long LLM work (bulk persona generation, intervention test runs) runs on a
+process-wide worker pool instead of the Streamlit script thread, so widget
+interactions and reruns no longer kill it and several jobs can run at once.
+Jobs, their progress and their partial results live in SQLite; the UI submits
+a job, keeps its ID in session state and polls it with render_job_panel. Live
+preview text (e.g. a streaming completion) is kept in memory only. Every job
+records the browser session that submitted it; that session ID is kept in the
+page URL so it survives reloads, and job history is limited to it.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import streamlit as st
+
+JOB_DB_PATH = Path(os.getenv("CYPERSONA_JOB_DB", ".cache/jobs.sqlite"))
+JOB_WORKERS = int(os.getenv("CYPERSONA_JOB_WORKERS", "4"))
+POLL_INTERVAL = 1.0  # seconds between UI polls
+SESSION_PARAM = "session"  # URL query parameter holding the browser session ID
+
+ACTIVE_STATUSES = ('queued', 'running')
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled', 'interrupted')
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function by JobHandle.check() after cancellation"""
+
+
+class JobHandle:
+    """What a job function uses to report progress, publish results and notice cancellation"""
+
+    def __init__(self, runner, job_id, session_id=None):
+        self.runner = runner
+        self.job_id = job_id
+        self.session_id = session_id
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def progress(self, done, total=None, message=None):
+        self.runner._update(self.job_id, progress_done=done, progress_total=total, message=message)
+
+    def add_result(self, payload):
+        """Append a partial result (visible to pollers immediately)"""
+        self.runner._add_result(self.job_id, payload)
+
+    def preview(self, text):
+        """Latest live text for pollers (not persisted)"""
+        self.runner._previews[self.job_id] = text
+
+
+class JobRunner:
+    """Worker pool plus a persistent job table"""
+
+    def __init__(self, path=JOB_DB_PATH, workers=JOB_WORKERS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                title TEXT,
+                status TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                progress_done INTEGER NOT NULL DEFAULT 0,
+                progress_total INTEGER,
+                message TEXT,
+                error TEXT,
+                result TEXT,
+                session_id TEXT
+            )"""
+        )
+        # Job tables created before jobs recorded their session
+        if 'session_id' not in {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN session_id TEXT")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS job_results (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_session_id ON jobs(session_id)")
+        # Jobs from a previous process cannot be resumed by this pool
+        self._conn.execute(
+            f"UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE status IN {ACTIVE_STATUSES}",
+            (datetime.now().isoformat(),)
+        )
+        self._conn.commit()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cypersona-job")
+        self._handles = {}
+        self._previews = {}
+
+    # -- submission ---------------------------------------------------------
+
+    def submit(self, kind, title, fn, *args, session_id=None, **kwargs):
+        """Queue fn(handle, *args, **kwargs); its return value (JSON-serializable) becomes the job result.
+
+        session_id records the submitting browser session (see current_session_id).
+        """
+        job_id = str(uuid.uuid4())[:12]
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, title, status, created_at, session_id) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, title, datetime.now().isoformat(), session_id)
+            )
+            self._conn.commit()
+            handle = self._handles[job_id] = JobHandle(self, job_id, session_id)
+        self._pool.submit(self._run, handle, fn, args, kwargs)
+        return job_id
+
+    def _run(self, handle, fn, args, kwargs):
+        if handle.cancelled:
+            self._finish(handle.job_id, 'cancelled')
+            return
+        self._update(handle.job_id, status='running', started_at=datetime.now().isoformat())
+        try:
+            result = fn(handle, *args, **kwargs)
+        except JobCancelled:
+            self._finish(handle.job_id, 'cancelled')
+        except Exception as e:
+            self._finish(handle.job_id, 'failed', error=f"{e}\n{traceback.format_exc(limit=5)}")
+        else:
+            self._finish(handle.job_id, 'cancelled' if handle.cancelled else 'completed', result=result)
+
+    def cancel(self, job_id):
+        """Ask a job to stop; it ends at its next check (queued jobs never start)"""
+        handle = self._handles.get(job_id)
+        if handle is not None:
+            handle._cancel.set()
+        self._update(job_id, message="Cancelling...")
+
+    # -- state --------------------------------------------------------------
+
+    def _update(self, job_id, **fields):
+        fields = {k: v for k, v in fields.items() if v is not None}
+        if not fields:
+            return
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                list(fields.values()) + [job_id]
+            )
+            self._conn.commit()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self._update(job_id, status=status, finished_at=datetime.now().isoformat(), error=error,
+                     result=json.dumps(result) if result is not None else None)
+        self._handles.pop(job_id, None)
+        self._previews.pop(job_id, None)
+
+    def _add_result(self, job_id, payload):
+        with self._lock:
+            seq = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) + 1 FROM job_results WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            self._conn.execute("INSERT INTO job_results (job_id, seq, payload) VALUES (?, ?, ?)",
+                               (job_id, seq, json.dumps(payload)))
+            self._conn.commit()
+
+    # -- polling ------------------------------------------------------------
+
+    def get(self, job_id):
+        """Job row as a dict (result decoded, live preview attached), or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['preview'] = self._previews.get(job_id)
+        return job
+
+    def results(self, job_id, after=-1):
+        """Partial results with seq > after, in order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, payload FROM job_results WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, after)
+            ).fetchall()
+        return [(row['seq'], json.loads(row['payload'])) for row in rows]
+
+    def list_jobs(self, limit=20, kind=None, active_only=False, session_id=None):
+        clauses, params = [], []
+        if kind:
+            clauses.append("kind = ?")
+            params.append(kind)
+        if session_id:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        if active_only:
+            clauses.append(f"status IN {ACTIVE_STATUSES}")
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, kind, title, status, created_at, finished_at, progress_done, progress_total, message "
+                f"FROM jobs{where} ORDER BY created_at DESC LIMIT ?", params + [limit]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    """Process-wide job runner (page modules are re-executed on every Streamlit rerun)"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
+
+
+def current_session_id():
+    """ID of this browser session, kept in the page URL so a reload keeps it"""
+    session_id = st.query_params.get(SESSION_PARAM)
+    if not session_id:
+        session_id = st.session_state.get('job_session_id') or str(uuid.uuid4())[:12]
+        st.query_params[SESSION_PARAM] = session_id
+    st.session_state.job_session_id = session_id
+    return session_id
+
+
+def render_job_panel(session_key, on_finished=None, render_preview=None):
+    """Progress, live preview and a cancel button for the jobs this session submitted.
+
+    The job IDs live in st.session_state[session_key]. The panel is a fragment that
+    polls itself while any job is active; when a job ends, on_finished(job) runs once
+    on the script thread (worker threads cannot touch session state) and the whole
+    page reruns so it picks up the new personas or results.
+    """
+    runner = get_job_runner()
+    job_ids = st.session_state.setdefault(session_key, [])
+    for level, text in st.session_state.pop(f"{session_key}_notices", []):
+        getattr(st, level)(text)
+    if not job_ids:
+        return
+    jobs = [runner.get(job_id) for job_id in job_ids]
+    active = any(job and job['status'] in ACTIVE_STATUSES for job in jobs)
+
+    @st.fragment(run_every=POLL_INTERVAL if active else None)
+    def poll():
+        finished = False
+        for job_id in list(st.session_state[session_key]):
+            job = runner.get(job_id)
+            if job is None or job['status'] not in ACTIVE_STATUSES:
+                st.session_state[session_key].remove(job_id)
+                if job is not None:
+                    if on_finished:
+                        on_finished(job)
+                    st.session_state.setdefault(f"{session_key}_notices", []).append(_finished_notice(job))
+                finished = True
+                continue
+            with st.container(border=True):
+                total = job['progress_total']
+                fraction = min(job['progress_done'] / total, 1.0) if total else 0.0
+                st.progress(fraction, text=f"{job['title']}: {job['message'] or job['status'].capitalize() + '...'}")
+                if job['preview']:
+                    (render_preview or st.markdown)(job['preview'])
+                st.button("Cancel", key=f"cancel_job_{job_id}", on_click=runner.cancel, args=(job_id,))
+        if finished:
+            st.rerun()
+
+    poll()
+
+
+def _finished_notice(job):
+    if job['status'] == 'completed':
+        return 'success', f"✅ {job['title']}: done"
+    if job['status'] == 'failed':
+        return 'error', f"{job['title']} failed: {(job['error'] or '').splitlines()[0] if job['error'] else 'unknown error'}"
+    return 'warning', f"{job['title']}: {job['status']} after {job['progress_done']} of {job['progress_total'] or '?'}"
+
+
+def render_job_history(kind, session_key, attach_label=None):
+    """Recent jobs of a kind submitted by this browser session; attach_label enables
+    re-attaching one (e.g. to collect a finished test run after a browser reload)"""
+    runner = get_job_runner()
+    jobs = runner.list_jobs(kind=kind, session_id=current_session_id())
+    if not jobs:
+        return
+    with st.expander(f"Background jobs ({sum(job['status'] in ACTIVE_STATUSES for job in jobs)} running)", expanded=False):
+        st.dataframe([
+            {'Job': job['title'], 'Status': job['status'], 'Progress': f"{job['progress_done']}/{job['progress_total'] or '?'}",
+             'Started': job['created_at'][:16].replace('T', ' ')}
+            for job in jobs
+        ], hide_index=True, use_container_width=True)
+        if attach_label:
+            attached = set(st.session_state.get(session_key, []))
+            options = {job['id']: f"{job['title']} ({job['status']})" for job in jobs if job['id'] not in attached}
+            if options:
+                job_id = st.selectbox("Job", list(options), format_func=options.get, key=f"{session_key}_attach")
+                if st.button(attach_label, key=f"{session_key}_attach_button"):
+                    st.session_state.setdefault(session_key, []).append(job_id)
+                    st.rerun()
@@ -0,0 +1,133 @@
+"""
+Disk-backed cache for LLM completions
+
+Completions are stored in SQLite keyed by a hash of (model, messages, sampling
+parameters, seed), with LRU eviction and a time-to-live. Only reproducible
+requests are cached: temperature 0 or an explicit seed. Deterministic mode
+gives every request a fixed seed so repeated workloads are served from disk.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+LLM_CACHE_PATH = Path(os.getenv("CYPERSONA_LLM_CACHE_PATH", ".cache/llm_responses.sqlite"))
+LLM_CACHE_ENABLED = os.getenv("CYPERSONA_LLM_CACHE", "1") != "0"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("CYPERSONA_LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("CYPERSONA_LLM_CACHE_TTL", str(30 * 24 * 3600)))
+
+# Deterministic mode: every completion gets a fixed seed (variants get seed + n)
+DETERMINISTIC_MODE = os.getenv("CYPERSONA_DETERMINISTIC", "0") == "1"
+DETERMINISTIC_SEED = int(os.getenv("CYPERSONA_SEED", "42"))
+
+
+def cache_key(model, messages, params):
+    """Stable hash of a completion request"""
+    payload = json.dumps({'model': model, 'messages': messages, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def is_cacheable(temperature, params):
+    """Only reproducible requests may be answered from the cache"""
+    return temperature == 0 or params.get('seed') is not None
+
+
+def variant_seed(variant_index):
+    """Seed for the n-th variant of the same request in deterministic mode (None otherwise)"""
+    return DETERMINISTIC_SEED + variant_index if DETERMINISTIC_MODE else None
+
+
+class ResponseCache:
+    """SQLite completion cache with LRU eviction, TTL expiry and hit statistics"""
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL_SECONDS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.commit()
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    def get(self, key):
+        """Cached response text, or None on a miss or an expired entry"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.stats['misses'] += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.stats['hits'] += 1
+            return row[0]
+
+    def set(self, key, model, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_used, hits) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (key, model, response, now, now)
+            )
+            self.stats['writes'] += 1
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        deleted = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            deleted += self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            ).rowcount
+        self.stats['evictions'] += deleted
+
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Process-wide response cache, or None when caching is disabled"""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
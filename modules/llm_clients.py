@@ -0,0 +1,278 @@
+"""
+Shared async LLM and embedding clients for CyPersona
+
+"""
+
+import asyncio
+import concurrent.futures
+import importlib
+import importlib.util
+import os
+import queue
+import threading
+
+import openai
+import together
+
+from llm_cache import DETERMINISTIC_MODE, DETERMINISTIC_SEED, cache_key, get_response_cache, is_cacheable
+
+TOGETHER_MODEL = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# HTTP/2 needs the optional `h2` package; fall back to pooled HTTP/1.1 without it
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# OpenAI accepts up to 2048 inputs per embeddings request
+EMBEDDING_BATCH_SIZE = 256
+
+# Point both providers at an OpenAI-compatible server (e.g. modules/mock_llm_server.py);
+# TOGETHER_BASE_URL / OPENAI_BASE_URL override a single provider
+LLM_BASE_URL = os.getenv("CYPERSONA_LLM_BASE_URL")
+
+# Completions allowed in flight at once across the whole process (provider rate limit)
+CHAT_CONCURRENCY = int(os.getenv("CYPERSONA_CHAT_CONCURRENCY", "8"))
+
+
+def _http_client(client_class, timeout, connect_timeout=10.0):
+    """An SDK's default async HTTP client with our pool limits and timeouts.
+
+    The SDKs are built on different HTTP libraries (openai on httpx2, together on
+    httpx), so Limits and Timeout come from the library the SDK's client class
+    actually subclasses; mixing them fails on the first request.
+    """
+    http = importlib.import_module(next(
+        base for base in client_class.__mro__[1:] if base.__name__ == 'AsyncClient'
+    ).__module__.split('.')[0])
+    limits = http.Limits(
+        max_connections=int(os.getenv("CYPERSONA_MAX_CONNECTIONS", "64")),
+        max_keepalive_connections=int(os.getenv("CYPERSONA_MAX_KEEPALIVE", "32")),
+        keepalive_expiry=120.0
+    )
+    return client_class(limits=limits, http2=HTTP2_AVAILABLE, timeout=http.Timeout(timeout, connect=connect_timeout))
+
+
+class LLMClients:
+    """Process-wide async Together and OpenAI clients running on one background event loop.
+
+    Streamlit runs each script rerun on its own thread without an event loop, so the
+    clients live on a dedicated loop thread. Coroutines can be awaited from other
+    coroutines (and combined with asyncio.gather) or run from sync code with run().
+    """
+
+    def __init__(self, together_api_key=None, openai_api_key=None, together_base_url=None, openai_base_url=None):
+        self.together_api_key = together_api_key
+        self.openai_api_key = openai_api_key
+        self.together_base_url = together_base_url
+        self.openai_base_url = openai_base_url
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="cypersona-llm-loop", daemon=True)
+        self._thread.start()
+        self._together = None
+        self._openai = None
+        self.cache = get_response_cache()
+        # Shared by every completion request (all fan-outs and all jobs); cache hits skip it
+        self.completion_slots = asyncio.Semaphore(CHAT_CONCURRENCY)
+
+    @property
+    def together(self):
+        if self._together is None:
+            self._together = together.AsyncTogether(
+                api_key=self.together_api_key,
+                base_url=self.together_base_url,
+                http_client=_http_client(together.DefaultAsyncHttpxClient, 120.0)
+            )
+        return self._together
+
+    @property
+    def openai(self):
+        if self._openai is None:
+            self._openai = openai.AsyncOpenAI(
+                api_key=self.openai_api_key,
+                base_url=self.openai_base_url,
+                http_client=_http_client(openai.DefaultAsyncHttpxClient, 60.0)
+            )
+        return self._openai
+
+    def _cache_lookup(self, model, messages, max_tokens, temperature, params, use_cache):
+        """Apply deterministic mode to params and return (cache key or None, cached text or None)"""
+        if DETERMINISTIC_MODE:
+            params.setdefault('seed', DETERMINISTIC_SEED)
+        if not use_cache or self.cache is None or not is_cacheable(temperature, params):
+            return None, None
+        key = cache_key(model, messages, dict(params, max_tokens=max_tokens, temperature=temperature))
+        return key, self.cache.get(key)
+
+    async def chat(self, prompt=None, messages=None, model=TOGETHER_MODEL, max_tokens=600, temperature=0.7,
+                   use_cache=True, **params):
+        """Return the completion text for a prompt (or full message list)"""
+        if messages is None:
+            messages = [{"role": "user", "content": prompt}]
+        key, cached = self._cache_lookup(model, messages, max_tokens, temperature, params, use_cache)
+        if cached is not None:
+            return cached
+        async with self.completion_slots:
+            response = await self.together.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=False,
+                **params
+            )
+        content = response.choices[0].message.content
+        if key and content:
+            self.cache.set(key, model, content)
+        return content
+
+    async def stream_chat(self, prompt=None, messages=None, model=TOGETHER_MODEL, max_tokens=600, temperature=0.7,
+                          use_cache=True, **params):
+        """Yield completion text deltas as they arrive (a cached completion arrives in one piece)"""
+        if messages is None:
+            messages = [{"role": "user", "content": prompt}]
+        key, cached = self._cache_lookup(model, messages, max_tokens, temperature, params, use_cache)
+        if cached is not None:
+            yield cached
+            return
+        async with self.completion_slots:
+            stream = await self.together.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                **params
+            )
+            parts = []
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield parts[-1]
+                # Only completed streams are cached; a cancelled one never reaches here
+                if key and parts:
+                    self.cache.set(key, model, "".join(parts))
+            finally:
+                # Closing the response stops generation (and billing) when the consumer stops early
+                await stream.close()
+
+    def iter_stream(self, agen):
+        """Consume an async generator on the client loop from sync code.
+
+        Items are yielded as they arrive. Closing the returned iterator early (break,
+        garbage collection, or a Streamlit rerun interrupting the script) cancels the
+        underlying request. Exceptions from the generator are re-raised here.
+        """
+        items = queue.Queue()
+        done = object()
+
+        async def _pump():
+            try:
+                async for item in agen:
+                    items.put(item)
+            except BaseException as e:
+                items.put(e)
+                raise
+            finally:
+                items.put(done)
+
+        future = self.submit(_pump())
+        try:
+            while True:
+                item = items.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    if isinstance(item, asyncio.CancelledError):
+                        break
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    async def embed(self, texts, model=EMBEDDING_MODEL):
+        """Return one embedding per input text, batching large inputs concurrently"""
+        if isinstance(texts, str):
+            texts = [texts]
+        batches = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+        responses = await asyncio.gather(*[
+            self.openai.embeddings.create(model=model, input=batch) for batch in batches
+        ])
+        embeddings = []
+        for response in responses:
+            embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return embeddings
+
+    def submit(self, coro):
+        """Schedule a coroutine on the client loop and return a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the client loop and block until it finishes"""
+        return self.submit(coro).result(timeout)
+
+    def run_all(self, coros, return_exceptions=True):
+        """Run several coroutines concurrently and return their results in order"""
+        async def _gather():
+            return await asyncio.gather(*coros, return_exceptions=return_exceptions)
+        return self.run(_gather())
+
+    def iter_completed(self, coros, limit=CHAT_CONCURRENCY):
+        """Run coroutines with at most `limit` in flight and yield (index, result) as each finishes.
+
+        The completions they make also share completion_slots with every other
+        fan-out, so concurrent jobs stay within CHAT_CONCURRENCY requests in total;
+        `limit` only caps how many of this call's coroutines are scheduled at once.
+        A failed coroutine yields its exception as the result instead of raising.
+        """
+        semaphore = asyncio.Semaphore(max(1, limit))
+
+        async def _bounded(index, coro):
+            async with semaphore:
+                try:
+                    return index, await coro
+                except Exception as e:
+                    return index, e
+
+        futures = [self.submit(_bounded(i, coro)) for i, coro in enumerate(coros)]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            # Abandoned iteration (e.g. a Streamlit rerun) cancels the remaining requests
+            for future in futures:
+                future.cancel()
+
+    def close(self):
+        """Close pooled connections and stop the loop thread"""
+        async def _aclose():
+            for client in (self._together, self._openai):
+                if client is not None:
+                    await client.close()
+        try:
+            self.run(_aclose(), timeout=10)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+_clients = None
+_clients_lock = threading.Lock()
+
+
+def get_llm_clients():
+    """Return the process-wide clients, rebuilding them only when API keys or base URLs change"""
+    global _clients
+    settings = (
+        os.getenv("TOGETHER_API_KEY"),
+        os.getenv("OPENAI_API_KEY"),
+        os.getenv("TOGETHER_BASE_URL") or os.getenv("CYPERSONA_LLM_BASE_URL", LLM_BASE_URL),
+        os.getenv("OPENAI_BASE_URL") or os.getenv("CYPERSONA_LLM_BASE_URL", LLM_BASE_URL)
+    )
+    with _clients_lock:
+        current = _clients and (_clients.together_api_key, _clients.openai_api_key,
+                                _clients.together_base_url, _clients.openai_base_url)
+        if _clients is None or current != settings:
+            previous = _clients
+            _clients = LLMClients(*settings)
+            if previous is not None:
+                threading.Thread(target=previous.close, daemon=True).start()
+        return _clients
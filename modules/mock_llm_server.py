@@ -0,0 +1,405 @@
+"""
+Local OpenAI-compatible stand-in server for load testing
+
+Speaks the chat-completions (including SSE streaming) and embeddings wire
+formats used by the `together` and `openai` clients, with configurable latency,
+token throughput, error and 429 rates. Responses are templated to follow the
+persona (text or JSON) and intervention section formats, so the whole app can
+run against it.
+
+Usage:
+    python modules/mock_llm_server.py --port 8765 --latency-ms 400 --tokens-per-second 80 --rate-limit-rate 0.05
+    CYPERSONA_LLM_BASE_URL=http://127.0.0.1:8765/v1 TOGETHER_API_KEY=mock OPENAI_API_KEY=mock streamlit run main.py
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from persona_schema import RECOMMENDATION_FIELDS, SCORE_FIELDS
+
+DEFAULT_CONFIG = {
+    'latency_ms': 300.0,         # median time to first token
+    'latency_sigma': 0.5,        # lognormal spread of the latency
+    'tokens_per_second': 100.0,  # generation throughput after the first token
+    'error_rate': 0.0,           # fraction of requests answered with HTTP 500
+    'rate_limit_rate': 0.0,      # fraction of requests answered with HTTP 429
+    'retry_after': 1.0,          # Retry-After seconds sent with 429s
+    'embedding_dim': 1536,
+    'embedding_latency_ms': 50.0,
+    'seed': None                 # fixes the random draws (latency, failures, content)
+}
+
+FIRST_NAMES = ["Maya", "Daniel", "Priya", "Marcus", "Elena", "Kwame", "Sofia", "Liam", "Aisha", "Tomas"]
+LAST_NAMES = ["Chen", "Okafor", "Patel", "Rivera", "Novak", "Haddad", "Kim", "Schmidt", "Moreau", "Silva"]
+JOB_TITLES = ["Registered Nurse", "Accounts Payable Specialist", "IT Support Analyst", "High School Teacher",
+              "Procurement Officer", "Software Engineer", "Claims Adjuster", "HR Coordinator"]
+TRAITS = ["conscientious but rushed", "highly trusting of authority", "curious and quick to click",
+          "skeptical and methodical", "eager to please colleagues", "easily overloaded by email"]
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _token_estimate(text):
+    return max(1, len(text) // 4)
+
+
+def _persona_values(rng):
+    return {
+        'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        'age': rng.randint(25, 55),
+        'job_title': rng.choice(JOB_TITLES),
+        'experience_years': rng.randint(2, 4),
+        'personality_trait': rng.choice(TRAITS),
+        'scores': {key: rng.randint(2, 9) for key, _ in SCORE_FIELDS}
+    }
+
+
+def persona_json(rng):
+    """Persona matching PERSONA_JSON_SCHEMA"""
+    values = _persona_values(rng)
+    return json.dumps({
+        'name': values['name'],
+        'age': values['age'],
+        'job_title': values['job_title'],
+        'experience_years': values['experience_years'],
+        'personality_trait': values['personality_trait'],
+        'summary': f"{values['name']} works as a {values['job_title']} under steady time pressure. "
+                   f"Being {values['personality_trait']} shapes how they handle suspicious email.",
+        'scores': {key: {'score': values['scores'][key], 'reason': f"Mock reason for {label.lower()}"}
+                   for key, label in SCORE_FIELDS},
+        'vulnerabilities': ["Approves requests from mobile without checking senders",
+                            "Authority bias toward executive-sounding emails",
+                            "End-of-month deadline pressure"],
+        'protective_behaviors': ["Double-checks payment changes by phone",
+                                 "Uses the report-phish button",
+                                 "Asks the IT help desk when unsure"],
+        'recommendations': {key: f"Mock {label.lower()} recommendation" for key, label in RECOMMENDATION_FIELDS}
+    })
+
+
+def persona_text(rng):
+    """Persona in the numbered-section text format"""
+    values = _persona_values(rng)
+    scores = "\n".join(f"- {label}: {values['scores'][key]}/10 (mock reason for {label.lower()})"
+                       for key, label in SCORE_FIELDS)
+    return f"""1. BASIC PROFILE:
+Name: {values['name']}
+Age: {values['age']}
+Job Title: {values['job_title']}
+Experience: {values['experience_years']} years
+Personality Trait: {values['personality_trait']}
+
+2. BEHAVIORAL SCORES:
+{scores}
+
+3. KEY VULNERABILITIES:
+• Approves requests from mobile without checking senders
+• Authority bias toward executive-sounding emails
+• End-of-month deadline pressure
+
+4. PROTECTIVE BEHAVIORS:
+• Double-checks payment changes by phone
+• Uses the report-phish button
+• Asks the IT help desk when unsure
+
+5. INTERVENTION RECOMMENDATIONS:
+• Communication style: short, casual team-chat messages
+• Training format: five-minute micro-learning modules
+• Timing: Tuesday mornings, away from deadlines
+• Concrete example: a simulated invoice-fraud email followed by instant feedback
+"""
+
+
+def intervention_text(rng):
+    """Prediction in the numbered intervention-analysis format"""
+    return f"""1. ENGAGEMENT LIKELIHOOD: {rng.randint(30, 90)}%
+The persona is likely to open and skim the material during a quiet period.
+
+2. BEHAVIORAL CHANGE PREDICTION:
+Expect fewer clicks on invoice-themed lures and more use of the report button.
+
+3. SUCCESS FACTORS:
+Short format, role-specific examples and immediate feedback.
+
+4. RESISTANCE FACTORS:
+Deadline pressure and alert fatigue.
+
+5. EFFECTIVENESS SCORE: {rng.randint(3, 9)}/10
+
+6. RECOMMENDATIONS:
+Deliver it as a two-minute module with a follow-up simulation two weeks later.
+"""
+
+
+def completion_text(messages, response_format, rng):
+    """Templated completion matching what the prompt asks for"""
+    prompt = "\n".join(str(message.get('content', '')) for message in messages)
+    if "Predict intervention outcomes" in prompt or "ENGAGEMENT LIKELIHOOD" in prompt:
+        return intervention_text(rng)
+    if "cybersecurity persona" in prompt:
+        if response_format or "single JSON object" in prompt:
+            return persona_json(rng)
+        return persona_text(rng)
+    return ("Mock analysis: employees under time pressure click more often, reporting improves after "
+            "short feedback-driven training, and click rates vary most by department.")
+
+
+def embedding_vector(text, dim):
+    """Deterministic hashed bag-of-words embedding (similar texts get similar vectors)"""
+    vector = [0.0] * dim
+    for word in _WORD.findall(text.lower()):
+        h = zlib.crc32(word.encode())
+        vector[h % dim] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, MockLLMHandler)
+        self.config = dict(DEFAULT_CONFIG, **config)
+        self.rng = random.Random(self.config['seed'])
+        self.rng_lock = threading.Lock()
+        self.stats = {'requests': 0, 'chat': 0, 'stream': 0, 'embeddings': 0, 'errors': 0, 'rate_limited': 0}
+
+    def count(self, name):
+        with self.rng_lock:
+            self.stats[name] += 1
+
+    def draw(self, method, *args):
+        with self.rng_lock:
+            return getattr(self.rng, method)(*args)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real providers
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path.endswith('/health'):
+            self._send_json(200, {'status': 'ok'})
+        elif path.endswith('/stats'):
+            self._send_json(200, self.server.stats)
+        elif path.endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model'}]})
+        else:
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': "Invalid JSON body", 'type': 'invalid_request_error'}})
+            return
+
+        server, config = self.server, self.server.config
+        server.count('requests')
+        if self._maybe_fail():
+            return
+        path = self.path.rstrip('/')
+        if path.endswith('/chat/completions'):
+            self._chat(request)
+        elif path.endswith('/embeddings'):
+            self._embeddings(request, config)
+        else:
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+
+    def _maybe_fail(self):
+        config, server = self.server.config, self.server
+        roll = server.draw('random')
+        if roll < config['rate_limit_rate']:
+            server.count('rate_limited')
+            self._send_json(429, {'error': {'message': "Rate limit exceeded (mock)", 'type': 'rate_limit_error'}},
+                            {'Retry-After': f"{config['retry_after']:g}"})
+            return True
+        if roll < config['rate_limit_rate'] + config['error_rate']:
+            server.count('errors')
+            self._send_json(500, {'error': {'message': "Internal error (mock)", 'type': 'server_error'}})
+            return True
+        return False
+
+    def _latency(self):
+        config = self.server.config
+        if config['latency_ms'] <= 0:
+            return 0.0
+        return self.server.draw('lognormvariate', 0.0, config['latency_sigma']) * config['latency_ms'] / 1000
+
+    def _chat(self, request):
+        server, config = self.server, self.server.config
+        messages = request.get('messages') or []
+        # Seeded requests get reproducible content, like the real providers' seed parameter
+        if request.get('seed') is not None:
+            digest = hashlib.sha1(json.dumps([messages, request['seed']], sort_keys=True).encode()).hexdigest()
+            rng = random.Random(digest)
+        else:
+            rng = random.Random(server.draw('random'))
+        text = completion_text(messages, request.get('response_format'), rng)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created, model = int(time.time()), request.get('model', 'mock')
+        prompt_tokens = _token_estimate(" ".join(str(m.get('content', '')) for m in messages))
+        completion_tokens = _token_estimate(text)
+        per_token = 1.0 / config['tokens_per_second'] if config['tokens_per_second'] > 0 else 0.0
+
+        time.sleep(self._latency())
+        if not request.get('stream'):
+            server.count('chat')
+            time.sleep(completion_tokens * per_token)
+            self._send_json(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                          'total_tokens': prompt_tokens + completion_tokens}
+            })
+            return
+
+        server.count('stream')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(delta, finish_reason=None):
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                     'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        try:
+            event({'role': 'assistant', 'content': ''})
+            # ~4 characters per token
+            for start in range(0, len(text), 4):
+                event({'content': text[start:start + 4]})
+                time.sleep(per_token)
+            event({}, 'stop')
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream
+            self.close_connection = True
+
+    def _embeddings(self, request, config):
+        self.server.count('embeddings')
+        inputs = request.get('input') or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(config['embedding_latency_ms'] / 1000)
+        dim = int(request.get('dimensions') or config['embedding_dim'])
+        data = []
+        for index, text in enumerate(inputs):
+            vector = embedding_vector(str(text), dim)
+            if request.get('encoding_format') == 'base64':
+                # The openai client requests base64 float32 by default
+                vector = base64.b64encode(struct.pack(f"<{dim}f", *vector)).decode()
+            data.append({'object': 'embedding', 'index': index, 'embedding': vector})
+        tokens = sum(_token_estimate(str(text)) for text in inputs)
+        self._send_json(200, {'object': 'list', 'data': data, 'model': request.get('model', 'mock'),
+                              'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}})
+
+
+def start_mock_server(host="127.0.0.1", port=0, **config):
+    """Start the server on a background thread and return it (server.url is the base URL)"""
+    server = MockLLMServer((host, port), config)
+    threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True).start()
+    return server
+
+
+def smoke_check(server):
+    """Run one chat completion and one embeddings request through the app's real clients.
+
+    Returns a list of failure messages (empty when both round trips work).
+    """
+    from llm_clients import EMBEDDING_MODEL, LLMClients
+
+    clients = LLMClients("mock", "mock", server.url, server.url)
+    failures = []
+    try:
+        text = clients.run(clients.chat("Say hello", use_cache=False), timeout=60)
+        if not text:
+            failures.append("chat: empty completion")
+    except Exception as e:
+        failures.append(f"chat: {type(e).__name__}: {e}")
+    try:
+        vectors = clients.run(clients.embed(["first text", "second text"], model=EMBEDDING_MODEL), timeout=60)
+        if len(vectors) != 2 or not all(vectors):
+            failures.append(f"embed: expected 2 vectors, got {len(vectors)}")
+    except Exception as e:
+        failures.append(f"embed: {type(e).__name__}: {e}")
+    finally:
+        clients.close()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    for name, default in DEFAULT_CONFIG.items():
+        if name != 'seed':
+            parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--smoke", action="store_true",
+                        help="check that the app's chat and embedding clients work against the server, then exit")
+    args = vars(parser.parse_args(argv))
+    host, port, smoke = args.pop('host'), args.pop('port'), args.pop('smoke')
+
+    if smoke:
+        server = start_mock_server(host, 0, **args)
+        failures = smoke_check(server)
+        server.shutdown()
+        for failure in failures:
+            print(f"FAIL {failure}", file=sys.stderr)
+        print("smoke check " + ("failed" if failures else "passed: chat and embed"), file=sys.stderr)
+        return 1 if failures else 0
+
+    server = MockLLMServer((host, port), args)
+    print(f"Mock LLM server on {server.url} (set CYPERSONA_LLM_BASE_URL to this)", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Persona avatar assets and rendered-card cache
+
+Avatar images are read, downscaled and base64-encoded once per process and
+assigned to personas deterministically by ID, so a persona keeps its face across
+reruns. Rendered card HTML is memoized by (persona ID, content version); editing
+a persona bumps its version with touch_persona().
+"""
+
+import base64
+import io
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow ships with Streamlit, but stay usable without it
+    Image = None
+
+AVATAR_DIR = Path("images")
+AVATAR_EXTENSIONS = ['.png', '.jpg', '.jpeg']
+# Cards display avatars at 120px; keep 2x for high-DPI screens
+AVATAR_MAX_PIXELS = 240
+CARD_CACHE_SIZE = 512
+
+_avatars = None
+_avatars_lock = threading.Lock()
+
+
+def _encode_avatar(path):
+    """Data URI of a downscaled avatar image"""
+    if Image is None:
+        mime = 'image/png' if path.suffix.lower() == '.png' else 'image/jpeg'
+        return f"data:{mime};base64,{base64.b64encode(path.read_bytes()).decode()}"
+    with Image.open(path) as image:
+        image.thumbnail((AVATAR_MAX_PIXELS, AVATAR_MAX_PIXELS))
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', optimize=True)
+    return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+
+def load_avatar_library(avatar_dir=AVATAR_DIR):
+    """{gender: [data URI, ...]} built once per process from images/{gender}_{n}.ext"""
+    global _avatars
+    with _avatars_lock:
+        if _avatars is None:
+            library = {}
+            for gender in ('female', 'male'):
+                paths = [avatar_dir / f"{gender}_{i}{ext}" for i in range(1, 5) for ext in AVATAR_EXTENSIONS]
+                paths = [p for p in paths if p.exists()]
+                if not paths:
+                    paths = [p for p in (avatar_dir / f"{gender}_persona{ext}" for ext in AVATAR_EXTENSIONS) if p.exists()][:1]
+                encoded = []
+                for path in paths:
+                    try:
+                        encoded.append(_encode_avatar(path))
+                    except Exception:
+                        continue
+                library[gender] = encoded
+            _avatars = library
+        return _avatars
+
+
+def avatar_for(persona_id, gender):
+    """Data URI of the persona's avatar (stable per ID), or None when no images exist"""
+    choices = load_avatar_library().get(gender) or []
+    if not choices:
+        return None
+    return choices[zlib.crc32(str(persona_id).encode()) % len(choices)]
+
+
+def touch_persona(persona):
+    """Mark a persona as edited so its cached card is re-rendered"""
+    persona['version'] = persona.get('version', 0) + 1
+
+
+class CardCache:
+    """LRU cache of rendered persona card HTML keyed by (persona ID, version)"""
+
+    def __init__(self, max_entries=CARD_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cards = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get_or_render(self, persona, render):
+        key = (persona['id'], persona.get('version', 0))
+        with self._lock:
+            if key in self._cards:
+                self._cards.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._cards[key]
+        html = render(persona)
+        with self._lock:
+            self.stats['misses'] += 1
+            self._cards[key] = html
+            if len(self._cards) > self.max_entries:
+                self._cards.popitem(last=False)
+        return html
+
+
+_card_cache = CardCache()
+
+
+def get_card_cache():
+    """Process-wide card cache (page modules are re-executed on every Streamlit rerun)"""
+    return _card_cache
@@ -0,0 +1,235 @@
+"""
+Batch persona generation from a spec file
+
+Runs knowledge-base retrieval and persona generation for every row of a CSV or
+JSONL spec file with bounded concurrency, appending each persona to a JSONL
+library as soon as it completes. The library doubles as the checkpoint: a
+re-run skips every (spec, variant) already present, so a crashed job resumes
+where it stopped. Failed generations are not written and are retried next run.
+
+Usage:
+    python modules/persona_batch.py specs.csv --out personas.jsonl --knowledge-base kb.pkl
+
+Spec columns: description (or department/role/location/... to compose one),
+industry, complexity, count (variants per spec), name and spec_id, all optional
+except a description or segment columns.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+from dotenv import load_dotenv
+
+sys.path.append(str(Path(__file__).parent))
+
+# Modules read their CYPERSONA_* settings at import, so .env has to be loaded first
+load_dotenv()
+
+from llm_cache import variant_seed
+from llm_clients import CHAT_CONCURRENCY
+from persona_diversity import LIBRARY_COMPARISON_LIMIT, DiversityIndex, persona_fingerprint_text
+
+SEGMENT_FIELDS = ['role', 'title', 'department', 'location', 'seniority', 'age', 'experience', 'traits']
+FAILURE_PREFIXES = ("Error:", "API connection failed")
+
+
+def read_specs(path):
+    """Read persona specs from CSV or JSONL into a list of dicts with normalized keys"""
+    path = Path(path)
+    if path.suffix.lower() in ('.jsonl', '.ndjson'):
+        with open(path) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        rows = pd.read_csv(path, dtype=str, keep_default_na=False).to_dict('records')
+
+    specs = []
+    for row in rows:
+        row = {str(k).strip().lower(): str(v).strip() for k, v in row.items() if v is not None and str(v).strip()}
+        description = row.get('description') or compose_description(row)
+        if not description:
+            raise ValueError(f"Spec has neither a description nor segment columns: {row}")
+        spec = {
+            'description': description,
+            'industry': row.get('industry', 'Any'),
+            'complexity': row.get('complexity', 'Detailed'),
+            'count': int(row.get('count', 1)),
+            'name': row.get('name')
+        }
+        spec['spec_id'] = row.get('spec_id') or spec_fingerprint(spec)
+        specs.append(spec)
+    return specs
+
+
+def compose_description(row):
+    """Persona request text from segment columns (department x role x location ...)"""
+    parts = [f"{field}: {row[field]}" for field in SEGMENT_FIELDS if row.get(field)]
+    if not parts:
+        return None
+    return f"Create a persona for an employee with {', '.join(parts)}."
+
+
+def spec_fingerprint(spec):
+    payload = json.dumps([spec['description'], spec['industry'], spec['complexity']])
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+
+def load_checkpoint(library_path):
+    """(spec_id, variant) pairs already in the library"""
+    done = set()
+    if Path(library_path).exists():
+        with open(library_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from a crash; that persona is regenerated
+                    continue
+                done.add((record.get('spec_id'), record.get('variant')))
+    return done
+
+
+def _terminate_torn_line(library_path):
+    """Make sure appended records start on a fresh line after a crash mid-write"""
+    path = Path(library_path)
+    if path.exists() and path.stat().st_size:
+        with open(path, 'rb+') as f:
+            f.seek(-1, 2)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+
+def build_contexts(generator, specs, vector_db, max_workers):
+    """Retrieve knowledge context for each distinct (description, industry) concurrently"""
+    keys = list(dict.fromkeys((spec['description'], spec['industry']) for spec in specs))
+    if vector_db is not None and vector_db.index is None:
+        vector_db.build_index()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        contexts = pool.map(lambda key: generator.build_knowledge_context(key[0], key[1], vector_db), keys)
+        return dict(zip(keys, contexts))
+
+
+def library_index_vectors(generator, library_path, limit=LIBRARY_COMPARISON_LIMIT):
+    """(vectors, profiles) of the most recent personas already in a JSONL library"""
+    from persona_schema import persona_profile
+
+    if not Path(library_path).exists():
+        return None, []
+    with open(library_path) as f:
+        records = []
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    profiles = [persona_profile(record) for record in records[-limit:]]
+    if not profiles:
+        return None, []
+    try:
+        vectors = generator.llm.run(generator.llm.embed([persona_fingerprint_text(p) for p in profiles]))
+    except Exception:
+        return None, []
+    return vectors, profiles
+
+
+def run_batch_job(spec_path, library_path, knowledge_base=None, max_concurrency=CHAT_CONCURRENCY, log=print):
+    """Generate every missing persona for a spec file and return the job report"""
+    from data_pipeline import OpenAIVectorDB
+    from persona_generation import PersonaGenerator, build_persona_record
+
+    job_id = str(uuid.uuid4())[:8]
+    started = time.perf_counter()
+    specs = read_specs(spec_path)
+    done = load_checkpoint(library_path)
+
+    pending = [(spec, variant) for spec in specs for variant in range(spec['count'])
+               if (spec['spec_id'], variant) not in done]
+    report = {
+        'job_id': job_id,
+        'spec_file': str(spec_path),
+        'library': str(library_path),
+        'specs': len(specs),
+        'requested': sum(spec['count'] for spec in specs),
+        'already_done': sum(spec['count'] for spec in specs) - len(pending),
+        'generated': 0,
+        'failed': 0,
+        'started_at': datetime.now().isoformat()
+    }
+    log(f"[{job_id}] {len(pending)} persona(s) to generate, {report['already_done']} already in {library_path}")
+
+    if pending:
+        generator = PersonaGenerator()
+        if not generator.check_api_connection():
+            raise RuntimeError("TOGETHER_API_KEY is not configured")
+
+        vector_db = None
+        if knowledge_base:
+            vector_db = OpenAIVectorDB()
+            if not vector_db.load(str(knowledge_base)):
+                raise RuntimeError(f"Could not load knowledge base {knowledge_base}")
+
+        contexts = build_contexts(generator, [spec for spec, _ in pending], vector_db, max_concurrency)
+        bulk_specs = [(spec['description'], spec['industry']) for spec, _ in pending]
+        seeds = [variant_seed(variant) for _, variant in pending]
+
+        # One diversity index for the whole job, seeded with what the library already holds
+        diversity_index = DiversityIndex(*library_index_vectors(generator, library_path))
+
+        _terminate_torn_line(library_path)
+        with open(library_path, 'a') as library:
+            for index, llm_output, context, diversity in generator.generate_personas_bulk(
+                    bulk_specs, vector_db=vector_db, max_concurrency=max_concurrency, knowledge_contexts=contexts,
+                    seeds=seeds, diversity_index=diversity_index):
+                spec, variant = pending[index]
+                if not llm_output or llm_output.startswith(FAILURE_PREFIXES):
+                    report['failed'] += 1
+                    log(f"[{job_id}] FAILED {spec['spec_id']}#{variant}: {(llm_output or 'empty response')[:200]}")
+                else:
+                    name = spec['name'] or f"Persona {spec['spec_id']}-{variant + 1}"
+                    if spec['name'] and spec['count'] > 1:
+                        name = f"{name} ({variant + 1})"
+                    record = build_persona_record(spec['description'], spec['industry'], spec['complexity'],
+                                                  llm_output, context, name, diversity)
+                    record.update({'spec_id': spec['spec_id'], 'variant': variant, 'job_id': job_id})
+                    library.write(json.dumps(record) + "\n")
+                    library.flush()
+                    report['generated'] += 1
+                finished = report['generated'] + report['failed']
+                if finished % 10 == 0 or finished == len(pending):
+                    log(f"[{job_id}] {finished}/{len(pending)} done ({report['failed']} failed)")
+
+    elapsed = time.perf_counter() - started
+    report['elapsed_seconds'] = round(elapsed, 2)
+    report['personas_per_minute'] = round(report['generated'] / elapsed * 60, 2) if elapsed else 0.0
+    report['finished_at'] = datetime.now().isoformat()
+
+    # Per-job reports accumulate next to the library
+    with open(f"{library_path}.jobs.jsonl", 'a') as jobs:
+        jobs.write(json.dumps(report) + "\n")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a persona library from a CSV/JSONL spec file")
+    parser.add_argument("specs", help="CSV or JSONL file of persona specs")
+    parser.add_argument("--out", required=True, help="JSONL persona library (also the resume checkpoint)")
+    parser.add_argument("--knowledge-base", help="Knowledge base .pkl saved from Step 1")
+    parser.add_argument("--concurrency", type=int, default=CHAT_CONCURRENCY,
+                        help="Maximum retrievals/completions in flight")
+    args = parser.parse_args(argv)
+
+    report = run_batch_job(args.specs, args.out, args.knowledge_base, args.concurrency,
+                           log=lambda message: print(message, file=sys.stderr))
+    print(json.dumps(report, indent=2))
+    return 1 if report['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Diversity-aware persona variant sampling
+
+Each generated persona's profile is embedded and compared (cosine) with its
+sibling variants and with the existing library. A variant that is too close to
+something already there is regenerated, steered away with perturbed behavioral
+score targets, an explicit "differ from" note and a different slice of the
+retrieved research context.
+"""
+
+import os
+import random
+
+import numpy as np
+
+from context_packing import normalize_rows, pack_context
+from llm_clients import EMBEDDING_MODEL
+from persona_schema import SCORE_FIELDS
+
+DIVERSITY_THRESHOLD = float(os.getenv("CYPERSONA_DIVERSITY_THRESHOLD", "0.92"))
+MAX_DIVERSITY_RETRIES = int(os.getenv("CYPERSONA_DIVERSITY_RETRIES", "2"))
+LIBRARY_COMPARISON_LIMIT = 500
+CONTEXT_SLICE = 5
+
+
+def persona_fingerprint_text(profile):
+    """What makes a persona distinct, without the name (names differ even between duplicates)"""
+    scores = ", ".join(
+        f"{label} {profile['scores'][key]['score']:g}"
+        for key, label in SCORE_FIELDS if profile['scores'][key]['score'] is not None
+    )
+    parts = [
+        profile.get('job_title') or '',
+        f"age {profile['age']}" if profile.get('age') else '',
+        profile.get('personality_trait') or '',
+        scores,
+        "; ".join(profile.get('vulnerabilities', [])),
+        "; ".join(profile.get('protective_behaviors', [])),
+        "; ".join(v for v in profile.get('recommendations', {}).values() if v),
+        profile.get('summary', '') if profile.get('source') == 'json' else ''
+    ]
+    return "\n".join(part for part in parts if part)
+
+
+class DiversityIndex:
+    """Normalized profile embeddings of the library and of variants accepted so far"""
+
+    def __init__(self, library_vectors=None, library_profiles=None):
+        self.vectors = normalize_rows(library_vectors) if library_vectors is not None and len(library_vectors) else None
+        self.profiles = list(library_profiles or [])
+
+    def nearest(self, vector):
+        """(cosine similarity, profile) of the closest accepted persona, or (0.0, None)"""
+        if self.vectors is None:
+            return 0.0, None
+        similarities = self.vectors @ normalize_rows(vector)[0]
+        best = int(np.argmax(similarities))
+        return float(similarities[best]), self.profiles[best] if best < len(self.profiles) else None
+
+    def add(self, vector, profile):
+        vector = normalize_rows(vector)
+        self.vectors = vector if self.vectors is None else np.vstack([self.vectors, vector])
+        self.profiles.append(profile)
+
+
+def steering_instructions(nearest_profile, attempt, seed=None):
+    """Prompt addendum pushing a regenerated variant away from its nearest neighbour"""
+    rng = random.Random(f"{seed}-{attempt}")
+    targets = []
+    for key, label in SCORE_FIELDS:
+        current = (nearest_profile or {}).get('scores', {}).get(key, {}).get('score')
+        choices = [v for v in range(1, 10) if current is None or abs(v - current) >= 3]
+        targets.append(f"{label} about {rng.choice(choices or list(range(1, 10)))}/10")
+    lines = ["", "DIVERSITY REQUIREMENTS (the library already has a very similar persona):",
+             f"- Target behavioral scores: {', '.join(targets)}"]
+    if nearest_profile:
+        existing = ", ".join(filter(None, [nearest_profile.get('job_title'), nearest_profile.get('personality_trait')]))
+        if existing:
+            lines.append(f"- Clearly differ from the existing persona: {existing}")
+        if nearest_profile.get('vulnerabilities'):
+            lines.append(f"- Do not reuse these vulnerabilities: {'; '.join(nearest_profile['vulnerabilities'][:3])}")
+    return "\n".join(lines)
+
+
+def context_slice(results, attempt, query, vector_db=None):
+    """Packed research context from a later window of the ranked retrieval results"""
+    window = results[attempt * CONTEXT_SLICE:(attempt + 1) * CONTEXT_SLICE] or results[:CONTEXT_SLICE]
+    vectors = vector_db.result_vectors(window) if hasattr(vector_db, 'result_vectors') else None
+    return pack_context(query, window, vectors=vectors)
+
+
+def library_embeddings(store, llm, industry=None, limit=LIBRARY_COMPARISON_LIMIT):
+    """(vectors, profiles) of recent library personas, embedding any that have no stored vector yet"""
+    from persona_schema import persona_profile
+
+    summaries = store.list_summaries(limit=limit, industry=industry)
+    ids = [summary['id'] for summary in summaries]
+    stored = store.embeddings(ids)
+    missing = [persona_id for persona_id in ids if persona_id not in stored]
+    if missing:
+        personas = store.get_many(missing)
+        texts = [persona_fingerprint_text(persona_profile(persona)) for persona in personas]
+        try:
+            vectors = llm.run(llm.embed(texts, model=EMBEDDING_MODEL)) if texts else []
+        except Exception:
+            vectors = []
+        new = {persona['id']: vector for persona, vector in zip(personas, vectors)}
+        if new:
+            store.save_embeddings(new)
+            stored.update({k: np.asarray(v, dtype=np.float32) for k, v in new.items()})
+    ids = [persona_id for persona_id in ids if persona_id in stored]
+    if not ids:
+        return None, []
+    profiles = [persona_profile(persona) for persona in store.get_many(ids)]
+    return np.vstack([stored[persona_id] for persona_id in ids]), profiles
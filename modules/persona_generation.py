@@ -9,22 +9,41 @@ import json
 import os
 import uuid
 from datetime import datetime
-import together
 import plotly.express as px
-import base64
-from pathlib import Path
+from llm_clients import get_llm_clients, TOGETHER_MODEL, CHAT_CONCURRENCY
+from llm_cache import variant_seed
+from persona_assets import avatar_for, get_card_cache, touch_persona
+from persona_store import get_persona_store, PAGE_SIZE
+from job_runner import current_session_id, get_job_runner, render_job_history, render_job_panel
+from context_packing import CANDIDATE_COUNT, pack_context
+from persona_traits import get_trait_table, trait_vector
+from archetype_clustering import (
+    ARCHETYPE_COUNT, FEATURE_LABELS, archetype_description, archetype_specs, find_archetypes, load_knowbe4_columns
+)
+from population_synthesis import PopulationModel, narrate_sample, summarize_cohort
+from persona_diversity import (
+    CONTEXT_SLICE, DIVERSITY_THRESHOLD, MAX_DIVERSITY_RETRIES, DiversityIndex, context_slice,
+    library_embeddings, persona_fingerprint_text, steering_instructions
+)
+from persona_schema import (
+    PERSONA_JSON_SCHEMA, SCORE_FIELDS, RECOMMENDATION_FIELDS, parse_persona_content,
+    profile_from_output, profile_from_text, profile_to_text, persona_profile
+)
+
+# Generate personas as schema-validated JSON (JSON-mode decoding where Together supports it)
+STRUCTURED_PERSONAS = os.getenv("CYPERSONA_STRUCTURED_PERSONAS", "1") != "0"
 
 class PersonaGenerator:
     def __init__(self):
-        self.model_name = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo"
-        self.together_client = None
+        self.model_name = TOGETHER_MODEL
+        self.llm = None
         self.together_api_key = os.getenv("TOGETHER_API_KEY")
         
     def check_api_connection(self):
         if not self.together_api_key:
             return False
         try:
-            self.together_client = together.Together(api_key=self.together_api_key)
+            self.llm = get_llm_clients()
             return True
         except Exception as e:
             st.error(f"API connection failed: {e}")
@@ -32,12 +51,127 @@ class PersonaGenerator:
     
     def query_knowledge_base(self, query, vector_db):
         if vector_db and hasattr(vector_db, 'query'):
-            results = vector_db.query(query, top_k=5)
-            return "\n".join([result['text'] for result in results])
+            # Over-fetch, then keep relevant, non-redundant passages within the prompt budget
+            results = vector_db.query(query, top_k=CANDIDATE_COUNT)
+            vectors = vector_db.result_vectors(results) if hasattr(vector_db, 'result_vectors') else None
+            return pack_context(query, results, vectors=vectors)
         return "No knowledge base available"
     
+    def build_knowledge_context(self, description, industry, vector_db=None, catalog=None):
+        """Research context for a persona request: KB passages plus exact segment statistics"""
+        if vector_db:
+            knowledge_context = self.query_knowledge_base(f"{description} {industry} cybersecurity behavior", vector_db)
+        else:
+            knowledge_context = "Knowledge base not available - using general cybersecurity patterns"
+        
+        # Add exact segment statistics when the datasets are registered for SQL
+        if catalog:
+            segment_facts = catalog.segment_facts(description)
+            if segment_facts:
+                knowledge_context = f"{knowledge_context}\n\n{segment_facts}"
+        return knowledge_context
+    
     def generate_persona_from_description(self, description, knowledge_context):
-        prompt = f"""
+        prompt = self.build_persona_prompt(description, knowledge_context, structured=STRUCTURED_PERSONAS)
+        return self._query_llm(prompt, structured=STRUCTURED_PERSONAS)
+    
+    def stream_persona_from_description(self, description, knowledge_context):
+        """Yield the persona text accumulated so far as tokens arrive.
+        
+        Streaming uses the sectioned text format so partial output can be previewed;
+        the finished text is parsed into the typed profile once, in build_persona_record.
+        """
+        yield from self._stream_llm(self.build_persona_prompt(description, knowledge_context))
+    
+    def generate_personas_bulk(self, specs, vector_db=None, catalog=None, max_concurrency=CHAT_CONCURRENCY,
+                               knowledge_contexts=None, seeds=None, diversity_index=None):
+        """Generate personas for many (description, industry) pairs concurrently.
+        
+        Yields (index, llm_output, knowledge_context, diversity) as each completion finishes,
+        so N personas take roughly as long as one, up to max_concurrency in flight.
+        knowledge_contexts may map (description, industry) to an already built context;
+        seeds optionally gives each spec an explicit sampling seed. Every persona is
+        checked against its siblings and diversity_index (the existing library) and
+        near-duplicates are regenerated with steering. diversity is None when the
+        check could not run (e.g. no embeddings available).
+        """
+        specs = list(specs)
+        if not self.llm and not self.check_api_connection():
+            for index in range(len(specs)):
+                yield index, "API connection failed", "", None
+            return
+        
+        # Identical requests share one retrieval
+        contexts = dict(knowledge_contexts or {})
+        for spec in specs:
+            if spec not in contexts:
+                contexts[spec] = self.build_knowledge_context(spec[0], spec[1], vector_db, catalog)
+        
+        # Repeated specs are variants: in deterministic mode each gets its own seed
+        diversity_index = diversity_index if diversity_index is not None else DiversityIndex()
+        coros, seen = [], {}
+        for description, industry in specs:
+            variant = seen[(description, industry)] = seen.get((description, industry), -1) + 1
+            seed = seeds[len(coros)] if seeds is not None else variant_seed(variant)
+            coros.append(self._generate_diverse_async(
+                description, industry, contexts[(description, industry)], seed, diversity_index, vector_db
+            ))
+        for index, result in self.llm.iter_completed(coros, max_concurrency):
+            if isinstance(result, Exception):
+                result = (f"Error: {str(result)}", contexts[specs[index]], None)
+            persona_response, context, diversity = result
+            yield index, persona_response, context, diversity
+    
+    async def _generate_diverse_async(self, description, industry, knowledge_context, seed, diversity_index,
+                                      vector_db=None):
+        """Generate one persona, regenerating with steering while it is a near-duplicate"""
+        context, steering, retrieved, best = knowledge_context, "", None, None
+        _, _, segment_facts = knowledge_context.partition("\n\nEXACT ")
+        for attempt in range(MAX_DIVERSITY_RETRIES + 1):
+            prompt = self.build_persona_prompt(description, context, structured=STRUCTURED_PERSONAS) + steering
+            persona_response = await self._query_llm_async(prompt, seed=seed, structured=STRUCTURED_PERSONAS)
+            if persona_response.startswith(("Error:", "API connection failed")):
+                return persona_response, context, None
+            profile = profile_from_output(persona_response)
+            fingerprint = persona_fingerprint_text(profile)
+            try:
+                vector = (await self.llm.embed(fingerprint))[0] if fingerprint else None
+            except Exception:
+                vector = None
+            if vector is None:
+                # Unparseable output or no embeddings: the diversity check is skipped
+                return persona_response, context, None
+            
+            similarity, nearest = diversity_index.nearest(vector)
+            if best is None or similarity < best[0]:
+                best = (similarity, persona_response, context, vector, profile)
+            if similarity < DIVERSITY_THRESHOLD:
+                break
+            
+            # Too close to a sibling or library persona: steer the next attempt away from it
+            steering = "\n" + steering_instructions(nearest, attempt, seed)
+            if vector_db is not None:
+                try:
+                    query = f"{description} {industry} cybersecurity behavior"
+                    if retrieved is None:
+                        query_vector = (await self.llm.embed(query))[0]
+                        retrieved = vector_db.search_embedding(query_vector, top_k=CONTEXT_SLICE * (MAX_DIVERSITY_RETRIES + 1))
+                    sliced = context_slice(retrieved, attempt + 1, query, vector_db)
+                    if sliced:
+                        context = f"{sliced}\n\nEXACT {segment_facts}" if segment_facts else sliced
+                except Exception:
+                    pass
+        
+        # Keep the least similar attempt; accepting it makes it a sibling for the rest
+        similarity, persona_response, context, vector, profile = best
+        diversity_index.add(vector, profile)
+        return persona_response, context, {'max_similarity': round(similarity, 4), 'attempts': attempt + 1,
+                                           'embedding': vector}
+    
+    def build_persona_prompt(self, description, knowledge_context, structured=False):
+        if structured:
+            return self.build_structured_persona_prompt(description, knowledge_context)
+        return f"""
 Create a cybersecurity persona based on research data. Be SPECIFIC and ACTIONABLE, avoid generic statements.
 
 RESEARCH CONTEXT:
@@ -77,88 +211,194 @@ Design a SPECIFIC intervention for THIS persona:
 
 Make every detail specific to this persona's role, industry, and psychology. No generic advice.
         """
-        return self._query_llm(prompt)
 
-    def _query_llm(self, prompt):
-        if not self.together_client and not self.check_api_connection():
+    def build_structured_persona_prompt(self, description, knowledge_context):
+        score_lines = "\n".join(f"- {key}: {label}, score 0-10 with ONE specific reason" for key, label in SCORE_FIELDS)
+        return f"""
+Create a cybersecurity persona based on research data. Be SPECIFIC and ACTIONABLE, avoid generic statements.
+
+RESEARCH CONTEXT:
+{knowledge_context}
+
+USER REQUEST: "{description}"
+
+Respond with a single JSON object and nothing else, matching this JSON schema:
+{json.dumps(PERSONA_JSON_SCHEMA)}
+
+Field guidance:
+- name, age (25-55), job_title, experience_years (2-4), personality_trait: one specific trait that affects security behavior
+- summary: two sentences on how their role and psychology shape security behavior
+- scores:
+{score_lines}
+- vulnerabilities: a technical/procedural weakness, a cognitive bias or emotional trigger, a workplace pressure
+- protective_behaviors: a natural security strength, a positive habit, how they seek help when uncertain
+- recommendations: communication_style, training_format, timing (timing and delivery method) and one concrete example intervention
+
+Make every detail specific to this persona's role, industry, and psychology. No generic advice.
+        """
+
+    def _query_llm(self, prompt, structured=False):
+        if not self.llm and not self.check_api_connection():
             return "API connection failed"
-        
+        return self.llm.run(self._query_llm_async(prompt, structured=structured))
+
+    def _stream_llm(self, prompt):
+        if not self.llm and not self.check_api_connection():
+            yield "API connection failed"
+            return
+        text = ""
+        try:
+            for delta in self.llm.iter_stream(self.llm.stream_chat(
+                prompt, model=self.model_name, max_tokens=800, temperature=0.7
+            )):
+                text += delta
+                yield text
+        except Exception as e:
+            yield f"{text}\nError: {str(e)}" if text else f"Error: {str(e)}"
+
+    async def _query_llm_async(self, prompt, seed=None, structured=False):
+        params = {'seed': seed} if seed is not None else {}
+        if structured:
+            params['response_format'] = {"type": "json_object", "schema": PERSONA_JSON_SCHEMA}
         try:
-            response = self.together_client.chat.completions.create(
+            return await self.llm.chat(
+                prompt,
                 model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
                 max_tokens=800,
                 temperature=0.7,
-                stream=False
+                **params
             )
-            return response.choices[0].message.content
         except Exception as e:
+            if structured and _rejects_response_format(e):
+                # Models without JSON mode still follow the schema in the prompt
+                params.pop('response_format')
+                try:
+                    return await self.llm.chat(prompt, model=self.model_name, max_tokens=800,
+                                               temperature=0.7, **params)
+                except Exception as retry_error:
+                    e = retry_error
             return f"Error: {str(e)}"
 
-def parse_persona_content(llm_output):
-    """Parse LLM output into structured components with better section detection"""
-    sections = {'basic_profile': '', 'behavioral_scores': '', 'vulnerabilities': '', 
-               'protective_behaviors': '', 'recommendations': ''}
-    
-    current_section = None
-    lines = llm_output.split('\n')
-    
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Detect section headers with more specific patterns
-        line_upper = line.upper()
-        if ('BASIC PROFILE' in line_upper or line_upper.startswith('1.')) and 'BASIC' in line_upper:
-            current_section = 'basic_profile'
-            continue
-        elif ('BEHAVIORAL SCORE' in line_upper or line_upper.startswith('2.')) and ('BEHAVIORAL' in line_upper or 'SCORE' in line_upper):
-            current_section = 'behavioral_scores'
-            continue
-        elif ('VULNERABILITIES' in line_upper or line_upper.startswith('3.')) and 'VULNERABILITIES' in line_upper:
-            current_section = 'vulnerabilities'
-            continue
-        elif ('PROTECTIVE' in line_upper or 'BEHAVIORS' in line_upper or line_upper.startswith('4.')) and ('PROTECTIVE' in line_upper or 'BEHAVIORS' in line_upper):
-            current_section = 'protective_behaviors'
-            continue
-        elif ('RECOMMENDATION' in line_upper or 'INTERVENTION' in line_upper or line_upper.startswith('5.')) and ('RECOMMENDATION' in line_upper or 'INTERVENTION' in line_upper):
-            current_section = 'recommendations'
-            continue
-        
-        # Add content to current section
-        if current_section:
-            sections[current_section] += line + '\n'
-    
-    return sections
 
-def get_persona_image_base64(gender):
-    """Get base64 encoded image for persona display"""
-    import random
+def _rejects_response_format(error):
+    """True if the provider refused the request because it does not support JSON mode.
+
+    Rate limits, timeouts and server errors are not retried without the schema.
+    """
+    message = str(error).lower()
+    return getattr(error, 'status_code', None) in (400, 422) \
+        and any(token in message for token in ('response_format', 'json', 'schema'))
+
+
+def build_persona_record(description, industry, complexity, llm_output, knowledge_context, name, diversity=None):
+    """Session-state persona record for one generated persona.
     
+    The output is validated into the typed 'profile' here, once; JSON output is
+    also rendered back to readable text for the editor and exports.
+    """
+    profile = None
+    if llm_output and not llm_output.startswith(("Error:", "API connection failed")):
+        profile = profile_from_output(llm_output)
+        if profile['source'] == 'json':
+            llm_output = profile_to_text(profile)
+    return {
+        'id': str(uuid.uuid4())[:8],
+        'name': name,
+        'description': description,
+        'generated_at': datetime.now().isoformat(),
+        'llm_output': llm_output,
+        'profile': profile,
+        'industry': industry,
+        'complexity': complexity,
+        'knowledge_context': knowledge_context[:500] + "..." if len(knowledge_context) > 500 else knowledge_context,
+        'diversity': {k: v for k, v in diversity.items() if k != 'embedding'} if diversity else None
+    }
+
+PERSONA_SECTION_TITLES = {
+    'basic_profile': "Basic Profile",
+    'behavioral_scores': "Behavioral Scores",
+    'vulnerabilities': "Key Vulnerabilities",
+    'protective_behaviors': "Protective Behaviors",
+    'recommendations': "Intervention Recommendations"
+}
+
+def format_partial_persona(llm_output):
+    """Markdown preview of a persona while it is still streaming"""
+    parsed = parse_persona_content(llm_output)
+    blocks = [f"**{PERSONA_SECTION_TITLES[key]}**\n\n{content.strip()}"
+              for key, content in parsed.items() if content.strip()]
+    return "\n\n".join(blocks) if blocks else llm_output
+
+def stream_persona_job(job, generator, store, description, industry, complexity, vector_db=None, catalog=None):
+    """Background job: stream one persona (previewed live) and save it to the library"""
+    job.progress(0, 1, "Retrieving research context...")
+    knowledge_context = generator.build_knowledge_context(description, industry, vector_db, catalog)
+    job.progress(0, 1, "Writing persona...")
+    persona_response = ""
+    for persona_response in generator.stream_persona_from_description(description, knowledge_context):
+        job.preview(format_partial_persona(persona_response))
+        job.check()
+    record = build_persona_record(description, industry, complexity, persona_response, knowledge_context,
+                                  f"Persona {store.count() + 1}")
+    store.save(record)
+    job.add_result({'id': record['id'], 'name': record['name']})
+    job.progress(1, 1, "Saved")
+    return {'saved': [record['id']]}
+
+def generate_personas_job(job, generator, store, specs, vector_db=None, catalog=None, library_industry=None):
+    """Background job: generate persona specs concurrently, saving each record as it finishes.
+
+    specs are dicts with description, industry, complexity, an optional name and
+    optional 'extra' record fields. With library_industry the personas are also
+    kept apart from the existing library of that industry. Cancelling stops after
+    the next completion; personas already saved stay in the library.
+    """
+    job.progress(0, len(specs), "Retrieving research context...")
+    vectors, profiles = (None, [])
+    if library_industry is not None:
+        vectors, profiles = library_embeddings(store, generator.llm, library_industry)
+    saved = []
+    results = generator.generate_personas_bulk(
+        [(spec['description'], spec['industry']) for spec in specs], vector_db=vector_db, catalog=catalog,
+        diversity_index=DiversityIndex(vectors, profiles)
+    )
     try:
-        # Look for variation files
-        variations = []
-        for i in range(1, 5):
-            for ext in ['.png', '.jpg', '.jpeg']:
-                image_path = Path(f"images/{gender}_{i}{ext}")
-                if image_path.exists():
-                    variations.append(image_path)
-        
-        if variations:
-            selected_image = random.choice(variations)
-            with open(selected_image, "rb") as img_file:
-                return base64.b64encode(img_file.read()).decode()
-        
-        # Fallback
-        for ext in ['.png', '.jpg', '.jpeg']:
-            image_path = Path(f"images/{gender}_persona{ext}")
-            if image_path.exists():
-                with open(image_path, "rb") as img_file:
-                    return base64.b64encode(img_file.read()).decode()
-        return None
-    except Exception:
-        return None
+        for index, persona_response, context, diversity in results:
+            spec = specs[index]
+            record = build_persona_record(spec['description'], spec['industry'], spec['complexity'], persona_response,
+                                          context, spec.get('name') or f"Persona {store.count() + 1}", diversity)
+            record.update(spec.get('extra', {}))
+            store.save(record)
+            if diversity:
+                store.save_embeddings({record['id']: diversity['embedding']})
+            saved.append(record['id'])
+            job.add_result({'id': record['id'], 'name': record['name']})
+            job.progress(len(saved), len(specs), f"Generated {len(saved)}/{len(specs)} persona(s)")
+            if job.cancelled:
+                break
+    finally:
+        # Closing the generator cancels completions still in flight
+        results.close()
+    return {'saved': saved}
+
+def narrate_cohort_job(job, generator, store, cohort, sample_size, seed=None, vector_db=None, catalog=None):
+    """Background job: narrate a few synthetic cohort members as full personas.
+
+    Each persona is saved as it completes; cancelling stops after the next one.
+    """
+    job.progress(0, sample_size, f"Writing {sample_size} narrative persona(s)...")
+    records = narrate_sample(cohort, generator, sample_size, seed=seed, vector_db=vector_db, catalog=catalog)
+    saved = []
+    try:
+        for record in records:
+            store.save(record)
+            saved.append(record['id'])
+            job.add_result({'id': record['id'], 'name': record['name']})
+            job.progress(len(saved), sample_size, f"Saved {len(saved)}/{sample_size} narrated persona(s)")
+            job.check()
+    finally:
+        records.close()
+    return {'saved': saved}
 
 def create_gradient_avatar(gender):
     """Create CSS gradient avatar as fallback"""
@@ -259,74 +499,52 @@ def get_card_css():
 
 def render_persona_card(persona):
     """Render beautiful persona card with enhanced styling"""
-    parsed = parse_persona_content(persona['llm_output'])
-    
-    # Extract name
-    basic_profile = parsed['basic_profile'].strip()
-    extracted_name = None
-    if basic_profile:
-        for line in basic_profile.split('\n'):
-            # Look for patterns like "Name: Dr. Sarah Johnson" or "Dr. Sarah Johnson"
-            if 'name' in line.lower() and ':' in line:
-                name_part = line.split(':')[-1].strip()
-                words = name_part.split()
-            else:
-                words = line.split()
-            
-            # Extract full name including titles
-            name_parts = []
-            for i, word in enumerate(words):
-                clean_word = word.rstrip('.,').strip()
-                if clean_word and (clean_word.istitle() or clean_word.startswith('Dr') or clean_word.startswith('Mr') or clean_word.startswith('Ms')):
-                    name_parts.append(clean_word)
-                    # Continue collecting until we hit a non-name word
-                    if len(name_parts) >= 3:  # Title + First + Last is enough
-                        break
-                elif name_parts:  # If we started collecting names but hit a non-name, stop
-                    break
-            
-            if len(name_parts) >= 2:  # At least first and last name
-                extracted_name = ' '.join(name_parts)
-                break
+    profile = persona_profile(persona)
+    display_name = profile['name'] or persona['name']
     
-    display_name = extracted_name or persona['name']
+    # Profile overview from typed fields (free-text personas keep their own wording)
+    if profile['source'] == 'json':
+        overview_items = [
+            f"<strong>{label}:</strong> {value}" for label, value in (
+                ("Job Title", profile['job_title']),
+                ("Age", profile['age']),
+                ("Experience", f"{profile['experience_years']:g} years" if profile['experience_years'] is not None else None),
+                ("Personality", profile['personality_trait'])
+            ) if value
+        ]
+        basic_profile = "<br>".join(overview_items + ([profile['summary']] if profile['summary'] else []))
+    else:
+        basic_profile = profile['summary'].replace('\n', '<br>')
     
     # Determine gender
     female_names = ['Sarah', 'Maria', 'Jennifer', 'Lisa', 'Michelle', 'Amanda', 'Jessica', 
                    'Rachel', 'Emily', 'Ashley', 'Anna', 'Patricia', 'Laura', 'Elizabeth', 'Karen']
     gender = 'female' if any(name in display_name for name in female_names) else 'male'
     
-    # Get image or create avatar
-    img_base64 = get_persona_image_base64(gender)
-    avatar_html = (f'<img src="data:image/png;base64,{img_base64}" class="persona-avatar" alt="{display_name}">' 
-                  if img_base64 else create_gradient_avatar(gender))
+    # Cached avatar (stable per persona ID) or a gradient fallback
+    avatar_uri = avatar_for(persona['id'], gender)
+    avatar_html = (f'<img src="{avatar_uri}" class="persona-avatar" alt="{display_name}">' 
+                  if avatar_uri else create_gradient_avatar(gender))
     
-    # Parse behavioral scores
+    # Behavioral scores
     scores_html = ""
-    if parsed['behavioral_scores']:
-        score_lines = [line.strip() for line in parsed['behavioral_scores'].split('\n') 
-                      if line.strip() and ('/' in line or 'score' in line.lower())]
-        
-        if score_lines:
-            scores_html = '<div class="behavioral-scores">'
-            for line in score_lines[:5]:
-                if '/' in line:
-                    parts = line.split(':')
-                    if len(parts) >= 2:
-                        label = parts[0].strip().replace('-', '').replace('•', '').strip()
-                        rest = parts[1].strip()
-                        score_match = rest.split('(')
-                        score = score_match[0].strip()
-                        reason = score_match[1].replace(')', '').strip() if len(score_match) > 1 else "See profile"
-                        
-                        scores_html += f'''
-                        <div class="score-item">
-                            <div class="score-label">{label}</div>
-                            <div class="score-value">{score}</div>
-                            <div class="score-reason">{reason}</div>
-                        </div>
-                        '''
-            scores_html += '</div>'
+    scored = [(label, profile['scores'][key]) for key, label in SCORE_FIELDS if profile['scores'][key]['score'] is not None]
+    if scored:
+        scores_html = '<div class="behavioral-scores">'
+        for label, entry in scored:
+            scores_html += f'''
+            <div class="score-item">
+                <div class="score-label">{label}</div>
+                <div class="score-value">{entry['score']:g}/10</div>
+                <div class="score-reason">{entry['reason'] or "See profile"}</div>
+            </div>
+            '''
+        scores_html += '</div>'
+    
+    vulnerabilities = "<br>".join(f"• {item}" for item in profile['vulnerabilities'])
+    protective_behaviors = "<br>".join(f"• {item}" for item in profile['protective_behaviors'])
+    recommendations = "<br>".join(f"• <strong>{label}:</strong> {profile['recommendations'][key]}"
+                                  for key, label in RECOMMENDATION_FIELDS if profile['recommendations'][key])
     
     # Build card HTML
     card_html = f"""
@@ -352,29 +570,133 @@ def render_persona_card(persona):
         {scores_html}
         """
     
-    if parsed['vulnerabilities']:
+    if vulnerabilities:
         card_html += f"""
         <div class="section-header"><span class="icon">⚠️</span>Key Vulnerabilities</div>
-        <div class="vulnerability-section">{parsed['vulnerabilities']}</div>
+        <div class="vulnerability-section">{vulnerabilities}</div>
         """
     
-    if parsed['protective_behaviors']:
+    if protective_behaviors:
         card_html += f"""
         <div class="section-header"><span class="icon">🛡️</span>Protective Behaviors</div>
-        <div class="strength-section">{parsed['protective_behaviors']}</div>
+        <div class="strength-section">{protective_behaviors}</div>
         """
     
-    if parsed['recommendations']:
+    if recommendations:
         card_html += f"""
         <div class="section-header"><span class="icon">💡</span>Targeted Intervention Strategy</div>
         <div class="recommendation-section">
             <strong>Personalized Approach:</strong><br>
-            {parsed['recommendations']}
+            {recommendations}
         </div>
         """
     
     return card_html + "</div>"
 
+def render_archetype_ui(generator, store):
+    """Cluster KnowBe4 employees into archetypes and turn them into persona requests"""
+    catalog = st.session_state.get('analytics_catalog')
+    with st.expander("🧭 Employee Archetypes from KnowBe4", expanded=False):
+        if not catalog or not catalog.has_dataset('knowbe4'):
+            st.info("Process a KnowBe4 export in Step 1 to find employee archetypes")
+            return
+        k_col, run_col = st.columns([2, 1])
+        with k_col:
+            archetype_count = st.slider("Archetypes", 3, 10, ARCHETYPE_COUNT)
+        with run_col:
+            if st.button("Find Archetypes", use_container_width=True):
+                with st.spinner("Clustering employees..."):
+                    st.session_state.archetypes = find_archetypes(load_knowbe4_columns(catalog), archetype_count)
+        
+        result = st.session_state.get('archetypes')
+        if not result:
+            return
+        st.caption(f"{result['employees']:,} employees clustered on {', '.join(result['features'])}")
+        table = pd.DataFrame([
+            {'Archetype': a['archetype_id'], 'Label': a['label'], 'Share': f"{a['weight']:.0%}",
+             **{FEATURE_LABELS[name]: round(value, 2) for name, value in a['centroid'].items()}}
+            for a in result['archetypes']
+        ])
+        st.dataframe(table, hide_index=True, use_container_width=True)
+        
+        for archetype in result['archetypes']:
+            st.button(f"Use {archetype['archetype_id']} ({archetype['label']}) as description",
+                      key=f"use_archetype_{archetype['archetype_id']}",
+                      on_click=lambda a=archetype: st.session_state.update(persona_description=archetype_description(a)))
+        
+        specs = archetype_specs(result['archetypes'])
+        gen_col, export_col = st.columns(2)
+        with gen_col:
+            if st.button("Generate One Persona per Archetype", type="primary", use_container_width=True):
+                if generator.llm or generator.check_api_connection():
+                    # One persona each; population-weighted counts are only for the batch export
+                    persona_specs = [{**{key: value for key, value in spec.items() if key != 'count'},
+                                      'extra': {'archetype_weight': spec['weight']}} for spec in specs]
+                    job_id = get_job_runner().submit(
+                        'persona_generation', f"{len(specs)} archetype personas", generate_personas_job, generator,
+                        store, persona_specs, st.session_state.get('vector_knowledge_base'), catalog,
+                        session_id=current_session_id()
+                    )
+                    st.session_state.setdefault('persona_jobs', []).append(job_id)
+                    st.rerun()
+        with export_col:
+            st.download_button(
+                "Download Specs (JSONL)",
+                "".join(json.dumps(spec) + "\n" for spec in archetype_specs(result['archetypes'], total_personas=20)),
+                "archetype_specs.jsonl",
+                "application/json",
+                help="Population-weighted specs for modules/persona_batch.py",
+                use_container_width=True
+            )
+
+def render_population_synthesis_ui(generator, store):
+    """Sample a statistically realistic cohort, optionally narrating a few members with the LLM"""
+    catalog = st.session_state.get('analytics_catalog')
+    with st.expander("👥 Synthesize Population Cohort", expanded=False):
+        if not catalog or not catalog.datasets:
+            st.info("Process KnowBe4 or survey datasets in Step 1 to synthesize a cohort")
+            return
+        st.caption("Samples employees from trait distributions fitted to your datasets; "
+                   "no LLM calls except for the optional narratives.")
+        size_col, seed_col, narrate_col = st.columns(3)
+        with size_col:
+            cohort_size = st.number_input("Employees", 100, 100000, 5000, step=500)
+        with seed_col:
+            seed = st.number_input("Seed", 0, 2**31 - 1, 0)
+        with narrate_col:
+            narrate_count = st.number_input("Narrate as personas", 0, 20, 0,
+                                            help="Write full LLM personas for this many sampled employees")
+        
+        if st.button("Synthesize Cohort", use_container_width=True):
+            with st.spinner("Fitting trait distributions and sampling..."):
+                try:
+                    model = PopulationModel.fit_catalog(catalog)
+                except ValueError as e:
+                    st.error(str(e))
+                    return
+                st.session_state.synthetic_cohort = model.sample(int(cohort_size), seed=int(seed))
+            if narrate_count and (generator.llm or generator.check_api_connection()):
+                job_id = get_job_runner().submit(
+                    'persona_generation', f"{narrate_count} cohort narratives", narrate_cohort_job, generator, store,
+                    st.session_state.synthetic_cohort, int(narrate_count), seed=int(seed),
+                    vector_db=st.session_state.get('vector_knowledge_base'), catalog=catalog,
+                    session_id=current_session_id()
+                )
+                st.session_state.setdefault('persona_jobs', []).append(job_id)
+                st.rerun()
+        
+        cohort = st.session_state.get('synthetic_cohort')
+        if cohort is not None:
+            st.metric("Synthetic employees", f"{len(cohort):,}")
+            st.dataframe(summarize_cohort(cohort), use_container_width=True)
+            st.download_button(
+                "Download Cohort CSV",
+                cohort.to_csv(index=False),
+                f"cypersona_cohort_{datetime.now().strftime('%Y%m%d')}.csv",
+                "text/csv",
+                use_container_width=True
+            )
+
 def render_persona_generation_ui():
     """Enhanced persona generation UI with beautiful cards"""
     
@@ -391,10 +713,7 @@ def render_persona_generation_ui():
         return
     
     generator = PersonaGenerator()
-    
-    # Initialize session state
-    if 'generated_personas' not in st.session_state:
-        st.session_state.generated_personas = []
+    store = get_persona_store()
     
     # Main content in columns
     col1, col2 = st.columns([2, 1])
@@ -406,7 +725,8 @@ def render_persona_generation_ui():
             "Describe the persona you want to create:",
             placeholder="Example: Create a persona for a busy research scientist in their early 40s who is moderately tech-savvy but often rushes through emails due to workload pressure and has limited cybersecurity training.",
             height=120,
-            help="Be specific about role, industry, experience level, and behavioral characteristics"
+            help="Be specific about role, industry, experience level, and behavioral characteristics",
+            key='persona_description'
         )
         
         # Parameters row
@@ -427,79 +747,98 @@ def render_persona_generation_ui():
                 st.error("Please provide a persona description")
                 return
                 
-            with st.spinner("Creating AI persona using research knowledge..."):
-                # Get knowledge base context
-                vector_db = st.session_state.get('vector_knowledge_base')
-                knowledge_context = generator.query_knowledge_base(
-                    f"{persona_description} {industry} cybersecurity behavior", 
-                    vector_db
-                ) if vector_db else "Knowledge base not available - using general cybersecurity patterns"
-                
-                # Show context being used
-                with st.expander("Knowledge Base Context Used", expanded=False):
-                    st.text_area("Research context:", knowledge_context, height=100, disabled=True)
-                
-                # Generate personas
-                for i in range(persona_count):
-                    persona_response = generator.generate_persona_from_description(
-                        persona_description, knowledge_context
-                    )
-                    
-                    persona = {
-                        'id': str(uuid.uuid4())[:8],
-                        'name': f"Persona {len(st.session_state.generated_personas) + 1}",
-                        'description': persona_description,
-                        'generated_at': datetime.now().isoformat(),
-                        'llm_output': persona_response,
-                        'industry': industry,
-                        'complexity': complexity,
-                        'knowledge_context': knowledge_context[:500] + "..." if len(knowledge_context) > 500 else knowledge_context
-                    }
-                    
-                    st.session_state.generated_personas.append(persona)
-                
-                st.success(f"✅ Generated {persona_count} persona(s)!")
-                st.rerun()
+            if not generator.llm and not generator.check_api_connection():
+                return
+            
+            # Generation runs as a background job, so it survives reruns and other widget use
+            vector_db = st.session_state.get('vector_knowledge_base')
+            catalog = st.session_state.get('analytics_catalog')
+            runner = get_job_runner()
+            title = persona_description[:40] + ("..." if len(persona_description) > 40 else "")
+            if persona_count == 1:
+                # Stream a single persona so sections appear as they are written
+                job_id = runner.submit('persona_generation', f"Persona: {title}", stream_persona_job, generator, store,
+                                       persona_description, industry, complexity, vector_db, catalog,
+                                       session_id=current_session_id())
+            else:
+                # Generate all variants concurrently; near-duplicates of each other or of
+                # the library are regenerated with steering
+                specs = [{'description': persona_description, 'industry': industry, 'complexity': complexity}] * persona_count
+                job_id = runner.submit('persona_generation', f"{persona_count} personas: {title}", generate_personas_job,
+                                       generator, store, specs, vector_db, catalog, library_industry=industry,
+                                       session_id=current_session_id())
+            st.session_state.setdefault('persona_jobs', []).append(job_id)
+            st.rerun()
+        
+        render_job_panel('persona_jobs')
     
     with col2:
         st.subheader("Current Personas")
+        # The store is one persistent library shared by every session of this app
+        st.caption("Shared library: personas persist across sessions and restarts and are visible to every user "
+                   "of this app.")
         
-        if not st.session_state.generated_personas:
+        total_personas = store.count()
+        if not total_personas:
             st.info("No personas created yet")
         else:
-            # Quick stats
-            total_personas = len(st.session_state.generated_personas)
-            industries = [p['industry'] for p in st.session_state.generated_personas]
-            unique_industries = len(set(industries))
+            # Quick stats (indexed GROUP BY, no records decoded)
+            industry_counts = store.distinct('industry')
             
             metric_col1, metric_col2 = st.columns(2)
             with metric_col1:
                 st.metric("Total", total_personas)
             with metric_col2:
-                st.metric("Industries", unique_industries)
+                st.metric("Industries", len(industry_counts))
             
             # Industry distribution chart
             if total_personas > 1:
-                industry_counts = pd.Series(industries).value_counts()
-                fig = px.pie(values=industry_counts.values, names=industry_counts.index,
+                fig = px.pie(values=list(industry_counts.values()), names=list(industry_counts.keys()),
                            title="Distribution by Industry")
                 fig.update_layout(height=250, margin=dict(t=30, b=0, l=0, r=0))
                 st.plotly_chart(fig, use_container_width=True)
+            
+            # Average behavioral scores over the whole library (vectorized trait table)
+            averages = get_trait_table(store).aggregate()
+            if not averages.empty:
+                st.caption(" | ".join(
+                    f"{label}: {averages[f'{key}_mean'].iloc[0]:.1f}" for key, label in SCORE_FIELDS
+                    if pd.notna(averages[f'{key}_mean'].iloc[0])
+                ))
         
         # Quick actions
         st.subheader("⚡ Quick Actions")
         
-        if st.button("🔄 Clear All", use_container_width=True):
-            if st.checkbox("Confirm clearing all personas"):
-                st.session_state.generated_personas = []
-                st.success("All personas cleared!")
-                st.rerun()
+        library_file = st.file_uploader("Import persona library (JSONL)", type=['jsonl'],
+                                        help="Output of modules/persona_batch.py")
+        if library_file is not None and st.button("📥 Import", use_container_width=True):
+            imported = store.import_jsonl(library_file.getvalue().decode('utf-8').splitlines())
+            st.success(f"Imported {imported} persona(s)")
+            st.rerun()
         
-        if st.session_state.generated_personas:
+        if st.button("🔄 Clear All", use_container_width=True, disabled=not total_personas):
+            st.session_state.confirm_clear_personas = True
+        if st.session_state.get('confirm_clear_personas'):
+            st.warning(f"This permanently deletes all {total_personas} persona(s) in the shared library, "
+                       f"for every user of this app.")
+            typed = st.text_input("Type CLEAR to confirm:", key="confirm_clear_text")
+            confirm_col, cancel_col = st.columns(2)
+            with confirm_col:
+                if st.button("Delete all", type="primary", disabled=typed != "CLEAR", use_container_width=True):
+                    store.clear()
+                    st.session_state.confirm_clear_personas = False
+                    st.success("All personas cleared!")
+                    st.rerun()
+            with cancel_col:
+                if st.button("Cancel", key="cancel_clear_personas", use_container_width=True):
+                    st.session_state.confirm_clear_personas = False
+                    st.rerun()
+        
+        if total_personas:
             export_data = {
                 'export_date': datetime.now().isoformat(),
-                'total_personas': len(st.session_state.generated_personas),
-                'personas': st.session_state.generated_personas
+                'total_personas': total_personas,
+                'personas': list(store.iter_all())
             }
             export_json = json.dumps(export_data, indent=2)
             st.download_button(
@@ -510,13 +849,33 @@ def render_persona_generation_ui():
                 use_container_width=True
             )
     
+    render_archetype_ui(generator, store)
+    render_population_synthesis_ui(generator, store)
+    render_job_history('persona_generation', 'persona_jobs')
+    
     # Generated Personas Display - Enhanced Cards
-    if st.session_state.generated_personas:
+    if total_personas:
         st.markdown("---")
         st.subheader("Generated Personas")
         
-        persona_options = {p['id']: f"{p['name']} ({p['industry']}) - {p['generated_at'][:10]}" 
-                          for p in st.session_state.generated_personas}
+        # Indexed filters and pagination keep large libraries instant to browse
+        filter_col1, filter_col2, filter_col3 = st.columns(3)
+        with filter_col1:
+            industry_filter = st.selectbox("Industry", ["All"] + [i for i in store.distinct('industry') if i])
+        with filter_col2:
+            complexity_filter = st.selectbox("Detail", ["All"] + [c for c in store.distinct('complexity') if c])
+        filters = {
+            'industry': None if industry_filter == "All" else industry_filter,
+            'complexity': None if complexity_filter == "All" else complexity_filter
+        }
+        matching = store.count(**filters)
+        with filter_col3:
+            page_count = max(1, -(-matching // PAGE_SIZE))
+            page_number = st.number_input(f"Page (of {page_count})", 1, page_count, 1) - 1
+        
+        summaries = store.list_summaries(page_number * PAGE_SIZE, PAGE_SIZE, **filters)
+        persona_options = {p['id']: f"{p['name']} ({p['industry']}) - {p['created_at'][:10]}" 
+                          for p in summaries}
         
         selected_persona_id = st.selectbox(
             "Select persona to view/edit:", 
@@ -525,12 +884,20 @@ def render_persona_generation_ui():
         )
         
         if selected_persona_id:
-            persona = next(p for p in st.session_state.generated_personas if p['id'] == selected_persona_id)
+            persona = store.get(selected_persona_id)
             
             # Display the beautiful persona card
-            card_html = render_persona_card(persona)
+            card_html = get_card_cache().get_or_render(persona, render_persona_card)
             st.components.v1.html(card_html, height=1000, scrolling=True)
             
+            # Closest personas by behavioral scores
+            similar_ids, distances = get_trait_table(store).nearest(trait_vector(persona), k=3, exclude_id=persona['id'])
+            if similar_ids:
+                st.caption("Most similar scores: " + ", ".join(
+                    f"{similar['name']} (distance {distance:.1f})"
+                    for similar, distance in zip(store.get_many(similar_ids), distances)
+                ))
+            
             # Action buttons
             action_col1, action_col2, action_col3, action_col4 = st.columns(4)
             
@@ -538,15 +905,18 @@ def render_persona_generation_ui():
                 new_name = st.text_input("Edit Name:", persona['name'])
                 if new_name != persona['name']:
                     persona['name'] = new_name
+                    touch_persona(persona)
+                    store.save(persona)
                     st.rerun()
             
             with action_col2:
                 if st.button("📋 Clone", use_container_width=True):
-                    cloned = persona.copy()
+                    cloned = json.loads(json.dumps(persona))
                     cloned['id'] = str(uuid.uuid4())[:8]
                     cloned['name'] = f"{persona['name']} (Copy)"
                     cloned['generated_at'] = datetime.now().isoformat()
-                    st.session_state.generated_personas.append(cloned)
+                    cloned['version'] = 0
+                    store.save(cloned)
                     st.success("Persona cloned!")
                     st.rerun()
             
@@ -562,12 +932,22 @@ def render_persona_generation_ui():
             
             with action_col4:
                 if st.button("🗑️ Delete", use_container_width=True):
-                    if st.checkbox(f"Confirm delete {persona['name']}"):
-                        st.session_state.generated_personas = [
-                            p for p in st.session_state.generated_personas if p['id'] != selected_persona_id
-                        ]
+                    st.session_state.confirm_delete_persona = selected_persona_id
+            
+            if st.session_state.get('confirm_delete_persona') == selected_persona_id:
+                st.warning(f"Delete {persona['name']} from the shared library? This removes it for every user "
+                           f"of this app.")
+                confirm_col, cancel_col = st.columns(2)
+                with confirm_col:
+                    if st.button("Confirm delete", type="primary", use_container_width=True):
+                        store.delete(selected_persona_id)
+                        st.session_state.confirm_delete_persona = None
                         st.success("Persona deleted!")
                         st.rerun()
+                with cancel_col:
+                    if st.button("Cancel", key="cancel_delete_persona", use_container_width=True):
+                        st.session_state.confirm_delete_persona = None
+                        st.rerun()
             
             # Advanced editing section
             with st.expander("Advanced Editing", expanded=False):
@@ -583,6 +963,9 @@ def render_persona_generation_ui():
                 with col_save:
                     if st.button("💾 Save Changes"):
                         persona['llm_output'] = edited_profile
+                        persona['profile'] = profile_from_text(edited_profile)
+                        touch_persona(persona)
+                        store.save(persona)
                         st.success("Profile updated!")
                         st.rerun()
                 
@@ -598,9 +981,12 @@ def render_persona_generation_ui():
                 - Industry: {persona['industry']}
                 - Complexity: {persona.get('complexity', 'Standard')}
                 """)
+                if persona.get('diversity'):
+                    st.caption(f"Closest existing persona: {persona['diversity']['max_similarity']:.0%} similar "
+                               f"({persona['diversity']['attempts']} attempt(s))")
     
     # Next step navigation
-    if st.session_state.generated_personas:
+    if total_personas:
         st.markdown("---")
         if st.button("Go to Intervention Testing", type="primary", use_container_width=True):
             st.session_state.current_page = "Intervention Testing"
@@ -0,0 +1,307 @@
+"""
+Structured persona profiles
+
+Personas are generated as JSON against PERSONA_JSON_SCHEMA and validated once
+into a typed profile (numeric behavioral scores, lists of vulnerabilities and
+protective behaviors, recommendation fields). Free-text outputs from older
+personas or streaming generation are parsed once by the legacy section parser
+into the same shape. Cards, filters and intervention prompts read the profile.
+"""
+
+import json
+import re
+
+PERSONA_SCHEMA_VERSION = 1
+
+SCORE_FIELDS = [
+    ('phishing_susceptibility', "Phishing Susceptibility"),
+    ('security_awareness', "Security Awareness"),
+    ('reporting_likelihood', "Reporting Likelihood"),
+    ('stress_response', "Stress Response"),
+    ('training_receptiveness', "Training Receptiveness")
+]
+
+RECOMMENDATION_FIELDS = [
+    ('communication_style', "Communication style"),
+    ('training_format', "Training format"),
+    ('timing', "Timing and delivery"),
+    ('example', "Concrete example")
+]
+
+PERSONA_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "age": {"type": "integer", "minimum": 18, "maximum": 80},
+        "job_title": {"type": "string"},
+        "experience_years": {"type": "number"},
+        "personality_trait": {"type": "string"},
+        "summary": {"type": "string"},
+        "scores": {
+            "type": "object",
+            "properties": {
+                key: {
+                    "type": "object",
+                    "properties": {"score": {"type": "number", "minimum": 0, "maximum": 10},
+                                   "reason": {"type": "string"}},
+                    "required": ["score", "reason"]
+                } for key, _ in SCORE_FIELDS
+            },
+            "required": [key for key, _ in SCORE_FIELDS]
+        },
+        "vulnerabilities": {"type": "array", "items": {"type": "string"}},
+        "protective_behaviors": {"type": "array", "items": {"type": "string"}},
+        "recommendations": {
+            "type": "object",
+            "properties": {key: {"type": "string"} for key, _ in RECOMMENDATION_FIELDS},
+            "required": [key for key, _ in RECOMMENDATION_FIELDS]
+        }
+    },
+    "required": ["name", "age", "job_title", "scores", "vulnerabilities", "protective_behaviors", "recommendations"]
+}
+
+
+def _text(value):
+    return str(value).strip() if value is not None else ''
+
+
+def _number(value, low=None, high=None):
+    try:
+        number = float(str(value).split('/')[0].strip()) if not isinstance(value, (int, float)) else float(value)
+    except (TypeError, ValueError):
+        return None
+    if low is not None:
+        number = max(low, number)
+    if high is not None:
+        number = min(high, number)
+    return number
+
+
+def _string_list(value):
+    if isinstance(value, str):
+        value = [line for line in value.split('\n')]
+    return [_text(item).lstrip('•-* ').strip() for item in (value or []) if _text(item).lstrip('•-* ').strip()]
+
+
+def validate_persona_profile(data):
+    """Validate decoded JSON into a typed profile; raises ValueError when it is unusable"""
+    if not isinstance(data, dict):
+        raise ValueError("Persona JSON must be an object")
+    scores_in = data.get('scores') or {}
+    if not isinstance(scores_in, dict):
+        raise ValueError("'scores' must be an object")
+
+    scores = {}
+    for key, label in SCORE_FIELDS:
+        entry = scores_in.get(key, scores_in.get(label))
+        if isinstance(entry, dict):
+            score, reason = _number(entry.get('score'), 0, 10), _text(entry.get('reason'))
+        else:
+            score, reason = _number(entry, 0, 10), ''
+        scores[key] = {'score': score, 'reason': reason}
+    if all(entry['score'] is None for entry in scores.values()):
+        raise ValueError("Persona JSON has no behavioral scores")
+
+    recommendations_in = data.get('recommendations') or {}
+    if isinstance(recommendations_in, str):
+        recommendations_in = {'example': recommendations_in}
+    age = _number(data.get('age'), 18, 80)
+    return {
+        'version': PERSONA_SCHEMA_VERSION,
+        'source': 'json',
+        'name': _text(data.get('name')) or None,
+        'age': int(age) if age is not None else None,
+        'job_title': _text(data.get('job_title')),
+        'experience_years': _number(data.get('experience_years'), 0),
+        'personality_trait': _text(data.get('personality_trait')),
+        'summary': _text(data.get('summary')),
+        'scores': scores,
+        'vulnerabilities': _string_list(data.get('vulnerabilities')),
+        'protective_behaviors': _string_list(data.get('protective_behaviors')),
+        'recommendations': {key: _text(recommendations_in.get(key)) for key, _ in RECOMMENDATION_FIELDS}
+    }
+
+
+def _extract_json_object(text):
+    """Decode the first JSON object in text (tolerates code fences and preamble)"""
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end <= start:
+        raise ValueError("No JSON object in output")
+    return json.loads(text[start:end + 1])
+
+
+# ---------------------------------------------------------------------------
+# Legacy free-text format
+# ---------------------------------------------------------------------------
+
+def parse_persona_content(llm_output):
+    """Parse LLM output into structured components with better section detection"""
+    sections = {'basic_profile': '', 'behavioral_scores': '', 'vulnerabilities': '',
+               'protective_behaviors': '', 'recommendations': ''}
+
+    current_section = None
+    lines = llm_output.split('\n')
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        # Detect section headers with more specific patterns
+        line_upper = line.upper()
+        if ('BASIC PROFILE' in line_upper or line_upper.startswith('1.')) and 'BASIC' in line_upper:
+            current_section = 'basic_profile'
+            continue
+        elif ('BEHAVIORAL SCORE' in line_upper or line_upper.startswith('2.')) and ('BEHAVIORAL' in line_upper or 'SCORE' in line_upper):
+            current_section = 'behavioral_scores'
+            continue
+        elif ('VULNERABILITIES' in line_upper or line_upper.startswith('3.')) and 'VULNERABILITIES' in line_upper:
+            current_section = 'vulnerabilities'
+            continue
+        elif ('PROTECTIVE' in line_upper or 'BEHAVIORS' in line_upper or line_upper.startswith('4.')) and ('PROTECTIVE' in line_upper or 'BEHAVIORS' in line_upper):
+            current_section = 'protective_behaviors'
+            continue
+        elif ('RECOMMENDATION' in line_upper or 'INTERVENTION' in line_upper or line_upper.startswith('5.')) and ('RECOMMENDATION' in line_upper or 'INTERVENTION' in line_upper):
+            current_section = 'recommendations'
+            continue
+
+        # Add content to current section
+        if current_section:
+            sections[current_section] += line + '\n'
+
+    return sections
+
+
+def extract_persona_name(basic_profile):
+    """Pick a person's name out of the basic profile text"""
+    for line in basic_profile.split('\n'):
+        # Look for patterns like "Name: Dr. Sarah Johnson" or "Dr. Sarah Johnson"
+        if 'name' in line.lower() and ':' in line:
+            words = line.split(':')[-1].strip().split()
+        else:
+            words = line.split()
+
+        # Extract full name including titles
+        name_parts = []
+        for word in words:
+            clean_word = word.rstrip('.,').strip('*')
+            if clean_word and (clean_word.istitle() or clean_word.startswith(('Dr', 'Mr', 'Ms'))):
+                name_parts.append(clean_word)
+                if len(name_parts) >= 3:  # Title + First + Last is enough
+                    break
+            elif name_parts:
+                break
+
+        if len(name_parts) >= 2:  # At least first and last name
+            return ' '.join(name_parts)
+    return None
+
+
+def _field_after(label_pattern, text):
+    match = re.search(rf"(?:{label_pattern})\s*[:\-]\s*(.+)", text, re.IGNORECASE)
+    return match.group(1).strip().strip('*') if match else ''
+
+
+def profile_from_text(llm_output):
+    """Typed profile from the legacy numbered-section text format (parsed once)"""
+    parsed = parse_persona_content(llm_output)
+    basic = parsed['basic_profile'].strip()
+
+    scores = {key: {'score': None, 'reason': ''} for key, _ in SCORE_FIELDS}
+    for line in parsed['behavioral_scores'].split('\n'):
+        for key, label in SCORE_FIELDS:
+            if label.lower() in line.lower():
+                match = re.search(r"(\d+(?:\.\d+)?)\s*/\s*10\s*(?:\((.*?)\)?\s*$)?", line)
+                if match:
+                    scores[key] = {'score': _number(match.group(1), 0, 10), 'reason': _text(match.group(2))}
+
+    recommendations = {key: '' for key, _ in RECOMMENDATION_FIELDS}
+    keywords = {'communication_style': 'communication', 'training_format': 'format',
+                'timing': 'timing', 'example': 'example'}
+    leftovers = []
+    for line in _string_list(parsed['recommendations']):
+        key = next((k for k, word in keywords.items() if word in line.lower() and not recommendations[k]), None)
+        if key:
+            recommendations[key] = line.split(':', 1)[1].strip() if ':' in line else line
+        else:
+            leftovers.append(line)
+    if leftovers:
+        recommendations['example'] = " ".join(filter(None, [recommendations['example']] + leftovers))
+
+    age_match = re.search(r"\bage\s*[:\-]?\s*(\d{2})\b", basic, re.IGNORECASE) \
+        or re.search(r"\b(\d{2})[- ]years?[- ]old", basic, re.IGNORECASE)
+    age = _number(age_match.group(1), 18, 80) if age_match else None
+    experience = re.search(r"(\d+(?:\.\d+)?)\s*(?:\+\s*)?years?", basic, re.IGNORECASE)
+    return {
+        'version': PERSONA_SCHEMA_VERSION,
+        'source': 'text',
+        'name': extract_persona_name(basic) if basic else None,
+        'age': int(age) if age is not None else None,
+        'job_title': _field_after(r"(?:job\s*)?title|role|position", basic),
+        'experience_years': _number(experience.group(1), 0) if experience else None,
+        'personality_trait': _field_after(r"personality(?:\s*trait)?|trait", basic),
+        'summary': basic,
+        'scores': scores,
+        'vulnerabilities': _string_list(parsed['vulnerabilities']),
+        'protective_behaviors': _string_list(parsed['protective_behaviors']),
+        'recommendations': recommendations
+    }
+
+
+def profile_from_output(llm_output):
+    """Typed profile from a generation result: strict JSON first, legacy text otherwise"""
+    try:
+        return validate_persona_profile(_extract_json_object(llm_output))
+    except (ValueError, json.JSONDecodeError):
+        return profile_from_text(llm_output)
+
+
+def profile_to_text(profile):
+    """Readable numbered-section text of a profile (what the card editor and prompts show)"""
+    if profile.get('source') == 'text':
+        # Free-text personas keep their own basic-profile wording
+        lines = ["1. BASIC PROFILE:", profile.get('summary', '')]
+    else:
+        basics = [f"Name: {profile['name']}" if profile.get('name') else None,
+                  f"Age: {profile['age']}" if profile.get('age') else None,
+                  f"Job Title: {profile['job_title']}" if profile.get('job_title') else None,
+                  f"Experience: {profile['experience_years']:g} years" if profile.get('experience_years') is not None else None,
+                  f"Personality Trait: {profile['personality_trait']}" if profile.get('personality_trait') else None]
+        lines = ["1. BASIC PROFILE:"] + [line for line in basics if line]
+        if profile.get('summary'):
+            lines.append(profile['summary'])
+
+    lines.append("\n2. BEHAVIORAL SCORES:")
+    for key, label in SCORE_FIELDS:
+        entry = profile['scores'].get(key, {})
+        if entry.get('score') is not None:
+            reason = f" ({entry['reason']})" if entry.get('reason') else ""
+            lines.append(f"- {label}: {entry['score']:g}/10{reason}")
+
+    lines.append("\n3. KEY VULNERABILITIES:")
+    lines.extend(f"• {item}" for item in profile['vulnerabilities'])
+    lines.append("\n4. PROTECTIVE BEHAVIORS:")
+    lines.extend(f"• {item}" for item in profile['protective_behaviors'])
+    lines.append("\n5. INTERVENTION RECOMMENDATIONS:")
+    lines.extend(f"• {label}: {profile['recommendations'][key]}"
+                 for key, label in RECOMMENDATION_FIELDS if profile['recommendations'].get(key))
+    return "\n".join(lines)
+
+
+def persona_profile(persona):
+    """The persona's typed profile, parsing legacy text once and memoizing it on the record"""
+    profile = persona.get('profile')
+    if not profile or profile.get('version') != PERSONA_SCHEMA_VERSION:
+        profile = profile_from_output(persona.get('llm_output', ''))
+        persona['profile'] = profile
+    return profile
+
+
+def persona_score(persona, key):
+    """Numeric behavioral score (0-10) or None"""
+    return persona_profile(persona)['scores'].get(key, {}).get('score')
+
+
+def persona_prompt_text(persona):
+    """Persona description plus its normalized profile, for intervention prompts"""
+    return f"{persona['description']}\n{profile_to_text(persona_profile(persona))}"
@@ -0,0 +1,251 @@
+"""
+Persistent persona store
+
+Personas are kept in SQLite with a primary key on the persona ID, secondary
+indexes on industry, complexity and creation time, and the behavioral scores
+as real columns so filtering and paging happen in SQL. Full records are decoded
+through an in-process LRU read-through cache, so browsing and selecting stay
+instant for libraries of thousands of personas.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from persona_schema import SCORE_FIELDS, persona_profile
+
+PERSONA_STORE_PATH = Path(os.getenv("CYPERSONA_PERSONA_DB", ".cache/personas.sqlite"))
+PERSONA_CACHE_SIZE = 1024
+PAGE_SIZE = 50
+
+SCORE_COLUMNS = [f"score_{key}" for key, _ in SCORE_FIELDS]
+SUMMARY_COLUMNS = ['id', 'name', 'industry', 'complexity', 'created_at'] + SCORE_COLUMNS
+ORDERINGS = {
+    'newest': "created_at DESC, rowid DESC",
+    'oldest': "created_at ASC, rowid ASC",
+    'name': "name COLLATE NOCASE ASC"
+}
+
+
+class PersonaStore:
+    """SQLite-backed persona library with indexed filtering, paging and a read-through cache"""
+
+    def __init__(self, path=PERSONA_STORE_PATH, cache_size=PERSONA_CACHE_SIZE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        # Bumped on every write so derived views (e.g. the trait table) know when to rebuild
+        self.revision = 0
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        score_ddl = "".join(f", {column} REAL" for column in SCORE_COLUMNS)
+        self._conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS personas (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                industry TEXT,
+                complexity TEXT,
+                created_at TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                data TEXT NOT NULL{score_ddl}
+            )"""
+        )
+        # Profile embeddings for diversity checks, kept out of the JSON records
+        self._conn.execute("CREATE TABLE IF NOT EXISTS persona_embeddings (id TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        for column in ('industry', 'complexity', 'created_at'):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_personas_{column} ON personas({column})")
+        self._conn.commit()
+
+    # -- writes -------------------------------------------------------------
+
+    def _row(self, persona):
+        profile = persona_profile(persona)
+        scores = [profile['scores'][key]['score'] for key, _ in SCORE_FIELDS]
+        return [persona['id'], persona['name'], persona.get('industry'), persona.get('complexity'),
+                persona['generated_at'], persona.get('version', 0), json.dumps(persona)] + scores
+
+    def save_many(self, personas):
+        """Insert or replace personas (one transaction)"""
+        personas = list(personas)
+        rows = [self._row(persona) for persona in personas]
+        placeholders = ", ".join("?" * len(rows[0])) if rows else ""
+        columns = "id, name, industry, complexity, created_at, version, data, " + ", ".join(SCORE_COLUMNS)
+        with self._lock:
+            self._conn.executemany(f"INSERT OR REPLACE INTO personas ({columns}) VALUES ({placeholders})", rows)
+            self._conn.commit()
+            for persona in personas:
+                self._cache_put(persona['id'], persona)
+            self.revision += 1
+
+    def save(self, persona):
+        """Insert or replace one persona (call again after editing it)"""
+        self.save_many([persona])
+
+    def delete(self, persona_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM personas WHERE id = ?", (persona_id,))
+            self._conn.execute("DELETE FROM persona_embeddings WHERE id = ?", (persona_id,))
+            self._conn.commit()
+            self._cache.pop(persona_id, None)
+            self.revision += 1
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM personas")
+            self._conn.execute("DELETE FROM persona_embeddings")
+            self._conn.commit()
+            self._cache.clear()
+            self.revision += 1
+
+    def save_embeddings(self, vectors):
+        """Store profile embeddings ({persona ID: vector})"""
+        rows = [(persona_id, np.asarray(vector, dtype=np.float32).tobytes()) for persona_id, vector in vectors.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO persona_embeddings (id, vector) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    # -- reads --------------------------------------------------------------
+
+    def embeddings(self, persona_ids):
+        """{persona ID: float32 vector} for the IDs that have a stored embedding"""
+        persona_ids = list(persona_ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(persona_ids), 500):
+                chunk = persona_ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT id, vector FROM persona_embeddings WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update({row['id']: np.frombuffer(row['vector'], dtype=np.float32) for row in rows})
+        return found
+
+    def _cache_put(self, persona_id, persona):
+        self._cache[persona_id] = persona
+        self._cache.move_to_end(persona_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get(self, persona_id):
+        """Full persona record by ID (None if missing)"""
+        with self._lock:
+            if persona_id in self._cache:
+                self._cache.move_to_end(persona_id)
+                return self._cache[persona_id]
+            row = self._conn.execute("SELECT data FROM personas WHERE id = ?", (persona_id,)).fetchone()
+            if row is None:
+                return None
+            persona = json.loads(row['data'])
+            self._cache_put(persona_id, persona)
+            return persona
+
+    def get_many(self, persona_ids):
+        """Full records for several IDs, in the given order (missing IDs are skipped)"""
+        personas = [self.get(persona_id) for persona_id in persona_ids]
+        return [persona for persona in personas if persona is not None]
+
+    @staticmethod
+    def _where(industry=None, complexity=None, min_scores=None):
+        clauses, params = [], []
+        if industry:
+            clauses.append("industry = ?")
+            params.append(industry)
+        if complexity:
+            clauses.append("complexity = ?")
+            params.append(complexity)
+        for key, minimum in (min_scores or {}).items():
+            if minimum:
+                column = f"score_{key}"
+                if column not in SCORE_COLUMNS:
+                    raise ValueError(f"Unknown score '{key}'")
+                clauses.append(f"{column} >= ?")
+                params.append(minimum)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, industry=None, complexity=None, min_scores=None):
+        where, params = self._where(industry, complexity, min_scores)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM personas{where}", params).fetchone()[0]
+
+    def list_summaries(self, offset=0, limit=PAGE_SIZE, industry=None, complexity=None, min_scores=None,
+                       order='newest'):
+        """Lightweight rows (ID, name, industry, complexity, created_at, scores) for one page"""
+        where, params = self._where(industry, complexity, min_scores)
+        sql = f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM personas{where} ORDER BY {ORDERINGS[order]} LIMIT ? OFFSET ?"
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params + [int(limit), int(offset)])]
+
+    def column_frame(self, columns):
+        """Whole-library dataframe of summary columns (no JSON decoding)"""
+        unknown = set(columns) - set(SUMMARY_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown columns {sorted(unknown)}")
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(columns)} FROM personas ORDER BY created_at, rowid").fetchall()
+        return pd.DataFrame([tuple(row) for row in rows], columns=columns)
+
+    def page(self, page_number=0, page_size=PAGE_SIZE, **filters):
+        """Full persona records for one page"""
+        summaries = self.list_summaries(page_number * page_size, page_size, **filters)
+        return self.get_many([summary['id'] for summary in summaries])
+
+    def distinct(self, column):
+        """Distinct values and counts of an indexed column ('industry' or 'complexity')"""
+        if column not in ('industry', 'complexity'):
+            raise ValueError(f"'{column}' is not an indexed column")
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {column} AS value, COUNT(*) AS n FROM personas GROUP BY {column} ORDER BY n DESC"
+            ).fetchall()
+        return {row['value']: row['n'] for row in rows}
+
+    def iter_all(self, batch_size=500):
+        """Every persona, oldest first, decoded in batches (for exports)"""
+        offset = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT data FROM personas ORDER BY created_at, rowid LIMIT ? OFFSET ?", (batch_size, offset)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row['data'])
+            offset += batch_size
+
+    def import_jsonl(self, lines):
+        """Load a JSONL persona library (e.g. from persona_batch.py); returns the number imported"""
+        personas = []
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            try:
+                persona = json.loads(line) if line.strip() else None
+            except json.JSONDecodeError:
+                continue
+            if persona and persona.get('id') and persona.get('name') and persona.get('generated_at'):
+                personas.append(persona)
+        if personas:
+            self.save_many(personas)
+        return len(personas)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_persona_store():
+    """Process-wide persona store (one library shared by every session)"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PersonaStore()
+        return _store
@@ -0,0 +1,188 @@
+"""
+Column-wise numeric trait vectors for the persona library
+
+Every persona is one row of a NumPy structured array: a fixed-width float32
+vector of the behavioral scores (NaN where the persona has no score) plus
+integer codes for its categorical fields. Filters, nearest-persona search and
+aggregates are vectorized over the whole library, and the table is built from
+the store's indexed score columns without decoding any persona JSON.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from persona_schema import SCORE_FIELDS, persona_profile
+
+TRAIT_KEYS = [key for key, _ in SCORE_FIELDS]
+TRAIT_INDEX = {key: i for i, key in enumerate(TRAIT_KEYS)}
+CATEGORICAL_FIELDS = ['industry', 'complexity']
+
+TRAIT_DTYPE = np.dtype([
+    ('id', 'U36'),
+    ('created_at', 'datetime64[s]'),
+    ('traits', np.float32, (len(TRAIT_KEYS),)),
+    ('industry', np.int16),
+    ('complexity', np.int16)
+])
+
+
+def trait_vector(persona):
+    """float32 score vector of one persona record (NaN for missing scores)"""
+    scores = persona_profile(persona)['scores']
+    return np.array([np.nan if scores[key]['score'] is None else scores[key]['score'] for key in TRAIT_KEYS],
+                    dtype=np.float32)
+
+
+def _encode(values):
+    """Integer codes and vocabulary (-1 for missing)"""
+    codes, vocabulary = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    return codes.astype(np.int16), [str(v) for v in vocabulary]
+
+
+class TraitTable:
+    """Structured array of persona trait vectors with vectorized queries"""
+
+    def __init__(self, rows, vocabularies):
+        self.rows = rows
+        self.vocabularies = vocabularies
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_columns(cls, ids, traits, created_at=None, **categoricals):
+        """Build from parallel columns (traits is an (n, len(TRAIT_KEYS)) array)"""
+        rows = np.zeros(len(ids), dtype=TRAIT_DTYPE)
+        rows['id'] = ids
+        if created_at is not None:
+            rows['created_at'] = pd.to_datetime(pd.Series(created_at), errors='coerce', format='ISO8601').to_numpy(
+                dtype='datetime64[s]')
+        rows['traits'] = np.asarray(traits, dtype=np.float32).reshape(len(ids), len(TRAIT_KEYS))
+        vocabularies = {}
+        for field in CATEGORICAL_FIELDS:
+            values = categoricals.get(field)
+            rows[field], vocabularies[field] = _encode(values if values is not None else [None] * len(ids))
+        return cls(rows, vocabularies)
+
+    @classmethod
+    def from_store(cls, store):
+        """Whole library from the store's score columns (no JSON decoding)"""
+        columns = ['id', 'created_at'] + CATEGORICAL_FIELDS + [f"score_{key}" for key in TRAIT_KEYS]
+        frame = store.column_frame(columns)
+        traits = frame[[f"score_{key}" for key in TRAIT_KEYS]].to_numpy(dtype=np.float32, na_value=np.nan)
+        return cls.from_columns(frame['id'].to_numpy(), traits, frame['created_at'],
+                                **{field: frame[field].to_numpy() for field in CATEGORICAL_FIELDS})
+
+    @classmethod
+    def from_cohort(cls, cohort):
+        """Synthetic cohort from population_synthesis (score_* columns)"""
+        traits = cohort[[f"score_{key}" for key in TRAIT_KEYS]].to_numpy(dtype=np.float32)
+        return cls.from_columns(cohort['employee_id'].to_numpy(), traits,
+                                industry=cohort['department'].astype(str).to_numpy())
+
+    # -- queries ------------------------------------------------------------
+
+    @property
+    def traits(self):
+        return self.rows['traits']
+
+    @property
+    def ids(self):
+        return self.rows['id']
+
+    def code(self, field, value):
+        vocabulary = self.vocabularies[field]
+        return vocabulary.index(value) if value in vocabulary else -2
+
+    def mask(self, min_scores=None, max_scores=None, **categoricals):
+        """Boolean row mask; a persona without a score fails any bound on it"""
+        mask = np.ones(len(self.rows), dtype=bool)
+        for key, minimum in (min_scores or {}).items():
+            mask &= self.traits[:, TRAIT_INDEX[key]] >= minimum
+        for key, maximum in (max_scores or {}).items():
+            mask &= self.traits[:, TRAIT_INDEX[key]] <= maximum
+        for field, value in categoricals.items():
+            if value is not None:
+                mask &= self.rows[field] == self.code(field, value)
+        return mask
+
+    def filter_ids(self, **filters):
+        return self.ids[self.mask(**filters)].tolist()
+
+    def _filled(self):
+        """Traits with missing scores replaced by the library mean of that score"""
+        traits = self.traits
+        means = np.nanmean(traits, axis=0) if len(traits) else np.zeros(len(TRAIT_KEYS))
+        return np.where(np.isnan(traits), np.nan_to_num(means, nan=5.0), traits)
+
+    def nearest(self, vector, k=5, mask=None, exclude_id=None):
+        """(ids, distances) of the k personas closest in trait space"""
+        vector = np.asarray(vector, dtype=np.float32)
+        filled = self._filled()
+        target = np.where(np.isnan(vector), filled.mean(axis=0) if len(filled) else 5.0, vector)
+        distances = np.sqrt(((filled - target) ** 2).sum(axis=1))
+        candidates = np.ones(len(self.rows), dtype=bool) if mask is None else mask.copy()
+        if exclude_id is not None:
+            candidates &= self.ids != exclude_id
+        distances = np.where(candidates, distances, np.inf)
+        k = min(k, int(candidates.sum()))
+        if k <= 0:
+            return [], np.array([], dtype=np.float32)
+        order = np.argpartition(distances, k - 1)[:k]
+        order = order[np.argsort(distances[order])]
+        return self.ids[order].tolist(), distances[order]
+
+    def aggregate(self, by=None, mask=None):
+        """Mean, std and count of every score, overall or per categorical field"""
+        rows = self.rows if mask is None else self.rows[mask]
+        traits = rows['traits']
+        if by is None:
+            groups, labels = np.zeros(len(rows), dtype=np.int64), ['All']
+        else:
+            groups = rows[by].astype(np.int64) + 1  # -1 (missing) becomes group 0
+            labels = ['Unknown'] + self.vocabularies[by]
+        present = ~np.isnan(traits)
+        values = np.nan_to_num(traits)
+        bins = len(labels)
+        counts = np.stack([np.bincount(groups, weights=present[:, j], minlength=bins) for j in range(len(TRAIT_KEYS))], 1)
+        sums = np.stack([np.bincount(groups, weights=values[:, j], minlength=bins) for j in range(len(TRAIT_KEYS))], 1)
+        squares = np.stack([np.bincount(groups, weights=values[:, j] ** 2, minlength=bins)
+                            for j in range(len(TRAIT_KEYS))], 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+            stds = np.sqrt(np.maximum(squares / counts - means ** 2, 0))
+        personas = np.bincount(groups, minlength=bins)
+        frame = pd.DataFrame({'personas': personas}, index=pd.Index(labels, name=by or 'library'))
+        for j, key in enumerate(TRAIT_KEYS):
+            frame[f"{key}_mean"] = means[:, j]
+            frame[f"{key}_std"] = stds[:, j]
+        return frame[frame['personas'] > 0].round(2)
+
+    def to_frame(self):
+        frame = pd.DataFrame(self.traits, columns=TRAIT_KEYS)
+        frame.insert(0, 'id', self.ids)
+        for field in CATEGORICAL_FIELDS:
+            frame[field] = pd.Categorical.from_codes(self.rows[field], self.vocabularies[field]) \
+                if self.vocabularies[field] else None
+        return frame
+
+    def to_arrow(self):
+        """pyarrow Table of the same columns (requires pyarrow)"""
+        import pyarrow as pa
+        return pa.Table.from_pandas(self.to_frame(), preserve_index=False)
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_trait_table(store):
+    """Trait table of a store, rebuilt only after the library changes"""
+    with _tables_lock:
+        cached = _tables.get(id(store))
+        revision = store.revision
+        if cached is None or cached[0] != revision:
+            cached = _tables[id(store)] = (revision, TraitTable.from_store(store))
+        return cached[1]
@@ -0,0 +1,352 @@
+"""
+Statistical population synthesis for large persona cohorts
+
+Fits joint trait distributions once and then samples thousands of employees
+with NumPy, so a realistic organization costs seconds instead of one LLM call
+per person:
+
+- Department x Title mix: the empirical joint of KnowBe4 users
+- Click / report / data-entry propensities: per-group Beta distributions,
+  shrunk toward the organization-wide rate for small groups (empirical Bayes)
+- KnowBe4 numeric attributes and survey scales (PMT, SDT, TPB, stress, ...):
+  Gaussian copulas over the empirical marginals, so correlations between traits
+  are kept and integer scales stay on their observed values
+
+The surveys were answered by different people than the KnowBe4 users, so each
+survey block is sampled independently given the department (where the survey
+has one). The LLM is only used, optionally, to narrate a small sample.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from dataset_schemas import match_schema
+
+MIN_STRATUM_SIZE = 20
+# Shrinks copula correlations toward independence so small surveys stay positive definite
+COPULA_SHRINKAGE = 0.05
+
+OUTCOME_RATES = {'click_rate': 'Clicked', 'report_rate': 'Reported', 'data_entry_rate': 'Data Entered'}
+KNOWBE4_TRAITS = ['Current Risk Score', 'Phish-prone Percentage', 'Baseline Test Score', 'Last Training Score']
+KNOWBE4_FLAGS = ['Previous Training Completed', 'Two Factor Enabled', 'Password Manager', 'Mobile Device']
+# Survey columns that line up with the KnowBe4 Department of a synthetic employee
+SURVEY_DEPARTMENT_COLUMNS = {'survey_motivation_attitude': 'department'}
+
+# Persona scores (0-10) derived from sampled traits: (column, +1 higher is more / -1 inverted)
+SCORE_RECIPES = {
+    'phishing_susceptibility': [('click_rate', 1), ('pmt_threat_vulnerability', 1)],
+    'security_awareness': [('Baseline Test Score', 1), ('pmt_self_efficacy', 1), ('click_rate', -1)],
+    'reporting_likelihood': [('report_rate', 1), ('confidence_reporting', 1), ('tpb_behavioral_intention', 1)],
+    'stress_response': [('pre_decision_making_stress', 1), ('pre_time_pressure_perception', 1),
+                        ('pre_email_opening_anxiety', 1), ('emotional_self_control', -1)],
+    'training_receptiveness': [('intrinsic_motivation_score', 1), ('goal_commitment_level', 1),
+                               ('amotivation_score', -1)]
+}
+
+# Standard normal CDF tabulated once and linearly interpolated (absolute error < 1e-6)
+_CDF_GRID = np.linspace(-8.5, 8.5, 8193)
+_CDF_VALUES = np.array([0.5 * math.erfc(-z / math.sqrt(2.0)) for z in _CDF_GRID])
+
+# Acklam's rational approximation of the inverse normal CDF (relative error < 1.2e-9)
+_PPF_A = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+          1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+_PPF_B = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+          6.680131188771972e+01, -1.328068155288572e+01, 1.0]
+_PPF_C = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+          -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+_PPF_D = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00, 1.0]
+_PPF_TAIL = 0.02425
+
+
+def _norm_cdf(z):
+    """Standard normal CDF of a float array"""
+    return np.interp(z, _CDF_GRID, _CDF_VALUES)
+
+
+def _norm_ppf(p):
+    """Inverse standard normal CDF of a float array of probabilities in (0, 1)"""
+    p = np.asarray(p, dtype=np.float64)
+    out = np.empty_like(p)
+    central = np.abs(p - 0.5) <= 0.5 - _PPF_TAIL
+    q = p[central] - 0.5
+    r = q * q
+    out[central] = q * np.polyval(_PPF_A, r) / np.polyval(_PPF_B, r)
+    # Tails, using the symmetry ppf(1 - p) = -ppf(p)
+    tail = ~central
+    lower = np.minimum(p[tail], 1.0 - p[tail])
+    q = np.sqrt(-2.0 * np.log(lower))
+    out[tail] = np.where(p[tail] < 0.5, 1.0, -1.0) * np.polyval(_PPF_C, q) / np.polyval(_PPF_D, q)
+    return out
+
+
+def _is_post_measure(column):
+    """Post-intervention measurements describe an outcome, not the employee at baseline"""
+    return column.startswith('post_') or column.endswith('_post')
+
+
+class GaussianCopula:
+    """Gaussian copula over empirical marginals of numeric columns"""
+
+    def __init__(self, frame):
+        self.columns = list(frame.columns)
+        values = frame.to_numpy(dtype=np.float64)
+        self.marginals = [np.sort(col[~np.isnan(col)]) for col in values.T]
+        self.integer = [bool(len(m)) and bool(np.all(m == np.round(m))) for m in self.marginals]
+
+        # Normal scores of the ranks; missing values sit at the median (z = 0)
+        scores = np.zeros_like(values)
+        for j, col in enumerate(values.T):
+            present = ~np.isnan(col)
+            if present.sum() > 1:
+                ranks = pd.Series(col[present]).rank(method='average').to_numpy()
+                scores[present, j] = _norm_ppf(ranks / (present.sum() + 1))
+        if len(scores) > 1:
+            corr = np.nan_to_num(np.corrcoef(scores, rowvar=False), nan=0.0)
+        else:
+            corr = np.eye(len(self.columns))
+        corr = np.atleast_2d(corr)
+        np.fill_diagonal(corr, 1.0)
+        corr = (1 - COPULA_SHRINKAGE) * corr + COPULA_SHRINKAGE * np.eye(len(self.columns))
+        eigenvalues, eigenvectors = np.linalg.eigh(corr)
+        self.factor = eigenvectors * np.sqrt(np.clip(eigenvalues, 1e-6, None))
+
+    def sample_normal(self, n, rng):
+        """Correlated standard normal scores, one column per trait"""
+        return rng.standard_normal((n, len(self.columns))) @ self.factor.T
+
+    def to_values(self, normal_scores):
+        uniforms = _norm_cdf(normal_scores)
+        out = np.full(normal_scores.shape, np.nan, dtype=np.float64)
+        for j, marginal in enumerate(self.marginals):
+            if len(marginal):
+                # inverted_cdf returns observed values, so Likert items stay on their scale
+                method = 'inverted_cdf' if self.integer[j] else 'linear'
+                out[:, j] = np.quantile(marginal, np.clip(uniforms[:, j], 0, 1), method=method)
+        return out
+
+    def sample(self, n, rng):
+        return pd.DataFrame(self.to_values(self.sample_normal(n, rng)), columns=self.columns)
+
+
+def _beta_moments(rates, weights):
+    """Method-of-moments Beta(a, b) of per-user rates"""
+    mean = np.average(rates, weights=weights)
+    variance = np.average((rates - mean) ** 2, weights=weights)
+    mean = min(max(mean, 1e-3), 1 - 1e-3)
+    if variance <= 0 or variance >= mean * (1 - mean):
+        concentration = 50.0
+    else:
+        concentration = mean * (1 - mean) / variance - 1
+    return mean * concentration, (1 - mean) * concentration
+
+
+class PopulationModel:
+    """Joint trait model fitted from the KnowBe4 export and the behavioral surveys"""
+
+    def __init__(self):
+        self.groups = None          # DataFrame: Department, Title, weight, <rate>_a, <rate>_b
+        self.knowbe4_copula = None
+        self.surveys = {}           # name -> {'pooled': copula, 'by_department': {dept: copula}}
+        self.score_ranges = {}
+
+    @classmethod
+    def fit(cls, frames):
+        """Fit from {name: DataFrame}; layouts are recognized by the schema registry"""
+        model = cls()
+        for name, df in frames.items():
+            schema = match_schema(df.columns)
+            if schema is None:
+                continue
+            if schema['name'] == 'knowbe4':
+                model._fit_knowbe4(df)
+            else:
+                model._fit_survey(schema, df)
+        if model.groups is None and not model.surveys:
+            raise ValueError("No KnowBe4 or survey dataset to fit a population from")
+        return model
+
+    @classmethod
+    def fit_catalog(cls, catalog):
+        """Fit from the datasets registered in the analytics catalog (Step 1)"""
+        return cls.fit({table: pd.read_parquet(info['path']) for table, info in catalog.datasets.items()})
+
+    def _fit_knowbe4(self, df):
+        numeric_columns = {rate: column for rate, column in OUTCOME_RATES.items() if column in df.columns}
+        numeric_columns.update({column: column for column in KNOWBE4_TRAITS + KNOWBE4_FLAGS if column in df.columns})
+        numeric = pd.DataFrame({name: df[column].astype('float64') for name, column in numeric_columns.items()})
+        numeric['User ID'] = df['User ID'].astype(str).to_numpy()
+        per_user = numeric.groupby('User ID').mean()
+        per_user['sends'] = numeric.groupby('User ID').size()
+        # Most frequent department / title of each user
+        for column in ('Department', 'Title'):
+            pairs = pd.DataFrame({'User ID': numeric['User ID'], column: df[column].astype(str).fillna('Unknown').to_numpy()})
+            counts = pairs.value_counts().reset_index(name='n').drop_duplicates('User ID')
+            per_user[column] = counts.set_index('User ID')[column].reindex(per_user.index).fillna('Unknown')
+
+        # Group mix and Beta propensities, shrunk toward the organization-wide prior
+        groups = per_user.groupby(['Department', 'Title']).agg(users=('sends', 'size')).reset_index()
+        groups['weight'] = groups['users'] / groups['users'].sum()
+        for rate in OUTCOME_RATES:
+            if rate not in per_user:
+                continue
+            valid = per_user[rate].notna()
+            prior_a, prior_b = _beta_moments(per_user.loc[valid, rate].to_numpy(), per_user.loc[valid, 'sends'].to_numpy())
+            events = (per_user[rate] * per_user['sends']).groupby([per_user['Department'], per_user['Title']]).sum()
+            trials = per_user.loc[valid, 'sends'].groupby([per_user['Department'], per_user['Title']]).sum()
+            keys = pd.MultiIndex.from_frame(groups[['Department', 'Title']])
+            events = events.reindex(keys, fill_value=0).to_numpy()
+            trials = trials.reindex(keys, fill_value=0).to_numpy()
+            concentration = prior_a + prior_b
+            # Group mean is the shrunk posterior mean; spread within a group keeps the global concentration
+            group_mean = (prior_a + events) / (concentration + trials)
+            groups[f'{rate}_a'] = group_mean * concentration
+            groups[f'{rate}_b'] = (1 - group_mean) * concentration
+        self.groups = groups
+
+        copula_columns = [c for c in list(OUTCOME_RATES) + KNOWBE4_TRAITS + KNOWBE4_FLAGS if c in per_user]
+        self.knowbe4_copula = GaussianCopula(per_user[copula_columns])
+        self._record_ranges(per_user[copula_columns])
+
+    def _fit_survey(self, schema, df):
+        columns = [
+            column for column, dtype in schema['columns'].items()
+            if column in df.columns and dtype in ('Int8', 'Int16', 'float32') and not _is_post_measure(column)
+        ]
+        if not columns:
+            return
+        numeric = df[columns].astype('float64')
+        survey = {'pooled': GaussianCopula(numeric), 'by_department': {}}
+        link = SURVEY_DEPARTMENT_COLUMNS.get(schema['name'])
+        if link in df.columns:
+            for department, rows in numeric.groupby(df[link].astype(str).str.strip().str.lower()):
+                if len(rows) >= MIN_STRATUM_SIZE:
+                    survey['by_department'][department] = GaussianCopula(rows)
+        self.surveys[schema['name']] = survey
+        self._record_ranges(numeric)
+
+    def _record_ranges(self, frame):
+        for column in frame.columns:
+            values = frame[column].dropna()
+            if len(values):
+                self.score_ranges[column] = (float(values.min()), float(values.max()))
+
+    # -- sampling -----------------------------------------------------------
+
+    def sample(self, n, seed=None):
+        """DataFrame of n synthetic employees (traits as float32, persona scores 0-10)"""
+        rng = np.random.default_rng(seed)
+        cohort = pd.DataFrame({'employee_id': [f"SYN-{i + 1:05d}" for i in range(n)]})
+
+        if self.groups is not None:
+            group_index = rng.choice(len(self.groups), size=n, p=self.groups['weight'].to_numpy())
+            cohort['department'] = self.groups['Department'].to_numpy()[group_index]
+            cohort['title'] = self.groups['Title'].to_numpy()[group_index]
+            scores = self.knowbe4_copula.sample_normal(n, rng)
+            traits = pd.DataFrame(self.knowbe4_copula.to_values(scores), columns=self.knowbe4_copula.columns)
+            for j, column in enumerate(self.knowbe4_copula.columns):
+                if column in OUTCOME_RATES:
+                    traits[column] = self._group_propensities(column, group_index, scores[:, j], rng)
+            cohort = pd.concat([cohort, traits], axis=1)
+        else:
+            cohort['department'] = 'Unknown'
+            cohort['title'] = 'Unknown'
+
+        departments = cohort['department'].str.strip().str.lower().to_numpy()
+        for survey in self.surveys.values():
+            block = pd.DataFrame(np.nan, index=cohort.index, columns=survey['pooled'].columns)
+            pooled_rows = np.ones(n, dtype=bool)
+            for department, copula in survey['by_department'].items():
+                rows = departments == department
+                if rows.any():
+                    block.loc[rows, copula.columns] = copula.sample(int(rows.sum()), rng).to_numpy()
+                    pooled_rows &= ~rows
+            if pooled_rows.any():
+                block.loc[pooled_rows, :] = survey['pooled'].sample(int(pooled_rows.sum()), rng).to_numpy()
+            cohort = pd.concat([cohort, block.drop(columns=[c for c in block.columns if c in cohort])], axis=1)
+
+        for key, recipe in SCORE_RECIPES.items():
+            cohort[f'score_{key}'] = self._score(cohort, recipe)
+
+        numeric = cohort.select_dtypes('number').columns
+        cohort[numeric] = cohort[numeric].astype('float32')
+        cohort['department'] = cohort['department'].astype('category')
+        cohort['title'] = cohort['title'].astype('category')
+        return cohort
+
+    def _group_propensities(self, rate, group_index, normal_scores, rng):
+        """Beta draws per group, re-ordered to follow the copula ranks (Iman-Conover)"""
+        a = self.groups[f'{rate}_a'].to_numpy()
+        b = self.groups[f'{rate}_b'].to_numpy()
+        out = np.empty(len(group_index), dtype=np.float64)
+        for group in np.unique(group_index):
+            rows = np.flatnonzero(group_index == group)
+            draws = np.sort(rng.beta(a[group], b[group], size=len(rows)))
+            out[rows[np.argsort(normal_scores[rows])]] = draws
+        return out
+
+    def _score(self, cohort, recipe):
+        parts = []
+        for column, direction in recipe:
+            if column not in cohort or column not in self.score_ranges:
+                continue
+            low, high = self.score_ranges[column]
+            if column in OUTCOME_RATES:
+                low, high = 0.0, 1.0
+            scaled = (cohort[column].astype('float64') - low) / ((high - low) or 1.0)
+            parts.append(scaled if direction > 0 else 1 - scaled)
+        if not parts:
+            return np.full(len(cohort), np.nan)
+        return (10 * pd.concat(parts, axis=1).mean(axis=1, skipna=True)).clip(0, 10).round(1)
+
+
+def summarize_cohort(cohort):
+    """Headline rates and score means per department, for display next to the cohort"""
+    score_columns = [c for c in cohort.columns if c.startswith('score_')]
+    rate_columns = [c for c in OUTCOME_RATES if c in cohort]
+    summary = cohort.groupby('department', observed=True)[rate_columns + score_columns].mean()
+    summary.insert(0, 'employees', cohort.groupby('department', observed=True).size())
+    return summary.round(3)
+
+
+def describe_employee(row):
+    """Persona request text for one synthetic employee (used when narrating a sample)"""
+    facts = []
+    for rate, label in (('click_rate', 'clicks'), ('report_rate', 'reports'), ('data_entry_rate', 'enters data on')):
+        if pd.notna(row.get(rate)):
+            facts.append(f"{label} {row[rate]:.0%} of simulated phishing emails")
+    scores = [f"{key.replace('_', ' ')} {row[f'score_{key}']:.1f}/10"
+              for key in SCORE_RECIPES if pd.notna(row.get(f'score_{key}'))]
+    article = 'an' if str(row['title'])[:1].lower() in 'aeiou' else 'a'
+    text = f"Create a persona for {article} {row['title']} in {row['department']}"
+    if facts:
+        text += " who " + ", ".join(facts)
+    if scores:
+        text += f". Target behavioral scores: {', '.join(scores)}"
+    return text + "."
+
+
+def narrate_sample(cohort, generator, sample_size=5, industry='Any', complexity='Detailed', seed=None,
+                   vector_db=None, catalog=None):
+    """Full LLM personas for a few sampled cohort members (everyone else stays numeric).
+
+    Yields each persona record as it completes, grounded in the knowledge base when
+    vector_db is given; failed generations are skipped. Closing the generator cancels
+    the completions still in flight.
+    """
+    from persona_generation import build_persona_record
+
+    sample = cohort.sample(n=min(sample_size, len(cohort)), random_state=seed)
+    specs = [(describe_employee(row), industry) for _, row in sample.iterrows()]
+    results = generator.generate_personas_bulk(specs, vector_db=vector_db, catalog=catalog)
+    try:
+        for index, llm_output, context, diversity in results:
+            if llm_output and not llm_output.startswith(("Error:", "API connection failed")):
+                employee = sample.iloc[index]
+                record = build_persona_record(specs[index][0], industry, complexity, llm_output, context,
+                                              f"{employee['title']} ({employee['employee_id']})", diversity)
+                record['cohort_employee_id'] = employee['employee_id']
+                yield record
+    finally:
+        results.close()
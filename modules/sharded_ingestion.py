@@ -0,0 +1,451 @@
+"""
+Sharded multiprocess ingestion and profiling for large datasets
+
+Large CSV/Parquet inputs are split into row ranges, each shard is profiled in a
+process pool, and the partial aggregates (value counts, moments, digest aggregates)
+are merged exactly. Single-process mode profiles one in-memory shard through the
+same code path, so both modes produce the same knowledge-base documents.
+"""
+
+import argparse
+import glob
+import io
+import math
+import multiprocessing
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from data_digest import combine_moments, digest_partial, merge_digest_partials, moment_floats, moments, render_digest
+from dataset_schemas import apply_schema, read_csv_typed
+
+TOP_K = 5
+
+# Files below this size are profiled in-process; pool start-up is not worth it
+SHARDED_INGESTION_MIN_BYTES = int(os.getenv("CYPERSONA_SHARDED_MIN_BYTES", str(64 * 1024 * 1024)))
+DEFAULT_SHARD_BYTES = 32 * 1024 * 1024
+DEFAULT_SHARD_ROWS = 500_000
+_READ_BLOCK_BYTES = 16 * 1024 * 1024
+
+
+def column_kind(series):
+    """Classify a column as 'categorical', 'numerical', 'temporal' or None (not profiled)"""
+    dtype = series.dtype
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'temporal'
+    if (pd.api.types.is_bool_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype)
+            or pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)):
+        return 'categorical'
+    if pd.api.types.is_numeric_dtype(dtype):
+        return 'numerical'
+    return None
+
+
+def _python_scalar(value):
+    """Convert numpy scalars so document text reads 'True' rather than 'np.True_'"""
+    return value.item() if hasattr(value, 'item') else value
+
+
+# ---------------------------------------------------------------------------
+# Partial aggregates
+# ---------------------------------------------------------------------------
+
+def profile_frame(df):
+    """Compute mergeable partial aggregates for one shard of a dataset"""
+    df = df.reset_index(drop=True)
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        kind = column_kind(series)
+        if kind == 'categorical':
+            values = series.dropna()
+            first_seen = values.drop_duplicates()
+            columns[col] = {
+                'kind': kind,
+                'non_null': int(len(values)),
+                'counts': {value: count for value, count in values.value_counts(sort=False).items() if count},
+                'first_seen': dict(zip(first_seen.values, first_seen.index))
+            }
+        elif kind == 'numerical':
+            values = series.dropna().astype('float64')
+            count, mean, m2 = moments(values)
+            columns[col] = {
+                'kind': kind,
+                'non_null': count,
+                'mean': mean,
+                'm2': m2,
+                'min': float(values.min()) if count else math.nan,
+                'max': float(values.max()) if count else math.nan
+            }
+        elif kind == 'temporal':
+            values = series.dropna()
+            columns[col] = {
+                'kind': kind,
+                'non_null': int(len(values)),
+                'min': values.min() if len(values) else None,
+                'max': values.max() if len(values) else None
+            }
+        else:
+            columns[col] = {'kind': kind, 'non_null': int(series.notna().sum())}
+    return {
+        'rows': int(len(df)),
+        'column_order': list(df.columns),
+        'columns': columns,
+        'digest': digest_partial(df)
+    }
+
+
+def _merge_categorical(parts):
+    counts = Counter()
+    first_seen = {}
+    for shard_idx, part in parts:
+        counts.update(part['counts'])
+        for value, row in part['first_seen'].items():
+            key = (shard_idx, row)
+            if value not in first_seen or key < first_seen[value]:
+                first_seen[value] = key
+    # Same order as pandas value_counts: count descending, ties by first occurrence
+    ranked = sorted(counts, key=lambda value: (-counts[value], first_seen[value]))
+    return {
+        'kind': 'categorical',
+        'non_null': sum(counts.values()),
+        'distinct': len(counts),
+        'top_values': [(_python_scalar(value), int(counts[value])) for value in ranked[:TOP_K]]
+    }
+
+
+def _merge_numerical(parts):
+    # Whole-number columns carry exact moments, so any sharding gives the single-pass result
+    moment = (0, 0.0, 0.0)
+    minimum, maximum = math.nan, math.nan
+    for _, part in parts:
+        if not part['non_null']:
+            continue
+        moment = combine_moments(moment, (part['non_null'], part['mean'], part['m2']))
+        minimum = part['min'] if math.isnan(minimum) else min(minimum, part['min'])
+        maximum = part['max'] if math.isnan(maximum) else max(maximum, part['max'])
+    count, mean, m2 = moment_floats(moment)
+    return {
+        'kind': 'numerical',
+        'non_null': count,
+        'mean': mean if count else math.nan,
+        'std': math.sqrt(m2 / (count - 1)) if count > 1 else math.nan,
+        'min': minimum,
+        'max': maximum
+    }
+
+
+def resolve_column_kinds(partials):
+    """Return {column: kind} and the columns whose kind differs between shards"""
+    kinds, conflicts = {}, set()
+    for col in partials[0]['column_order'] if partials else []:
+        # An all-null shard parses as float64, so only populated shards decide the kind
+        populated = {p['columns'][col]['kind'] for p in partials if p['columns'][col]['non_null']}
+        if len(populated) > 1:
+            conflicts.add(col)
+            kinds[col] = 'categorical'
+        elif populated:
+            kinds[col] = populated.pop()
+        else:
+            kinds[col] = partials[0]['columns'][col]['kind']
+    return kinds, conflicts
+
+
+def merge_profiles(partials):
+    """Merge shard partials (in shard order) into a dataset profile"""
+    kinds, _ = resolve_column_kinds(partials)
+    column_order = list(partials[0]['column_order']) if partials else []
+    columns = {}
+    for col in column_order:
+        parts = [(i, p['columns'][col]) for i, p in enumerate(partials) if p['columns'][col]['kind'] == kinds[col]]
+        if kinds[col] == 'categorical':
+            columns[col] = _merge_categorical(parts)
+        elif kinds[col] == 'numerical':
+            columns[col] = _merge_numerical(parts)
+        elif kinds[col] == 'temporal':
+            populated = [part for _, part in parts if part['non_null']]
+            columns[col] = {
+                'kind': 'temporal',
+                'non_null': sum(part['non_null'] for part in populated),
+                'min': min((part['min'] for part in populated), default=None),
+                'max': max((part['max'] for part in populated), default=None)
+            }
+        else:
+            columns[col] = {'kind': kinds[col], 'non_null': sum(part['non_null'] for _, part in parts)}
+
+    return {
+        'rows': sum(p['rows'] for p in partials),
+        'columns': columns,
+        'digest': merge_digest_partials([p['digest'] for p in partials])
+    }
+
+
+def profile_dataframe(df):
+    """Profile an in-memory dataframe (single-process mode)"""
+    return merge_profiles([profile_frame(df)])
+
+
+def documents_from_profile(profile, dataset_name):
+    """Build column-insight documents and metadata from a dataset profile"""
+    texts, metadatas = [], []
+    for col, stats in profile['columns'].items():
+        if stats['kind'] == 'categorical':
+            text = f"In {dataset_name}, column {col} shows: {dict(stats['top_values'])}"
+            meta_type = 'categorical_analysis'
+        elif stats['kind'] == 'numerical':
+            text = f"In {dataset_name}, {col} has mean {stats['mean']:.2f}, std {stats['std']:.2f}, range {stats['min']:.2f}-{stats['max']:.2f}"
+            meta_type = 'numerical_analysis'
+        elif stats['kind'] == 'temporal' and stats['non_null']:
+            text = f"In {dataset_name}, {col} spans {stats['min']:%Y-%m-%d} to {stats['max']:%Y-%m-%d} across {stats['non_null']} records"
+            meta_type = 'temporal_analysis'
+        else:
+            continue
+        texts.append(text)
+        metadatas.append({'type': meta_type, 'dataset': dataset_name, 'column': col})
+    return texts, metadatas
+
+
+# Keyword → role family, checked in order (first match wins); shared by transcript
+# metadata and persona job titles so retrieval can filter one by the other
+# Keywords are regex fragments matched as whole words (stems spell out their endings)
+ROLE_FAMILIES = [
+    ('executive', (r'chief', r'ceo', r'cfo', r'cto', r'ciso', r'vp', r'vice president', r'directors?', r'executives?',
+                   r'partners?')),
+    ('it_security', (r'security', r'it', r'network\w*', r'systems?', r'databases?', r'devops', r'infrastructure',
+                     r'help ?desk')),
+    ('finance', (r'financ\w*', r'accountants?', r'accounting', r'payroll', r'audit\w*', r'controllers?', r'credit',
+                 r'loans?', r'treasury')),
+    ('technical', (r'engineer\w*', r'developers?', r'software', r'data', r'analysts?', r'scientists?', r'architects?',
+                   r'programmers?')),
+    ('clinical', (r'nurs\w*', r'doctors?', r'physicians?', r'clinical', r'medical', r'pharmac\w*', r'therapists?')),
+    ('education', (r'teachers?', r'professors?', r'lecturers?', r'faculty', r'students?', r'research\w*')),
+    ('management', (r'managers?', r'supervisors?', r'lead(?:er|s)?', r'head of', r'coordinators?')),
+    ('administrative', (r'admin\w*', r'assistants?', r'clerks?', r'receptionists?', r'secretar\w*', r'office',
+                        r'hr', r'human resources')),
+    ('sales_marketing', (r'sales', r'marketing', r'accounts?', r'customers?', r'support', r'representatives?'))
+]
+ROLE_PATTERNS = [(family, re.compile(r'\b(?:' + '|'.join(keywords) + r')\b', re.IGNORECASE))
+                 for family, keywords in ROLE_FAMILIES]
+TRANSCRIPT_METADATA_MAX_LENGTH = 80
+
+
+def role_family(title):
+    """Coarse role family of a job title or transcript role (None when unknown)"""
+    text = str(title)
+    return next((family for family, pattern in ROLE_PATTERNS if pattern.search(text)), None)
+
+
+def age_band(age):
+    """Decade band such as '30s' (None when the age is not a number)"""
+    try:
+        return f"{int(float(age)) // 10 * 10}s"
+    except (TypeError, ValueError):
+        return None
+
+
+def transcript_documents(df, dataset_name, text_column='transcript_text', min_length=50):
+    """Transcript documents with their row's short fields as metadata.
+
+    Besides the raw columns (role, age, interview type, ...), each document gets
+    a role_family and age_band so persona-specific retrieval can filter on them.
+    """
+    texts = df[text_column].astype('string')
+    rows = df[texts.notna() & (texts.str.len() > min_length)]
+    metadata_columns = [
+        column for column in rows.columns
+        if column != text_column and rows[column].astype(str).str.len().max() <= TRANSCRIPT_METADATA_MAX_LENGTH
+    ]
+    metadatas = []
+    for row in rows[metadata_columns].to_dict('records'):
+        metadata = {'type': 'qualitative_transcript', 'dataset': dataset_name}
+        metadata.update({str(column).lower(): str(value) for column, value in row.items() if pd.notna(value)})
+        family = role_family(metadata.get('role', ''))
+        if family:
+            metadata['role_family'] = family
+        band = age_band(metadata.get('age'))
+        if band:
+            metadata['age_band'] = band
+        metadatas.append(metadata)
+    return rows[text_column].astype(str).tolist(), metadatas
+
+
+# ---------------------------------------------------------------------------
+# Shard planning and workers
+# ---------------------------------------------------------------------------
+
+def plan_csv_shards(path, shard_bytes=DEFAULT_SHARD_BYTES):
+    """Split a CSV into byte ranges that start on record boundaries.
+
+    A newline only ends a record when the number of quote characters before it is
+    even, so quoted multi-line fields (interview transcripts) are never split.
+    """
+    size = os.path.getsize(path)
+    boundaries = []
+    in_quotes = 0
+    next_target = None
+    offset = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(_READ_BLOCK_BYTES)
+            if not block:
+                break
+            pos = 0
+            while pos < len(block):
+                if next_target is not None and offset + pos < next_target:
+                    jump = min(len(block), next_target - offset)
+                    in_quotes ^= block.count(b'"', pos, jump) & 1
+                    pos = jump
+                    continue
+                newline = block.find(b'\n', pos)
+                if newline == -1:
+                    in_quotes ^= block.count(b'"', pos) & 1
+                    break
+                in_quotes ^= block.count(b'"', pos, newline) & 1
+                pos = newline + 1
+                if not in_quotes:
+                    boundaries.append(offset + pos)
+                    next_target = offset + pos + shard_bytes
+            offset += len(block)
+
+    if not boundaries:
+        return []
+    header_end = boundaries[0]
+    edges = boundaries + ([size] if boundaries[-1] < size else [])
+    return [
+        {'format': 'csv', 'path': path, 'header_end': header_end, 'start': start, 'end': end}
+        for start, end in zip(edges[:-1], edges[1:])
+    ]
+
+
+def plan_parquet_shards(path, shard_rows=DEFAULT_SHARD_ROWS):
+    """Group Parquet row groups into shards of roughly shard_rows rows"""
+    import pyarrow.parquet as pq
+    metadata = pq.ParquetFile(path).metadata
+    shards, groups, rows = [], [], 0
+    for i in range(metadata.num_row_groups):
+        groups.append(i)
+        rows += metadata.row_group(i).num_rows
+        if rows >= shard_rows:
+            shards.append({'format': 'parquet', 'path': path, 'row_groups': groups})
+            groups, rows = [], 0
+    if groups:
+        shards.append({'format': 'parquet', 'path': path, 'row_groups': groups})
+    return shards
+
+
+def read_shard(shard, text_columns=()):
+    """Load one shard as a dataframe with the same compact dtypes as a full read"""
+    if shard['format'] == 'parquet':
+        import pyarrow.parquet as pq
+        df = pq.ParquetFile(shard['path']).read_row_groups(shard['row_groups']).to_pandas()
+        for col in text_columns:
+            df[col] = df[col].astype('string').astype(object)
+        return apply_schema(df, text_columns=text_columns)
+    with open(shard['path'], 'rb') as f:
+        header = f.read(shard['header_end'])
+        f.seek(shard['start'])
+        body = f.read(shard['end'] - shard['start'])
+    return read_csv_typed(io.BytesIO(header + body), text_columns)
+
+
+def _profile_shard(index, shard, text_columns):
+    return index, profile_frame(read_shard(shard, text_columns))
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(max_workers=None):
+    """Return the process-wide worker pool (spawned, so it is safe next to Streamlit threads)"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=max_workers or os.cpu_count(),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _process_pool
+
+
+class ShardedIngestionEngine:
+    """Profile large CSV/Parquet files across a process pool"""
+
+    def __init__(self, max_workers=None, shard_bytes=DEFAULT_SHARD_BYTES, shard_rows=DEFAULT_SHARD_ROWS):
+        self.max_workers = max_workers
+        self.shard_bytes = shard_bytes
+        self.shard_rows = shard_rows
+
+    def plan(self, path):
+        """Split a file into shards"""
+        if str(path).lower().endswith('.parquet'):
+            return plan_parquet_shards(path, self.shard_rows)
+        return plan_csv_shards(path, self.shard_bytes)
+
+    def profile(self, path, progress_callback=None):
+        """Profile a file shard-by-shard and return the merged dataset profile"""
+        shards = self.plan(path)
+        if not shards:
+            raise ValueError("Empty data file")
+        partials = self._run(shards, (), progress_callback)
+        _, conflicts = resolve_column_kinds(partials)
+        if conflicts:
+            # Mixed numeric/text columns: re-read them as text everywhere, as a full read would
+            partials = self._run(shards, tuple(sorted(conflicts)), progress_callback)
+        return merge_profiles(partials)
+
+    def _run(self, shards, text_columns, progress_callback):
+        pool = get_process_pool(self.max_workers)
+        futures = [pool.submit(_profile_shard, i, shard, text_columns) for i, shard in enumerate(shards)]
+        partials = [None] * len(shards)
+        for done, future in enumerate(as_completed(futures), start=1):
+            index, partial = future.result()
+            partials[index] = partial
+            if progress_callback:
+                progress_callback(done, len(shards))
+        return partials
+
+
+def check_sharding(path, shard_bytes=None, max_workers=None):
+    """Profile a CSV in one process and across shards; return the documents that differ.
+
+    shard_bytes defaults to an eighth of the file, so even small files split into several shards.
+    """
+    name = os.path.basename(path)
+    shard_bytes = shard_bytes or max(os.path.getsize(path) // 8, 1024)
+    with open(path, 'rb') as f:
+        single = profile_dataframe(read_csv_typed(f))
+    sharded = ShardedIngestionEngine(max_workers, shard_bytes=shard_bytes).profile(path)
+    documents = []
+    for profile in (single, sharded):
+        texts, _ = documents_from_profile(profile, name)
+        documents.append(texts + [render_digest(profile['digest'], name)])
+    if len(documents[0]) != len(documents[1]):
+        return [f"{len(documents[0])} documents in one process, {len(documents[1])} sharded"]
+    return [f"one process: {a}\nsharded:     {b}" for a, b in zip(*documents) if a != b]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that sharded profiling matches single-process profiling")
+    parser.add_argument("paths", nargs='*', help="CSV files (default: the bundled datasets in data/)")
+    parser.add_argument("--shard-bytes", type=int, help="shard size (default: an eighth of each file)")
+    args = parser.parse_args(argv)
+    paths = args.paths or sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'data', '*.csv')))
+
+    failed = False
+    for path in paths:
+        differences = check_sharding(path, args.shard_bytes)
+        print(f"{'FAIL' if differences else 'ok'}   {os.path.basename(path)}", file=sys.stderr)
+        for difference in differences:
+            print(difference, file=sys.stderr)
+        failed = failed or bool(differences)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
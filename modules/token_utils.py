@@ -0,0 +1,46 @@
+"""
+Local token counting for prompt budgeting
+
+Uses tiktoken when it is installed; otherwise a word/punctuation estimate that
+slightly over-counts, so budgets stay safe for Llama-family tokenizers.
+"""
+
+import math
+import re
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text):
+    """Number of tokens in text"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    pieces = _TOKEN_PATTERN.findall(text)
+    # Long words split into several sub-word tokens
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in pieces)
+
+
+def truncate_to_tokens(text, budget):
+    """Cut text to at most budget tokens, preferring a whitespace boundary"""
+    if count_tokens(text) <= budget:
+        return text
+    if _ENCODING is not None:
+        return _ENCODING.decode(_ENCODING.encode(text, disallowed_special=())[:budget]).rstrip()
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    cut = text[:low]
+    space = cut.rfind(' ')
+    return (cut[:space] if space > len(cut) // 2 else cut).rstrip()